@@ -1,63 +1,394 @@
-import requests
-from PyQt5.QtCore import QThread, pyqtSignal
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+from metrics import RequestMetrics, connect_time, reset_connect_time
+from payload_builder import DEFAULT_BUILDER, compress_body
+from rate_limiter import QuotaStoreError
+from response_cache import make_cache_key
+from retry_policy import NO_RETRY, parse_retry_after
 
-class DeepseekThread(QThread):
-    """处理Deepseek API调用的线程"""
-    result_ready = pyqtSignal(str)
-    error_occurred = pyqtSignal(str)
+
+DEFAULT_API_URL = "https://api.deepseek.com/v1/chat/completions"
+
+
+class DeepseekClient:
+    """持有长连接会话的API客户端，多个请求线程共享同一个连接池，避免每次请求重新握手"""
     
-    def __init__(self, api_key, api_url, messages, model_name, use_proxy=False, proxy_url="", verify_ssl=True):
-        super().__init__()
-        self.api_key = api_key
+    def __init__(self, api_url, use_proxy=False, proxy_url="", verify_ssl=True, pool_size=10):
         self.api_url = api_url
-        self.messages = messages
-        self.model_name = model_name
-        self.use_proxy = use_proxy
-        self.proxy_url = proxy_url
+        self.proxy = proxy_url if use_proxy else ""  # 实际生效的代理地址
         self.verify_ssl = verify_ssl
         
-    def run(self):
+        # requests导入较慢，推迟到第一次发送请求时，窗口可以先显示出来
+        from http_transport import create_session
+        self.session = create_session(self.proxy, verify_ssl, pool_size)
+    
+    def matches(self, api_url, use_proxy, proxy_url, verify_ssl):
+        """判断当前会话是否仍适用于给定的连接设置"""
+        proxy = proxy_url if use_proxy else ""
+        return (self.api_url, self.proxy, self.verify_ssl) == (api_url, proxy, verify_ssl)
+    
+    def post(self, headers, body, stream=False):
+        """发送已编码的请求体（见DeepseekRequest.build_body）"""
+        # 流式模式下读取超时作用于每一个数据块，而不是整个响应体
+        return self.session.post(
+            self.api_url,
+            headers=headers,
+            data=body,
+            timeout=(10, 30),  # 保持当前超时设置
+            stream=stream
+        )
+    
+    def probe(self, timeout=5.0):
+        """发送轻量的GET请求测量往返延迟，返回 (秒数, 状态码)；连接失败时抛出requests的异常"""
+        started = time.perf_counter()
+        response = self.session.get(self.api_url, timeout=timeout)
+        response.close()
+        return time.perf_counter() - started, response.status_code
+    
+    def label(self):
+        """用于状态显示的简短名称"""
+        host = urlsplit(self.api_url).netloc or self.api_url
+        if self.proxy:
+            return f"{host}（经{urlsplit(self.proxy).netloc or self.proxy}）"
+        return host
+    
+    # 以下方法与EndpointPool的接口一致，单个端点时没有可切换的备用线路
+    
+    def candidates(self):
+        return [self]
+    
+    def record_success(self, client, latency=None):
+        pass
+    
+    def record_failure(self, client, reason):
+        pass
+    
+    def close(self):
+        self.session.close()
+
+
+class DeepseekError(Exception):
+    """API调用失败，异常信息即展示给用户的错误描述"""
+
+
+class RequestCancelled(DeepseekError):
+    def __init__(self):
+        super().__init__("请求已取消")
+
+
+class TransientError(DeepseekError):
+    """可重试的暂时性错误（超时、连接中断、429、5xx）"""
+    
+    def __init__(self, message, reason, retry_after=None):
+        super().__init__(message)
+        self.reason = reason  # 简短的失败原因，用于状态栏提示
+        self.retry_after = retry_after
+
+
+class DeepseekRequest:
+    """一次API调用的完整流程，不依赖Qt，可在任意工作线程中执行"""
+    
+    def __init__(self, api_key, messages, model_name, client, stream=False,
+                 temperature=0.7, max_tokens=2000, cache=None, retry_policy=None, metrics_recorder=None,
+                 rate_limiter=None, compress=False, payload_builder=None, speculative=False):
+        self.api_key = api_key
+        self.messages = messages
+        self.model_name = model_name
+        self.client = client
+        self.stream = stream
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.cache = cache  # 可选的ResponseCache
+        self.from_cache = False
+        self.retry_policy = retry_policy or NO_RETRY
+        self.attempts = 0  # 实际发送的次数
+        self.total_wait = 0.0  # 重试累计等待的秒数
+        self.rate_limiter = rate_limiter  # 可选的RateLimiter，每次发送前排队等待配额
+        self.compress = compress  # 是否用gzip压缩较大的请求体
+        self.payload_builder = payload_builder or DEFAULT_BUILDER
+        self.speculative = speculative  # 预发送的请求不等待限速配额
+        self.prefetched = False  # 由预发送转为正式请求
+        self.queue_wait = 0.0  # 等待限速配额的累计秒数
+        self.tokens_emitted = False  # 已输出增量后不能再重发，否则界面上的内容会重复
+        self.usage = None  # 响应中的usage字段
+        self.metrics = RequestMetrics(model_name, stream)
+        self.metrics_recorder = metrics_recorder  # 可选的MetricsRecorder
+        self.cancel_event = threading.Event()
+        self.finish_lock = threading.Lock()
+        self.response = None  # 正在读取的响应，取消时关闭以中断读取
+    
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+    
+    def cancel(self):
+        """请求取消；流式读取会立即中断，阻塞中的非流式请求在返回后丢弃结果"""
+        self.cancel_event.set()
+        response = self.response
+        if response is not None:
+            response.close()
+    
+    def promote(self, retry_policy):
+        """预发送的请求被用户采用，之后按普通请求处理：排队等待配额，按retry_policy重试"""
+        self.speculative = False
+        self.prefetched = True
+        self.retry_policy = retry_policy
+    
+    def execute(self, on_token=None, on_retry=None, on_queue=None):
+        """执行请求并返回完整回复，失败时抛出DeepseekError
+
+        on_retry(attempt, delay, reason) 在每次等待重发前调用，
+        on_queue(delay) 在因限速配额不足而排队等待前调用。
+        """
+        status = "error"
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": self.model_name,
-                "messages": self.messages,
-                "temperature": 0.7,
-                "max_tokens": 2000
-            }
-            
-            proxies = None
-            if self.use_proxy and self.proxy_url:
-                proxies = {
-                    "http": self.proxy_url,
-                    "https": self.proxy_url
-                }
-            
-            # 修改请求设置，增加超时时间和重试机制
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=data,
-                proxies=proxies,
-                verify=self.verify_ssl,
-                timeout=(10, 30)  # 保持当前超时设置
-            )
+            response_text = self.execute_cached(on_token, on_retry, on_queue)
+            status = "cache" if self.from_cache else "ok"
+            return response_text
+        except RequestCancelled:
+            status = "cancelled"
+            raise
+        finally:
+            self.finish(status)
+    
+    def execute_cached(self, on_token=None, on_retry=None, on_queue=None):
+        cached = self.lookup_cache(on_token)
+        if cached is not None:
+            return cached
+        response_text = self.request_with_retry(on_token, on_retry, on_queue)
+        self.store_cache(response_text)
+        return response_text
+    
+    # 以下方法不涉及具体的HTTP库，同步与异步后端共用
+    
+    def build_headers(self):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+    
+    def build_body(self):
+        """返回 (编码后的请求体, 请求头)
+
+        消息列表由PayloadBuilder增量序列化，同一前缀每次得到相同的字节，便于服务端的上下文缓存命中。
+        """
+        fields = {
+            "model": self.model_name,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens
+        }
+        if self.stream:
+            fields["stream"] = True
+        body = self.payload_builder.build(fields, self.messages)
+        headers = self.build_headers()
+        if self.compress:
+            body, extra_headers = compress_body(body)
+            headers.update(extra_headers)
+        return body, headers
+    
+    def cache_key(self):
+        return make_cache_key(self.model_name, self.messages, self.temperature, self.max_tokens)
+    
+    def lookup_cache(self, on_token=None):
+        """缓存命中时返回回复（流式模式下一次性回调全部文本），否则返回None"""
+        if self.cache is None:
+            return None
+        cached = self.cache.get(self.cache_key())
+        if cached is not None:
+            self.from_cache = True
+            if self.stream and on_token is not None:
+                on_token(cached)
+        return cached
+    
+    def store_cache(self, response_text):
+        if self.cache is not None and response_text:
+            self.cache.put(self.cache_key(), response_text)
+    
+    def reserve_quota(self):
+        """向限速器预约本次发送的配额，返回Reservation；未启用限速时返回None"""
+        if self.rate_limiter is None:
+            return None
+        tokens = self.rate_limiter.estimate_tokens(self.model_name, self.messages, self.max_tokens)
+        try:
+            if not self.speculative:
+                return self.rate_limiter.reserve(self.model_name, tokens)
+            reservation = self.rate_limiter.try_reserve(self.model_name, tokens)
+        except QuotaStoreError as e:
+            raise DeepseekError(f"限速配额预约失败: {e}") from e
+        if reservation is None:
+            raise DeepseekError("限速配额不足，放弃预发送")
+        return reservation
+    
+    def settle_quota(self, reservation):
+        """发送成功后按usage结算配额；没有usage时保留预约的估算值"""
+        if reservation is not None:
+            self.rate_limiter.settle(reservation, self.usage)
+    
+    def finish(self, status):
+        """记录本次请求的最终状态和指标，只记录一次
+
+        排队中被取消的请求由调度器代为记录，此时执行线程可能也刚好结束，以先记录的为准。
+        """
+        with self.finish_lock:
+            if self.metrics.status != "pending":
+                return
+            self.metrics.attempts = self.attempts
+            self.metrics.queue_wait = self.queue_wait
+            self.metrics.finish(status)
+        if self.metrics_recorder is not None:
+            self.metrics_recorder.record(self.metrics)
+    
+    def parse_result(self, result):
+        """解析非流式响应体，返回回复文本"""
+        self.usage = result.get('usage')
+        self.metrics.add_usage(self.usage)
+        return result.get('choices', [{}])[0].get('message', {}).get('content', '')
+    
+    def handle_stream_line(self, line, parts, on_token=None):
+        """处理一行SSE数据，把增量追加到parts并回调"""
+        self.metrics.response_bytes += len(line.encode('utf-8')) + 1
+        chunk = parse_sse_event(line)
+        if chunk is None or chunk is SSE_DONE:
+            return
+        if chunk.get('usage'):
+            # 最后一个数据块携带整个请求的token用量
+            self.usage = chunk['usage']
+            self.metrics.add_usage(self.usage)
+        delta = delta_content(chunk)
+        if not delta:
+            return
+        if not parts:
+            self.metrics.first_token = self.metrics.elapsed()
+        parts.append(delta)
+        self.tokens_emitted = True
+        if on_token is not None:
+            on_token(delta)
+    
+    def status_error(self, status_code, body, retry_after_header):
+        """把非200响应转换为异常，可重试的状态码返回TransientError"""
+        error_message = f"API错误: {status_code} - {body}"
+        if self.retry_policy.is_retryable_status(status_code):
+            return TransientError(error_message, f"HTTP {status_code}", parse_retry_after(retry_after_header))
+        return DeepseekError(error_message)
+    
+    def wait_for_quota(self, on_queue=None):
+        """预约配额并等待到可以发送，等待期间被取消时退还配额"""
+        reservation = self.reserve_quota()
+        if reservation is not None and reservation.delay > 0:
+            if on_queue is not None:
+                on_queue(reservation.delay)
+            if self.cancel_event.wait(reservation.delay):
+                self.rate_limiter.cancel(reservation)
+                raise RequestCancelled()
+            self.queue_wait += reservation.delay
+        return reservation
+    
+    def request_with_retry(self, on_token=None, on_retry=None, on_queue=None):
+        """按重试策略重发同一组messages，直到成功、遇到不可重试的错误或次数用尽"""
+        while True:
+            reservation = self.wait_for_quota(on_queue)
+            self.attempts += 1
+            try:
+                response_text = self.request_remote(on_token)
+                self.settle_quota(reservation)
+                return response_text
+            except TransientError as e:
+                if self.tokens_emitted or self.attempts >= self.retry_policy.max_attempts:
+                    raise
+                delay = self.retry_policy.compute_delay(self.attempts, e.retry_after)
+                if on_retry is not None:
+                    on_retry(self.attempts, delay, e.reason)
+                if self.cancel_event.wait(delay):
+                    raise RequestCancelled() from e
+                self.total_wait += delay
+    
+    def request_remote(self, on_token=None):
+        import requests  # 创建客户端时已加载，这里只是取得模块引用
+        try:
+            if self.cancelled:
+                raise RequestCancelled()
+            # 复用共享会话中的连接，代理与SSL设置由客户端统一管理
+            reset_connect_time()
+            body, headers = self.build_body()
+            response = self.client.post(headers, body, stream=self.stream)
+            self.metrics.connect_time = connect_time()
+            self.metrics.ttfb = response.elapsed.total_seconds()
+            self.metrics.request_bytes = len(body)
             
             # 将响应处理移到try块内部
             if response.status_code == 200:
-                result = response.json()
-                response_text = result.get('choices', [{}])[0].get('message', {}).get('content', '')
-                self.result_ready.emit(response_text)
-            else:
-                error_message = f"API错误: {response.status_code} - {response.text}"
-                self.error_occurred.emit(error_message)
+                if self.stream:
+                    response_text = self.read_stream(response, on_token)
+                else:
+                    self.metrics.response_bytes = len(response.content)
+                    response_text = self.parse_result(response.json())
+                if self.cancelled:
+                    raise RequestCancelled()
+                return response_text
+            raise self.status_error(response.status_code, response.text, response.headers.get("Retry-After"))
                 
+        except DeepseekError:
+            raise
         except requests.exceptions.Timeout as e:
             error_type = "连接超时" if isinstance(e, requests.ConnectTimeout) else "读取超时"
-            self.error_occurred.emit(f"网络超时 ({error_type}): 请检查代理设置或尝试重新发送")
+            raise TransientError(f"网络超时 ({error_type}): 请检查代理设置或尝试重新发送", error_type) from e
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            if self.cancelled:
+                raise RequestCancelled() from e
+            raise TransientError(f"发生错误: {str(e)}", "连接错误") from e
         except Exception as e:
-            self.error_occurred.emit(f"发生错误: {str(e)}")
\ No newline at end of file
+            if self.cancelled:
+                raise RequestCancelled() from e
+            raise DeepseekError(f"发生错误: {str(e)}") from e
+
+    def read_stream(self, response, on_token=None):
+        """逐块读取SSE响应，回调增量文本并返回完整回复"""
+        parts = []
+        self.response = response
+        try:
+            # SSE响应通常不带charset，按字节读取后统一用UTF-8解码
+            # 读到[DONE]后继续读完剩余数据，使连接能够归还到连接池
+            for raw_line in response.iter_lines():
+                if self.cancelled:
+                    raise RequestCancelled()
+                self.handle_stream_line(raw_line.decode('utf-8'), parts, on_token)
+        finally:
+            self.response = None
+            response.close()
+        return "".join(parts)
+
+
+SSE_DONE = object()  # 流结束标记（对应 "data: [DONE]"）
+
+
+def parse_sse_event(line):
+    """解析一行SSE数据，返回数据块字典；流结束时返回SSE_DONE，非数据行返回None"""
+    if not line or not line.startswith("data:"):
+        return None
+    payload = line[len("data:"):].strip()
+    if payload == "[DONE]":
+        return SSE_DONE
+    return json.loads(payload)
+
+
+def delta_content(chunk):
+    choices = chunk.get('choices') or [{}]
+    return choices[0].get('delta', {}).get('content') or None
+
+
+def parse_sse_line(line):
+    """解析一行SSE数据，返回增量文本；流结束时返回SSE_DONE，无内容时返回None"""
+    chunk = parse_sse_event(line)
+    if chunk is None or chunk is SSE_DONE:
+        return chunk
+    return delta_content(chunk)
+
+
+def __getattr__(name):
+    # DeepseekThread依赖Qt，已移到request_scheduler；按需导入，命令行和服务端使用本模块时不会加载PyQt
+    if name == "DeepseekThread":
+        from request_scheduler import DeepseekThread
+        return DeepseekThread
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
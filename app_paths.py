@@ -0,0 +1,18 @@
+"""应用数据目录（缓存、对话记录等本地文件的存放位置）"""
+import os
+
+APP_DIR_NAME = "DeepseekEasyApp"
+
+
+def data_dir():
+    """返回应用数据目录，不存在时自动创建；可通过环境变量 DEEPSEEK_APP_DATA 指定"""
+    path = os.environ.get("DEEPSEEK_APP_DATA")
+    if not path:
+        base = os.environ.get("APPDATA") or os.path.join(os.path.expanduser("~"), ".local", "share")
+        path = os.path.join(base, APP_DIR_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def data_path(filename):
+    return os.path.join(data_dir(), filename)
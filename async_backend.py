@@ -0,0 +1,238 @@
+"""asyncio执行后端：所有请求在同一个后台事件循环中运行，使用httpx异步客户端和连接池
+
+与线程池后端相比，大量并发请求只占用一个线程，取消请求会立即中断正在等待的网络读取。
+httpx是可选依赖（pip install httpx），只有选择该后端时才会导入。
+"""
+import asyncio
+import threading
+import time
+
+from api_client import DeepseekError, RequestCancelled, TransientError
+from endpoint_pool import GATEWAY_ERRORS
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - 取决于运行环境
+    httpx = None
+
+
+class AsyncClients:
+    """按连接设置复用httpx.AsyncClient，可直接作为execute_async的client_for参数"""
+
+    def __init__(self):
+        if httpx is None:
+            raise DeepseekError("asyncio后端需要安装httpx：pip install httpx")
+        self.clients = {}  # (api_url, proxy, verify_ssl) -> httpx.AsyncClient
+
+    def __call__(self, endpoint):
+        """返回用于该端点（DeepseekClient）的客户端，设置与同步客户端保持一致"""
+        key = (endpoint.api_url, endpoint.proxy, endpoint.verify_ssl)
+        client = self.clients.get(key)
+        if client is None:
+            client = httpx.AsyncClient(
+                proxy=endpoint.proxy or None,
+                verify=endpoint.verify_ssl,
+                timeout=httpx.Timeout(30.0, connect=10.0),  # 与同步客户端相同的超时设置
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=64)
+            )
+            self.clients[key] = client
+        return client
+
+    async def aclose(self):
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients = {}
+
+
+class AsyncioBackend:
+    def __init__(self, signals, max_concurrency):
+        self.clients = AsyncClients()
+        self.signals = signals
+        self.max_concurrency = max_concurrency
+        self.semaphore = None  # 在事件循环线程中创建
+        self.futures = {}  # 请求id -> (concurrent.futures.Future, DeepseekRequest)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="deepseek-asyncio", daemon=True)
+        self.thread.start()
+
+    def start(self, request_id, request):
+        future = asyncio.run_coroutine_threadsafe(self._run(request_id, request), self.loop)
+        self.futures[request_id] = (future, request)
+        future.add_done_callback(lambda f: self._report(request_id, request, f))
+
+    def cancel(self, request_id):
+        """取消对应的协程，结果由_report统一投递，因此总是返回False"""
+        entry = self.futures.get(request_id)
+        if entry is not None:
+            future, request = entry
+            request.cancel()
+            future.cancel()
+        return False
+
+    def discard(self, request_id):
+        self.futures.pop(request_id, None)
+
+    def set_max_concurrency(self, value):
+        # 已在等待旧信号量的请求保持原上限，之后的请求使用新上限
+        self.max_concurrency = value
+        self.loop.call_soon_threadsafe(self._reset_semaphore)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.clients.aclose(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _reset_semaphore(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def _report(self, request_id, request, future):
+        if future.cancelled():
+            # 还在等待并发名额时被取消的请求不会执行execute_async，在这里记录；已在执行的以先记录的为准
+            request.finish("cancelled")
+            self.signals.done.emit(request_id, False, str(RequestCancelled()))
+            return
+        error = future.exception()
+        if error is None:
+            self.signals.done.emit(request_id, True, future.result())
+        elif isinstance(error, DeepseekError):
+            self.signals.done.emit(request_id, False, str(error))
+        else:
+            self.signals.done.emit(request_id, False, f"发生错误: {str(error)}")
+
+    async def _run(self, request_id, request):
+        if self.semaphore is None:
+            self._reset_semaphore()
+        async with self.semaphore:
+            return await execute_async(
+                request,
+                self.clients,
+                lambda delta: self.signals.token.emit(request_id, delta),
+                lambda attempt, delay, reason: self.signals.retry.emit(request_id, attempt, delay, reason),
+                lambda delay: self.signals.queued.emit(request_id, delay)
+            )
+
+
+async def execute_async(request, client_for, on_token=None, on_retry=None, on_queue=None):
+    """DeepseekRequest.execute 的异步版本，缓存、重试策略和指标与同步版本共用
+
+    client_for(endpoint) 返回用于该端点（DeepseekClient）的httpx.AsyncClient。
+    """
+    status = "error"
+    try:
+        cached = request.lookup_cache(on_token)
+        if cached is not None:
+            status = "cache"
+            return cached
+        response_text = await _request_with_retry(request, client_for, on_token, on_retry, on_queue)
+        request.store_cache(response_text)
+        status = "ok"
+        return response_text
+    except (asyncio.CancelledError, RequestCancelled):
+        status = "cancelled"
+        raise
+    finally:
+        request.finish(status)
+
+
+async def _wait_for_quota(request, on_queue):
+    """DeepseekRequest.wait_for_quota 的异步版本"""
+    reservation = request.reserve_quota()
+    if reservation is not None and reservation.delay > 0:
+        if on_queue is not None:
+            on_queue(reservation.delay)
+        try:
+            await asyncio.sleep(reservation.delay)
+        except asyncio.CancelledError:
+            request.rate_limiter.cancel(reservation)
+            raise
+        request.queue_wait += reservation.delay
+    return reservation
+
+
+async def _request_with_retry(request, client_for, on_token, on_retry, on_queue):
+    while True:
+        reservation = await _wait_for_quota(request, on_queue)
+        request.attempts += 1
+        try:
+            response_text = await _request_remote(request, client_for, on_token)
+            request.settle_quota(reservation)
+            return response_text
+        except TransientError as e:
+            if request.tokens_emitted or request.attempts >= request.retry_policy.max_attempts:
+                raise
+            delay = request.retry_policy.compute_delay(request.attempts, e.retry_after)
+            if on_retry is not None:
+                on_retry(request.attempts, delay, e.reason)
+            await asyncio.sleep(delay)
+            request.total_wait += delay
+
+
+class _EndpointFailed(Exception):
+    """当前端点连接失败或返回网关错误，可以换下一个端点重发"""
+
+    def __init__(self, reason, error):
+        super().__init__(reason)
+        self.reason = reason
+        self.error = error  # 没有其他端点可换时抛出的TransientError
+
+
+async def _request_remote(request, client_for, on_token):
+    """依次尝试请求的客户端给出的端点，与EndpointPool.post的切换规则相同"""
+    if request.cancelled:
+        raise RequestCancelled()
+    pool = request.client
+    endpoints = pool.candidates()
+    for index, endpoint in enumerate(endpoints):
+        try:
+            return await _request_endpoint(request, endpoint, client_for(endpoint), on_token,
+                                           index + 1 < len(endpoints))
+        except _EndpointFailed as e:
+            pool.record_failure(endpoint, e.reason)
+            if index + 1 == len(endpoints):
+                raise e.error from e
+
+
+async def _request_endpoint(request, endpoint, client, on_token, has_next):
+    body, headers = request.build_body()
+    http_request = client.build_request("POST", endpoint.api_url, headers=headers, content=body)
+    request.metrics.request_bytes = len(body)
+    started = time.perf_counter()
+    try:
+        response = await client.send(http_request, stream=True)
+        try:
+            request.metrics.ttfb = time.perf_counter() - started
+            if response.status_code in GATEWAY_ERRORS and has_next:
+                raise _EndpointFailed(f"HTTP {response.status_code}", None)
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", errors="replace")
+                error = request.status_error(response.status_code, body, response.headers.get("Retry-After"))
+                if response.status_code in GATEWAY_ERRORS:
+                    raise _EndpointFailed(f"HTTP {response.status_code}", error)
+                raise error
+            request.client.record_success(endpoint)
+            if request.stream:
+                parts = []
+                async for line in response.aiter_lines():
+                    request.handle_stream_line(line, parts, on_token)
+                return "".join(parts)
+            body = await response.aread()
+            request.metrics.response_bytes = len(body)
+            return request.parse_result(response.json())
+        finally:
+            await response.aclose()
+    except (DeepseekError, _EndpointFailed):
+        raise
+    except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ProxyError) as e:
+        # 连接阶段的失败，服务端没有收到请求，可以换一条线路重发
+        if isinstance(e, httpx.ConnectTimeout):
+            error = TransientError("网络超时 (连接超时): 请检查代理设置或尝试重新发送", "连接超时")
+        else:
+            error = TransientError(f"发生错误: {str(e)}", "连接错误")
+        raise _EndpointFailed(f"{type(e).__name__}: {str(e)[:120]}", error) from e
+    except httpx.TimeoutException as e:
+        # 读取超时说明服务端可能已在处理，交给重试策略决定是否重发
+        request.client.record_failure(endpoint, type(e).__name__)
+        raise TransientError("网络超时 (读取超时): 请检查代理设置或尝试重新发送", "读取超时") from e
+    except httpx.TransportError as e:
+        raise TransientError(f"发生错误: {str(e)}", "连接错误") from e
+    except ValueError as e:
+        raise DeepseekError(f"发生错误: {str(e)}") from e
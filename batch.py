@@ -0,0 +1,177 @@
+"""批量模式：从文件读取提示词，并发发送到Deepseek，结果逐条写入JSONL文件
+
+用法示例：
+    python batch.py prompts.txt -o results.jsonl --system-prompt "你是一个专业翻译助手" --concurrency 8
+中断后使用相同参数重新运行，已成功的id会被跳过。
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from api_client import DEFAULT_API_URL, DeepseekError, DeepseekRequest
+from endpoint_pool import create_client, parse_routes
+from payload_builder import UNCACHED_BUILDER
+from rate_limiter import RateLimiter, SharedBucketStore
+from response_cache import ResponseCache
+from retry_policy import RetryPolicy
+
+
+def load_prompts(path):
+    """读取提示词文件，返回 [(id, prompt, system_prompt或None)]
+
+    支持三种格式：
+    - .jsonl：每行一个对象，包含prompt字段，可选id和system字段
+    - .csv：表头包含prompt列，可选id和system列
+    - 其他：纯文本，每个非空行是一条提示词，id为行号
+    """
+    ext = os.path.splitext(path)[1].lower()
+    items = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if ext == ".jsonl":
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                items.append((str(record.get("id", line_no)), record["prompt"], record.get("system")))
+        elif ext == ".csv":
+            for row_no, row in enumerate(csv.DictReader(f), 1):
+                items.append((str(row.get("id") or row_no), row["prompt"], row.get("system") or None))
+        else:
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    items.append((str(line_no), line.strip(), None))
+    return items
+
+
+def load_finished_ids(path):
+    """读取已有输出文件中成功完成的id，用于断点续跑"""
+    finished = set()
+    if not os.path.exists(path):
+        return finished
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 中断时可能留下不完整的最后一行
+            if "response" in record:
+                finished.add(str(record["id"]))
+    return finished
+
+
+def run_batch(items, output_path, api_key, model_name, client, system_prompt="",
+              concurrency=4, rate_limiter=None, cache=None, retry_policy=None, log=print, compress=False):
+    """并发执行批量请求，结果完成一条写入一条；返回 (成功数, 失败数)"""
+    write_lock = threading.Lock()
+    running = set()
+    stopping = threading.Event()
+    counts = {"ok": 0, "error": 0}
+
+    def work(item_id, prompt, item_system):
+        if stopping.is_set():
+            return None
+        messages = []
+        if item_system or system_prompt:
+            messages.append({"role": "system", "content": item_system or system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        request = DeepseekRequest(api_key, messages, model_name, client, cache=cache, retry_policy=retry_policy,
+                                  rate_limiter=rate_limiter, compress=compress, payload_builder=UNCACHED_BUILDER)
+        running.add(request)
+        started = time.monotonic()
+        record = {"id": item_id, "prompt": prompt, "model": model_name}
+        try:
+            record["response"] = request.execute()
+        except DeepseekError as e:
+            record["error"] = str(e)
+        except Exception as e:
+            # 缓存、限速存储等出错同样只记为该条失败，其余条目继续，续跑时重新发送
+            record["error"] = f"发生错误: {e}"
+        finally:
+            running.discard(request)
+        record["elapsed"] = round(time.monotonic() - started, 3)
+        record["attempts"] = request.attempts
+        return record
+
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(work, *item) for item in items]
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                if record is None:
+                    continue
+                with write_lock:
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                status = "ok" if "response" in record else "error"
+                counts[status] += 1
+                log(f"[{done}/{len(items)}] {record['id']}: {status} ({record['elapsed']}s)")
+        except KeyboardInterrupt:
+            # 停止尚未开始的请求，中断正在读取的请求，已写入的结果保留用于续跑
+            stopping.set()
+            for future in futures:
+                future.cancel()
+            for request in list(running):
+                request.cancel()
+            log("已中断，重新运行相同命令可从断点继续")
+            raise
+    return counts["ok"], counts["error"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量发送提示词到Deepseek，结果写入JSONL文件")
+    parser.add_argument("input", help="提示词文件（.txt/.jsonl/.csv）")
+    parser.add_argument("-o", "--output", required=True, help="结果输出文件（JSONL，追加写入）")
+    parser.add_argument("--api-key", default=os.environ.get("DEEPSEEK_API_KEY", ""),
+                        help="API密钥，默认读取环境变量 DEEPSEEK_API_KEY")
+    parser.add_argument("--api-url", default=DEFAULT_API_URL, help="多个URL用逗号分隔，连接失败时自动切换")
+    parser.add_argument("--model", default="deepseek-chat")
+    parser.add_argument("--system-prompt", default="", help="系统提示词")
+    parser.add_argument("--system-prompt-file", help="从文件读取系统提示词")
+    parser.add_argument("--concurrency", type=int, default=4, help="并发请求数")
+    parser.add_argument("--rpm", type=int, default=0, help="每分钟最多发起的请求数，0表示不限制")
+    parser.add_argument("--tpm", type=int, default=0, help="每分钟最多消耗的token数，0表示不限制")
+    parser.add_argument("--shared-quota", action="store_true", help="与本机同时运行的其他实例（包括图形界面）共享RPM/TPM配额")
+    parser.add_argument("--retries", type=int, default=2, help="超时、429、5xx等暂时性错误的重试次数")
+    parser.add_argument("--cache", action="store_true", help="启用回复缓存，重复的提示词不再请求API")
+    parser.add_argument("--proxy", default="", help="代理URL，多个用逗号分隔，direct表示直连")
+    parser.add_argument("--no-verify-ssl", action="store_true", help="不验证SSL证书")
+    parser.add_argument("--gzip", action="store_true", help="用gzip压缩较大的请求体（需要服务端支持）")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("请通过 --api-key 或环境变量 DEEPSEEK_API_KEY 提供API密钥")
+    system_prompt = args.system_prompt
+    if args.system_prompt_file:
+        with open(args.system_prompt_file, encoding="utf-8") as f:
+            system_prompt = f.read().strip()
+
+    items = load_prompts(args.input)
+    finished = load_finished_ids(args.output)
+    pending = [item for item in items if item[0] not in finished]
+    log = lambda message: print(message, file=sys.stderr)
+    log(f"共{len(items)}条，已完成{len(items) - len(pending)}条，待处理{len(pending)}条")
+
+    routes = parse_routes(args.api_url, bool(args.proxy), args.proxy)
+    if not routes:
+        parser.error("请提供API URL")
+    client = create_client(routes, not args.no_verify_ssl, pool_size=max(10, args.concurrency))
+    rate_limiter = RateLimiter(SharedBucketStore() if args.shared_quota else None)
+    rate_limiter.set_limit(args.model, args.rpm, args.tpm)
+    try:
+        ok, failed = run_batch(pending, args.output, args.api_key, args.model, client, system_prompt,
+                               args.concurrency, rate_limiter, ResponseCache() if args.cache else None,
+                               RetryPolicy(max_attempts=args.retries + 1), log, args.gzip)
+    except KeyboardInterrupt:
+        return 130
+    log(f"完成：成功{ok}条，失败{failed}条")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
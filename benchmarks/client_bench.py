@@ -0,0 +1,145 @@
+"""客户端基准：用本地模拟服务压测请求执行路径（DeepseekRequest，线程池或asyncio后端）
+
+报告吞吐量、延迟分位数、首字节/首个增量时间和重试次数，不消耗真实的API额度。
+
+    python benchmarks/client_bench.py                              # 运行全部场景
+    python benchmarks/client_bench.py --scenario stream -n 500 -c 32 --backend asyncio
+    python benchmarks/client_bench.py --json results.json          # 保存结果，便于比较修改前后
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api_client import DeepseekClient, DeepseekError, DeepseekRequest  # noqa: E402
+from metrics import MetricsRecorder, percentile  # noqa: E402
+from retry_policy import RetryPolicy  # noqa: E402
+from mock_server import MockConfig, start_server  # noqa: E402
+
+# 场景名 -> (模拟服务配置, 是否流式, 最大尝试次数)
+SCENARIOS = {
+    "nonstream": (dict(latency=0.05, reply_chars=200), False, 1),
+    "stream": (dict(latency=0.05, reply_chars=400, chunk_chars=4, chunk_rate=500), True, 1),
+    "large": (dict(latency=0.05, reply_chars=200000, chunk_chars=64, chunk_rate=0), True, 1),
+    "errors": (dict(latency=0.02, reply_chars=200, error_rate=0.2, retry_after=0.05), False, 4),
+}
+
+
+def make_request(client, index, stream, max_attempts, recorder):
+    messages = [{"role": "user", "content": f"第{index}个基准请求"}]
+    # 退避等待缩短到毫秒级，只衡量重试流程本身的开销
+    policy = RetryPolicy(max_attempts=max_attempts, base_delay=0.01, max_delay=0.05)
+    return DeepseekRequest("bench-key", messages, "deepseek-chat", client, stream=stream,
+                           retry_policy=policy, metrics_recorder=recorder)
+
+
+def run_threads(make, count, concurrency):
+    def execute(index):
+        try:
+            make(index).execute(lambda delta: None)
+        except DeepseekError:
+            pass
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(execute, range(count)))
+
+
+def run_asyncio(make, count, concurrency):
+    import httpx
+    from async_backend import execute_async
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+        async with httpx.AsyncClient(timeout=httpx.Timeout(30.0, connect=10.0),
+                                     limits=httpx.Limits(max_connections=None)) as client:
+            async def execute(index):
+                async with semaphore:
+                    try:
+                        await execute_async(make(index), lambda endpoint: client, lambda delta: None)
+                    except DeepseekError:
+                        pass
+            await asyncio.gather(*(execute(index) for index in range(count)))
+    asyncio.run(main())
+
+
+def run_scenario(name, count, concurrency, backend):
+    config, stream, max_attempts = SCENARIOS[name]
+    server = start_server(MockConfig(seed=0, **config))
+    client = DeepseekClient(server.url, pool_size=concurrency)
+    recorder = MetricsRecorder(capacity=count)
+
+    # 在轮到执行时才创建请求，延迟统计不包含排队时间
+    def make(index):
+        return make_request(client, index, stream, max_attempts, recorder)
+    started = time.perf_counter()
+    try:
+        if backend == "asyncio":
+            run_asyncio(make, count, concurrency)
+        else:
+            run_threads(make, count, concurrency)
+        wall = time.perf_counter() - started
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+    records = recorder.snapshot()
+    totals = [m.total for m in records if m.status == "ok"]
+    first = [m.first_token if stream else m.ttfb for m in records if m.status == "ok"]
+    tokens = sum(m.completion_tokens or 0 for m in records if m.status == "ok")
+    return {
+        "scenario": name,
+        "backend": backend,
+        "requests": count,
+        "concurrency": concurrency,
+        "ok": len(totals),
+        "errors": sum(1 for m in records if m.status == "error"),
+        "retries": sum(max(m.attempts - 1, 0) for m in records),
+        "connections": server.stats.connections,
+        "wall_seconds": wall,
+        "requests_per_second": count / wall,
+        "tokens_per_second": tokens / wall,
+        "latency_p50": percentile(totals, 0.5),
+        "latency_p95": percentile(totals, 0.95),
+        "latency_p99": percentile(totals, 0.99),
+        "first_byte_p50": percentile([value for value in first if value is not None], 0.5),
+    }
+
+
+def format_result(result):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.1f}ms"
+    return (f"{result['scenario']:<10} {result['backend']:<7} "
+            f"成功 {result['ok']}/{result['requests']}  重试 {result['retries']}  连接 {result['connections']}  "
+            f"{result['requests_per_second']:.1f} req/s  {result['tokens_per_second']:.0f} tokens/s  "
+            f"p50 {ms(result['latency_p50'])}  p95 {ms(result['latency_p95'])}  p99 {ms(result['latency_p99'])}  "
+            f"首字节 p50 {ms(result['first_byte_p50'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用本地模拟服务压测API客户端")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="可重复指定，默认全部")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="每个场景的请求数")
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("--backend", choices=["thread", "asyncio"], default="thread")
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        result = run_scenario(name, args.requests, args.concurrency, args.backend)
+        print(format_result(result))
+        results.append(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
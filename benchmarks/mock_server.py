@@ -0,0 +1,223 @@
+"""本地模拟的DeepSeek（OpenAI兼容）chat/completions服务，用于离线基准测试和压测
+
+可以配置响应延迟、流式输出速度、回复长度，并按比例注入429/5xx错误。
+支持gzip压缩的请求体，并模拟服务端的前缀缓存：与之前请求的消息前缀相同的部分计入prompt_cache_hit_tokens。
+既可以在基准脚本中用 start_server() 启动，也可以单独运行后把界面的API URL指向它：
+
+    python benchmarks/mock_server.py --port 8765 --latency 0.3 --chunk-rate 40 --error-rate 0.1
+    # API URL填写 http://127.0.0.1:8765/v1/chat/completions
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockConfig:
+    def __init__(self, latency=0.05, chunk_rate=200.0, chunk_chars=4, reply_chars=200,
+                 error_rate=0.0, error_statuses=(429, 503), retry_after=None, seed=None):
+        self.latency = latency  # 收到请求到返回响应头（非流式为完整响应）的秒数
+        self.chunk_rate = chunk_rate  # 流式输出每秒发送的数据块数，0表示不限速
+        self.chunk_chars = chunk_chars  # 每个数据块包含的字符数
+        self.reply_chars = reply_chars  # 回复长度，调大即可模拟大响应
+        self.error_rate = error_rate  # 以该概率返回error_statuses中的错误
+        self.error_statuses = tuple(error_statuses)
+        self.retry_after = retry_after  # 429响应附带的Retry-After秒数
+        self.random = random.Random(seed)
+
+
+class MockStats:
+    """服务端计数，基准结束后可与客户端的统计互相印证"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.request_bytes = 0
+        self.connections = 0
+        self.prefixes = set()  # 见过的消息前缀摘要，模拟服务端的上下文缓存
+
+    def add(self, field, value=1):
+        with self.lock:
+            setattr(self, field, getattr(self, field) + value)
+
+
+def make_reply(prompt, length):
+    """生成指定长度的中英混合回复，内容与请求相关以便核对"""
+    seed = "模拟回复：" + (prompt[:20] or "空") + "。The quick brown fox jumps over the lazy dog. 数据块"
+    return (seed * (length // len(seed) + 1))[:length]
+
+
+def estimate_prompt_tokens(messages):
+    return max(1, sum(len(m.get("content", "")) for m in messages) // 2)
+
+
+def cached_prompt_tokens(messages, stats):
+    """按整条消息模拟前缀缓存：返回与之前请求相同的最长消息前缀的token数，并记住本次的各级前缀"""
+    digest = hashlib.sha1()
+    hit = 0
+    cached = True
+    with stats.lock:
+        for index, message in enumerate(messages):
+            digest.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+            key = digest.hexdigest()
+            if cached and key in stats.prefixes:
+                hit = index + 1
+            else:
+                cached = False
+                stats.prefixes.add(key)
+    return estimate_prompt_tokens(messages[:hit]) if hit else 0
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 支持长连接，才能测出连接复用的效果
+
+    def setup(self):
+        super().setup()
+        # 关闭Nagle算法，否则小数据块会被攒批，流式延迟失真约40ms
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.stats.add("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        config = self.server.config
+        stats = self.server.stats
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        stats.add("requests")
+        stats.add("request_bytes", len(body))
+        if config.latency:
+            time.sleep(config.latency)
+        if config.error_rate and config.random.random() < config.error_rate:
+            stats.add("errors")
+            self.send_error_status(config.random.choice(config.error_statuses))
+            return
+        try:
+            if self.headers.get("Content-Encoding", "").lower() == "gzip":
+                body = gzip.decompress(body)
+            data = json.loads(body)
+        except (OSError, ValueError):
+            self.send_json(400, {"error": {"message": "请求体不是合法的JSON"}})
+            return
+        messages = data.get("messages") or [{}]
+        text = make_reply(messages[-1].get("content", ""), config.reply_chars)
+        prompt_tokens = estimate_prompt_tokens(messages)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": max(1, len(text) // 2),
+            "total_tokens": prompt_tokens + max(1, len(text) // 2),
+            "prompt_cache_hit_tokens": cached_prompt_tokens(messages, stats),
+        }
+        if data.get("stream"):
+            self.send_stream(text, usage, config)
+        else:
+            self.send_json(200, {
+                "model": data.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+    def do_GET(self):
+        """模型列表，也用作多端点的健康探测；同样按比例注入错误"""
+        config = self.server.config
+        if config.error_rate and config.random.random() < config.error_rate:
+            self.server.stats.add("errors")
+            self.send_error_status(config.random.choice(config.error_statuses))
+            return
+        self.send_json(200, {"object": "list", "data": [{"id": "deepseek-chat", "object": "model"}]})
+
+    def send_error_status(self, status):
+        extra = {}
+        if status == 429 and self.server.config.retry_after is not None:
+            extra["Retry-After"] = str(self.server.config.retry_after)
+        self.send_json(status, {"error": {"message": f"模拟错误 {status}"}}, extra)
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, text, usage, config):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1.0 / config.chunk_rate if config.chunk_rate else 0.0
+        for start in range(0, len(text), config.chunk_chars):
+            delta = {"choices": [{"index": 0, "delta": {"content": text[start:start + config.chunk_chars]}}]}
+            self.write_event(json.dumps(delta, ensure_ascii=False))
+            if interval:
+                time.sleep(interval)
+        self.write_event(json.dumps({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}))
+        self.write_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def write_event(self, data):
+        payload = f"data: {data}\n\n".encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+        self.wfile.flush()
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.stats = MockStats()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+
+def start_server(config=None, port=0):
+    """在后台线程中启动模拟服务并返回它，结束时调用 shutdown()"""
+    server = MockServer(("127.0.0.1", port), config or MockConfig())
+    threading.Thread(target=server.serve_forever, name="mock-deepseek", daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地模拟DeepSeek chat/completions服务")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="响应延迟（秒）")
+    parser.add_argument("--chunk-rate", type=float, default=200.0, help="流式输出每秒数据块数，0为不限速")
+    parser.add_argument("--chunk-chars", type=int, default=4, help="每个数据块的字符数")
+    parser.add_argument("--reply-chars", type=int, default=200, help="回复长度")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的概率")
+    parser.add_argument("--error-status", type=int, action="append", help="注入的状态码，可重复指定，默认429和503")
+    parser.add_argument("--retry-after", type=float, help="429响应的Retry-After秒数")
+    args = parser.parse_args(argv)
+    config = MockConfig(
+        latency=args.latency, chunk_rate=args.chunk_rate, chunk_chars=args.chunk_chars,
+        reply_chars=args.reply_chars, error_rate=args.error_rate,
+        error_statuses=args.error_status or (429, 503), retry_after=args.retry_after
+    )
+    server = MockServer(("127.0.0.1", args.port), config)
+    print(f"模拟服务已启动: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""启动耗时基准：测量从启动进程到主窗口首次绘制的时间，以及各模块的导入耗时
+
+用法：
+    python benchmarks/startup.py                 # 冷启动5次，输出首次绘制耗时
+    python benchmarks/startup.py --importtime    # 同时列出导入最慢的模块（python -X importtime）
+    python benchmarks/startup.py --max-ms 800    # 首次绘制中位数超过阈值时以非0状态退出，用于发现回退
+    python benchmarks/startup.py --headless --max-ms 300   # 命令行/中转模式：导入cli并创建服务的耗时
+
+首次绘制时如果已经导入了网络相关模块（requests等），同样视为回退；命令行模式导入了PyQt视为回退。
+无显示环境下可设置 QT_QPA_PLATFORM=offscreen 运行。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 这些模块应推迟到第一次发送请求时才导入
+DEFERRED_MODULES = ["requests", "urllib3", "http_transport", "httpx", "async_backend"]
+# 命令行模式下列出这些模块在哪一步被导入，PyQt5出现即为回退
+HEADLESS_MODULES = ["PyQt5", "sqlite3", "rate_limiter", "response_cache", "certifi", "requests", "urllib3", "httpx"]
+
+
+def child():
+    """在子进程中按main.py的方式启动窗口，首次绘制后输出结果并退出"""
+    sys.path.insert(0, ROOT)
+    from PyQt5.QtCore import QEvent, QObject
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication(sys.argv)
+    from ui.main_window import DeepseekWindow
+
+    class FirstPaint(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint:
+                print(json.dumps({
+                    "ready_at": time.time(),
+                    "loaded": [name for name in DEFERRED_MODULES if name in sys.modules],
+                }), flush=True)
+                app.quit()
+            return False
+
+    window = DeepseekWindow()
+    paint_filter = FirstPaint()
+    window.installEventFilter(paint_filter)
+    window.show()
+    app.exec_()
+
+
+def headless_child():
+    """在子进程中按 python -m cli 的方式导入并创建服务（不发送请求），输出各步骤导入的模块"""
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    import cli  # noqa: F401
+    imported = time.perf_counter()
+    loaded_on_import = [name for name in HEADLESS_MODULES if name in sys.modules]
+    from relay import RelayServer  # noqa: F401
+    from service import DeepseekService
+    DeepseekService("startup-benchmark", "http://127.0.0.1:9/v1/chat/completions")
+    print(json.dumps({
+        "ready_at": time.time(),
+        "import_ms": (imported - started) * 1000,
+        "loaded_on_import": loaded_on_import,
+        "loaded": [name for name in HEADLESS_MODULES if name in sys.modules],
+    }), flush=True)
+
+
+def measure(data_dir, headless=False):
+    """返回 (从启动进程到就绪的毫秒数, 子进程输出的结果)"""
+    env = dict(os.environ, DEEPSEEK_APP_DATA=data_dir)
+    started = time.time()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child"] + (["--headless"] if headless else []),
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return (result["ready_at"] - started) * 1000, result
+
+
+def check_headless(data_dir, runs, max_ms):
+    """命令行/中转模式的启动耗时，返回是否回退"""
+    timings = []
+    import_timings = []
+    for _ in range(runs):
+        elapsed, result = measure(data_dir, headless=True)
+        timings.append(elapsed)
+        import_timings.append(result["import_ms"])
+    median = statistics.median(timings)
+    print(f"命令行就绪（导入cli并创建服务）: 中位数 {median:.0f} ms，最快 {min(timings):.0f} ms，"
+          f"最慢 {max(timings):.0f} ms（{runs}次）；其中导入cli {statistics.median(import_timings):.1f} ms")
+    print(f"导入cli时已加载: {', '.join(result['loaded_on_import']) or '无'}")
+    created = [name for name in result["loaded"] if name not in result["loaded_on_import"]]
+    print(f"创建服务时加载: {', '.join(created) or '无'}")
+    failed = False
+    if "PyQt5" in result["loaded"]:
+        print("回退: 命令行模式导入了PyQt5")
+        failed = True
+    if max_ms and median > max_ms:
+        print(f"回退: 命令行就绪中位数 {median:.0f} ms 超过上限 {max_ms:.0f} ms")
+        failed = True
+    return failed
+
+
+def import_times(module="ui.main_window", top=15):
+    """返回 (模块, 累计导入耗时毫秒) 列表，按耗时从高到低排列"""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env, capture_output=True, text=True, check=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        rows.append((name.strip(), int(cumulative) / 1000))
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return rows[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测量主窗口冷启动耗时")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=0, help="首次绘制（--headless时为就绪）中位数的上限，0表示不检查")
+    parser.add_argument("--headless", action="store_true", help="测量命令行/中转模式（python -m cli）而不是主窗口")
+    parser.add_argument("--importtime", action="store_true", help="列出导入最慢的模块")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "deepseek-startup-bench"),
+                        help="测量时使用的数据目录，避免读取真实的对话记录")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        headless_child() if args.headless else child()
+        return 0
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    if args.headless:
+        failed = check_headless(args.data_dir, args.runs, args.max_ms)
+        if args.importtime:
+            print("导入耗时最多的模块（累计）:")
+            for name, ms in import_times("cli", top=args.top):
+                print(f"  {ms:8.1f} ms  {name}")
+        return 1 if failed else 0
+
+    timings = []
+    loaded = set()
+    for _ in range(args.runs):
+        elapsed, result = measure(args.data_dir)
+        timings.append(elapsed)
+        loaded.update(result["loaded"])
+    median = statistics.median(timings)
+    print(f"首次绘制: 中位数 {median:.0f} ms，最快 {min(timings):.0f} ms，最慢 {max(timings):.0f} ms（{args.runs}次）")
+
+    if args.importtime:
+        print("导入耗时最多的模块（累计）:")
+        for name, ms in import_times(top=args.top):
+            print(f"  {ms:8.1f} ms  {name}")
+
+    failed = False
+    if loaded:
+        print(f"回退: 首次绘制前已导入 {', '.join(sorted(loaded))}")
+        failed = True
+    if args.max_ms and median > args.max_ms:
+        print(f"回退: 首次绘制中位数 {median:.0f} ms 超过上限 {args.max_ms:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""界面基准：在离屏Qt中驱动DeepseekWindow进行长时间的流式对话，测量渲染开销和内存增长
+
+主线程上运行一个高频心跳定时器，心跳间隔明显超过设定值说明事件循环被阻塞（界面卡顿）。
+
+    QT_QPA_PLATFORM=offscreen python benchmarks/ui_bench.py --turns 200
+    python benchmarks/ui_bench.py --turns 50 --reply-chars 4000 --chunk-rate 0   # 大回复、不限速
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from metrics import percentile  # noqa: E402
+from mock_server import MockConfig, start_server  # noqa: E402
+
+HEARTBEAT_MS = 5
+STALL_MS = 50  # 心跳间隔超过该值计为一次卡顿
+
+
+def rss_bytes():
+    """当前进程的常驻内存，无法获取时返回None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class Heartbeat:
+    """记录主线程心跳间隔"""
+
+    def __init__(self, interval_ms=HEARTBEAT_MS):
+        from PyQt5.QtCore import QTimer
+        self.interval = interval_ms / 1000
+        self.gaps = []
+        self.last = None
+        self.timer = QTimer()
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.beat)
+
+    def start(self):
+        self.last = time.perf_counter()
+        self.timer.start()
+
+    def stop(self):
+        self.timer.stop()
+
+    def beat(self):
+        now = time.perf_counter()
+        self.gaps.append(now - self.last)
+        self.last = now
+
+
+def run(args):
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication(sys.argv)
+    from ui.main_window import DeepseekWindow
+
+    server = start_server(MockConfig(
+        latency=args.latency, chunk_rate=args.chunk_rate, chunk_chars=args.chunk_chars, reply_chars=args.reply_chars
+    ))
+    window = DeepseekWindow()
+    window.resize(1000, 800)
+    window.show()
+    window.api_key_input.setText("bench-key")
+    window.api_url_input.setText(server.url)
+    window.stream_checkbox.setChecked(True)
+
+    def wait_idle(timeout=60):
+        deadline = time.perf_counter() + timeout
+        while window.scheduler.in_flight() and time.perf_counter() < deadline:
+            app.processEvents()
+            time.sleep(0.001)
+
+    tracemalloc.start()
+    heartbeat = Heartbeat()
+    memory = []  # (轮次, RSS, Python堆)
+    heartbeat.start()
+    started = time.perf_counter()
+    try:
+        for turn in range(1, args.turns + 1):
+            window.input_text.setPlainText(f"第{turn}轮基准问题，请详细回答。")
+            window.process_input()
+            wait_idle()
+            if turn == 1 or turn % args.sample_every == 0 or turn == args.turns:
+                memory.append((turn, rss_bytes(), tracemalloc.get_traced_memory()[0]))
+        elapsed = time.perf_counter() - started
+    finally:
+        heartbeat.stop()
+        tracemalloc.stop()
+        window.close()
+        server.shutdown()
+        server.server_close()
+
+    gaps_ms = [gap * 1000 for gap in heartbeat.gaps]
+    chars = args.turns * args.reply_chars
+    first, last = memory[0], memory[-1]
+    return {
+        "turns": args.turns,
+        "seconds": elapsed,
+        "turns_per_second": args.turns / elapsed,
+        "rendered_chars_per_second": chars / elapsed,
+        "heartbeat_p50_ms": percentile(gaps_ms, 0.5),
+        "heartbeat_p99_ms": percentile(gaps_ms, 0.99),
+        "max_stall_ms": max(gaps_ms) if gaps_ms else None,
+        "stalls": sum(1 for gap in gaps_ms if gap > STALL_MS),
+        "rss_growth_mb": None if first[1] is None else (last[1] - first[1]) / 2 ** 20,
+        "python_heap_growth_mb": (last[2] - first[2]) / 2 ** 20,
+        "memory_samples": memory,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离屏驱动主窗口，测量界面卡顿和内存增长")
+    parser.add_argument("--turns", type=int, default=100, help="对话轮数")
+    parser.add_argument("--reply-chars", type=int, default=1000, help="每条回复的长度")
+    parser.add_argument("--chunk-chars", type=int, default=4)
+    parser.add_argument("--chunk-rate", type=float, default=1000.0, help="流式输出每秒数据块数，0为不限速")
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--sample-every", type=int, default=25, help="每隔多少轮记录一次内存")
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    args = parser.parse_args(argv)
+
+    # 使用临时数据目录，避免把基准对话写进真实的对话记录
+    data_dir = tempfile.mkdtemp(prefix="deepseek-ui-bench-")
+    os.environ["DEEPSEEK_APP_DATA"] = data_dir
+    try:
+        result = run(args)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(f"{result['turns']}轮，用时 {result['seconds']:.1f}s（{result['turns_per_second']:.1f} 轮/s，"
+          f"渲染 {result['rendered_chars_per_second']:.0f} 字/s）")
+    print(f"心跳间隔 p50 {result['heartbeat_p50_ms']:.1f}ms  p99 {result['heartbeat_p99_ms']:.1f}ms  "
+          f"最长卡顿 {result['max_stall_ms']:.1f}ms  超过{STALL_MS}ms的卡顿 {result['stalls']}次")
+    rss = result["rss_growth_mb"]
+    print(f"内存增长: RSS {'-' if rss is None else f'{rss:+.1f}MB'}  Python堆 {result['python_heap_growth_mb']:+.1f}MB")
+    for turn, rss_value, heap in result["memory_samples"]:
+        rss_text = "-" if rss_value is None else f"{rss_value / 2 ** 20:.1f}MB"
+        print(f"  第{turn}轮: RSS {rss_text}  Python堆 {heap / 2 ** 20:.1f}MB")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""命令行模式：不加载PyQt，适合脚本、定时任务和没有显示器的服务器
+
+用法示例：
+    python -m cli "把这句话翻译成英文：你好"
+    echo "一段很长的文本" | python -m cli - --system-prompt "总结以下内容"
+    python -m cli "你好" --json              # 输出包含回复、usage和耗时的JSON
+    python -m cli "找出所有报错" --file app.log  # 大文件分段处理后合并，见map_reduce
+    python -m cli --serve 127.0.0.1:8765     # 启动本地HTTP中转，见relay
+
+API密钥默认读取环境变量 DEEPSEEK_API_KEY。
+"""
+import argparse
+import json
+import os
+import sys
+
+from api_client import DEFAULT_API_URL, DeepseekError
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cli", description="发送提示词到Deepseek并输出回复，或启动本地HTTP中转")
+    parser.add_argument("prompt", nargs="?", help="提示词，为 - 或省略时从标准输入读取")
+    parser.add_argument("--api-key", default=os.environ.get("DEEPSEEK_API_KEY", ""),
+                        help="API密钥，默认读取环境变量 DEEPSEEK_API_KEY")
+    parser.add_argument("--api-url", default=DEFAULT_API_URL, help="多个URL用逗号分隔，连接失败时自动切换")
+    parser.add_argument("--model", default="deepseek-chat")
+    parser.add_argument("--system-prompt", default="", help="系统提示词")
+    parser.add_argument("--system-prompt-file", help="从文件读取系统提示词")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--max-tokens", type=int, default=2000)
+    parser.add_argument("--no-stream", action="store_true", help="等待完整回复后一次性输出")
+    parser.add_argument("--json", action="store_true", help="输出包含回复、usage和耗时的JSON（隐含 --no-stream）")
+    parser.add_argument("--retries", type=int, default=2, help="超时、429、5xx等暂时性错误的重试次数")
+    parser.add_argument("--cache", action="store_true", help="启用回复缓存，重复的提示词不再请求API")
+    parser.add_argument("--proxy", default="", help="代理URL，多个用逗号分隔，direct表示直连")
+    parser.add_argument("--no-verify-ssl", action="store_true", help="不验证SSL证书")
+    parser.add_argument("--gzip", action="store_true", help="用gzip压缩较大的请求体（需要服务端支持）")
+    parser.add_argument("--file", help="附加本地文件：按段并发处理后合并为一个回答，提示词作为处理指令")
+    parser.add_argument("--concurrency", type=int, default=4, help="--file 模式下同时发送的请求数")
+    parser.add_argument("--serve", metavar="HOST:PORT", help="启动本地HTTP中转，提供OpenAI兼容的chat/completions接口")
+    parser.add_argument("--relay-token", default=os.environ.get("DEEPSEEK_RELAY_TOKEN", ""),
+                        help="中转模式下要求调用方携带的令牌（Authorization: Bearer），默认读取 DEEPSEEK_RELAY_TOKEN")
+    parser.add_argument("--rpm", type=int, default=0, help="中转模式下每分钟最多转发的请求数，0表示不限制")
+    parser.add_argument("--tpm", type=int, default=0, help="中转模式下每分钟最多消耗的token数，0表示不限制")
+    parser.add_argument("--shared-quota", action="store_true", help="与本机同时运行的其他实例（包括图形界面）共享RPM/TPM配额")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("请通过 --api-key 或环境变量 DEEPSEEK_API_KEY 提供API密钥")
+    system_prompt = args.system_prompt
+    if args.system_prompt_file:
+        with open(args.system_prompt_file, encoding="utf-8") as f:
+            system_prompt = f.read().strip()
+
+    # 只在需要时导入，保持单次调用的启动开销最小
+    from service import DeepseekService
+    rate_limiter = None
+    if args.rpm or args.tpm:
+        from rate_limiter import RateLimiter, SharedBucketStore
+        rate_limiter = RateLimiter(SharedBucketStore() if args.shared_quota else None)
+        rate_limiter.set_limit(None, args.rpm, args.tpm)
+    cache = None
+    if args.cache:
+        from response_cache import ResponseCache
+        cache = ResponseCache()
+    service = DeepseekService(args.api_key, args.api_url, args.model, args.proxy, not args.no_verify_ssl,
+                              args.retries, cache, rate_limiter, args.gzip)
+
+    if args.serve:
+        from relay import serve
+        serve(service, *parse_address(args.serve), token=args.relay_token or None,
+              log=lambda message: print(message, file=sys.stderr))
+        return 0
+
+    if args.file:
+        return run_file(service, args, system_prompt)
+
+    prompt = args.prompt
+    if prompt in (None, "-"):
+        prompt = sys.stdin.read()
+    if not prompt.strip():
+        parser.error("请输入提示词")
+    messages = service.messages(prompt.strip(), system_prompt)
+    options = {"temperature": args.temperature, "max_tokens": args.max_tokens}
+    try:
+        if args.json or args.no_stream:
+            request = service.request(messages, **options)
+            text = request.execute()
+            if args.json:
+                metrics = request.metrics
+                print(json.dumps({"model": request.model_name, "response": text, "usage": request.usage,
+                                  "ttfb": metrics.ttfb, "total": metrics.total, "attempts": request.attempts},
+                                 ensure_ascii=False))
+            else:
+                print(text)
+        else:
+            from service import iterate_request
+            for delta in iterate_request(service.request(messages, stream=True, **options)):
+                sys.stdout.write(delta)
+                sys.stdout.flush()
+            sys.stdout.write("\n")
+    except DeepseekError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    return 0
+
+
+def run_file(service, args, system_prompt):
+    """--file 模式：进度输出到标准错误，各段始终缓存，中断后重新运行时跳过已完成的段"""
+    from map_reduce import MapReduceJob
+    from response_cache import ResponseCache
+    if service.cache is None:
+        service.cache = ResponseCache()
+    options = {"temperature": args.temperature, "max_tokens": args.max_tokens}
+    job = MapReduceJob(args.file, (args.prompt or "请总结这个文件的主要内容").strip(),
+                       lambda messages: service.request(messages, **options), system_prompt,
+                       concurrency=args.concurrency)
+
+    def on_progress(stage, done, total):
+        label = "处理" if stage == "map" else "合并"
+        print(f"\r{label} {done}/{total}（缓存命中{job.cached}次）", end="", file=sys.stderr, flush=True)
+
+    try:
+        text = job.run(on_progress)
+    except (DeepseekError, OSError) as e:
+        print(f"\n{e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        job.cancel()
+        return 130
+    print(file=sys.stderr)
+    print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
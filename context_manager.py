@@ -0,0 +1,95 @@
+"""对话上下文管理：本地估算token数量，并按模型预算裁剪较早的历史消息"""
+import math
+import re
+
+# DeepSeek官方给出的换算比例：1个中文字符约0.6个token，1个英文字符约0.3个token
+CJK_TOKEN_RATIO = 0.6
+OTHER_TOKEN_RATIO = 0.3
+MESSAGE_OVERHEAD = 4  # 每条消息的角色和格式开销
+
+# 各模型的上下文预算，需为max_tokens留出余量（两个模型的上下文长度均为64K）
+MODEL_TOKEN_BUDGETS = {
+    "deepseek-chat": 60000,
+    "deepseek-reasoner": 60000,
+}
+DEFAULT_TOKEN_BUDGET = 60000
+PREFIX_ALIGN = 0.25  # 裁剪位置的对齐粒度，占预算的比例
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text):
+    """按字符类别估算文本的token数量"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return int(math.ceil(cjk_count * CJK_TOKEN_RATIO + other_count * OTHER_TOKEN_RATIO))
+
+
+def estimate_message_tokens(message):
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+
+def build_context(system_prompt, history, prompt, budget=DEFAULT_TOKEN_BUDGET, align=PREFIX_ALIGN):
+    """构建发送给API的消息列表
+
+    系统提示和本次输入总是保留；历史消息以"一问一答"为单位从最近往前保留，
+    直到超出预算为止，更早的轮次全部丢弃以保持上下文连续。
+    需要裁剪时，裁剪位置对齐到历史累计token数每跨过 budget×align 的轮次边界，
+    这样连续多轮对话的裁剪位置不变，发送的消息前缀保持一致，服务端的上下文缓存可以命中；
+    代价是最多少保留约 budget×align 的历史。align为0时按预算尽量多保留。
+    返回 (messages, stats)，stats 包含发送/丢弃的token估算和丢弃的消息条数。
+    """
+    head = []
+    if system_prompt:
+        head.append({"role": "system", "content": system_prompt})
+    tail = [{"role": "user", "content": prompt}]
+    used = sum(estimate_message_tokens(m) for m in head + tail)
+
+    turns = _split_turns(history)
+    costs = [sum(estimate_message_tokens(m) for m in turn) for turn in turns]
+    # 能放进预算的最早起始轮次；当前轮次放不下时，更早的轮次一并丢弃
+    start = len(turns)
+    remaining = budget - used
+    while start > 0 and costs[start - 1] <= remaining:
+        start -= 1
+        remaining -= costs[start]
+    if start and align > 0:
+        start = _aligned_start(costs, start, budget * align)
+
+    kept = [m for turn in turns[start:] for m in turn]
+    dropped = [m for turn in turns[:start] for m in turn]
+    messages = head + [{"role": m["role"], "content": m["content"]} for m in kept] + tail
+    stats = {
+        "sent_tokens": used + sum(costs[start:]),
+        "dropped_tokens": sum(costs[:start]),
+        "dropped_messages": len(dropped),
+    }
+    return messages, stats
+
+
+def _aligned_start(costs, start, step):
+    """返回不早于start的第一个对齐位置：该轮次之前的累计token数刚跨过step的某个整数倍
+
+    对齐位置只取决于较早的历史，新增轮次不会改变它们。找不到时返回start。
+    """
+    total = 0
+    for index, cost in enumerate(costs):
+        if index >= start and index and total // step > (total - costs[index - 1]) // step:
+            return index
+        total += cost
+    return start
+
+
+def _split_turns(history):
+    """把历史消息按用户消息切分为轮次"""
+    turns = []
+    for message in history:
+        if message["role"] == "system":
+            continue
+        if message["role"] == "user" or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
@@ -0,0 +1,226 @@
+"""对话存储：用SQLite（WAL模式）持久化对话，每条消息追加写入一行
+
+打开对话时只按需分页读取最近的消息，启动和切换对话的耗时与归档大小无关。
+消息同时写入FTS5全文索引（trigram分词，对中文无需分词词典），由触发器增量维护。
+"""
+import os
+import pathlib
+import sqlite3
+import time
+
+from app_paths import data_path
+
+TITLE_LENGTH = 30  # 用第一条用户消息的前若干字作为对话标题
+TRIGRAM_MIN_LENGTH = 3  # trigram索引只能匹配至少3个字符的查询
+SEARCH_CANDIDATES = 2000  # 只对最近的这么多条命中计算相关度排序，常见词的查询耗时也有上限
+
+
+class ConversationStore:
+    def __init__(self, db_path=None):
+        self.db_path = db_path or data_path("conversations.sqlite3")
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")  # WAL模式下仍能保证数据库一致
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL DEFAULT '',
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations(updated_at);
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY,
+                conversation_id INTEGER NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages(conversation_id, id);
+        """)
+        self.fts_enabled = self._init_fts()
+        self.conn.commit()
+
+    def _init_fts(self):
+        """创建全文索引；SQLite不支持FTS5 trigram（3.34以下）时退回LIKE搜索"""
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            self.conn.executescript("""
+                CREATE VIRTUAL TABLE messages_fts USING fts5(
+                    content, content='messages', content_rowid='id', tokenize='trigram'
+                );
+                CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+                END;
+                CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+                    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                END;
+            """)
+        except sqlite3.OperationalError:
+            return False
+        # 为升级前已保存的消息建立索引
+        self.conn.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+        return True
+
+    def create_conversation(self, title=""):
+        now = time.time()
+        cursor = self.conn.execute(
+            "INSERT INTO conversations (title, created_at, updated_at) VALUES (?, ?, ?)",
+            (title, now, now)
+        )
+        self.conn.commit()
+        return cursor.lastrowid
+
+    def list_conversations(self, limit=100):
+        """按最近更新时间返回对话索引"""
+        rows = self.conn.execute(
+            "SELECT id, title, updated_at, message_count FROM conversations "
+            "ORDER BY updated_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_conversation(self, conversation_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            self.conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+    def append_message(self, conversation_id, role, content):
+        """追加一条消息并返回其id；对话还没有标题时用第一条用户消息生成"""
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                (conversation_id, role, content, now)
+            )
+            title = " ".join(content.split())[:TITLE_LENGTH] if role == "user" else ""
+            self.conn.execute(
+                "UPDATE conversations SET updated_at = ?, message_count = message_count + 1, "
+                "title = CASE WHEN title = '' THEN ? ELSE title END WHERE id = ?",
+                (now, title, conversation_id)
+            )
+        return cursor.lastrowid
+
+    def load_recent(self, conversation_id, limit=50):
+        """读取对话中最近的limit条消息，按时间正序返回"""
+        rows = self.conn.execute(
+            "SELECT id, role, content FROM messages WHERE conversation_id = ? "
+            "ORDER BY id DESC LIMIT ?", (conversation_id, limit)
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def load_before(self, conversation_id, before_id, limit=50):
+        """读取id早于before_id的limit条消息，用于向前翻页"""
+        rows = self.conn.execute(
+            "SELECT id, role, content FROM messages WHERE conversation_id = ? AND id < ? "
+            "ORDER BY id DESC LIMIT ?", (conversation_id, before_id, limit)
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def load_around(self, conversation_id, message_id, limit=50):
+        """读取message_id附近的消息（之前约一半，之后约一半），用于从搜索结果跳转"""
+        before = self.conn.execute(
+            "SELECT id, role, content FROM messages WHERE conversation_id = ? AND id <= ? "
+            "ORDER BY id DESC LIMIT ?", (conversation_id, message_id, limit // 2)
+        ).fetchall()
+        after = self.conn.execute(
+            "SELECT id, role, content FROM messages WHERE conversation_id = ? AND id > ? "
+            "ORDER BY id LIMIT ?", (conversation_id, message_id, limit - len(before))
+        ).fetchall()
+        return [dict(row) for row in reversed(before)] + [dict(row) for row in after]
+
+    def has_after(self, conversation_id, after_id):
+        row = self.conn.execute(
+            "SELECT 1 FROM messages WHERE conversation_id = ? AND id > ? LIMIT 1",
+            (conversation_id, after_id)
+        ).fetchone()
+        return row is not None
+
+    def search(self, query, limit=50):
+        """全文搜索所有对话，见search_messages；界面中应使用SearchReader在后台线程执行"""
+        return search_messages(self.conn, self.fts_enabled, query, limit)
+
+    def has_before(self, conversation_id, before_id):
+        row = self.conn.execute(
+            "SELECT 1 FROM messages WHERE conversation_id = ? AND id < ? LIMIT 1",
+            (conversation_id, before_id)
+        ).fetchone()
+        return row is not None
+
+    def close(self):
+        self.conn.close()
+
+
+class SearchReader:
+    """搜索专用的只读连接，供后台线程使用；WAL模式下与写入连接互不阻塞"""
+
+    def __init__(self, db_path, fts_enabled):
+        uri = pathlib.Path(os.path.abspath(db_path)).as_uri() + "?mode=ro"
+        self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.fts_enabled = fts_enabled
+
+    def search(self, query, limit=50):
+        return search_messages(self.conn, self.fts_enabled, query, limit)
+
+    def close(self):
+        self.conn.close()
+
+
+def search_messages(conn, fts_enabled, query, limit=50):
+    """按相关度返回命中的消息及所属对话，返回 (结果列表, 是否只在部分命中中排序)
+
+    查询不少于3个字符时使用FTS5索引，在最近的SEARCH_CANDIDATES条命中中按bm25排序，
+    命中更多时更早的消息不参与排序；更短的查询只能逐条匹配，按时间倒序返回。
+    """
+    query = query.strip()
+    if not query:
+        return [], False
+    if fts_enabled and len(query) >= TRIGRAM_MIN_LENGTH:
+        return _search_fts(conn, query, limit)
+    pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    rows = conn.execute(
+        "SELECT m.id, m.conversation_id, m.role, c.title, m.content "
+        "FROM messages m JOIN conversations c ON c.id = m.conversation_id "
+        "WHERE m.content LIKE ? ESCAPE '\\' ORDER BY m.id DESC LIMIT ?", (pattern, limit)
+    ).fetchall()
+    return [dict(row, snippet=_make_snippet(row["content"], query)) for row in rows], False
+
+
+def _search_fts(conn, query, limit):
+    phrase = '"' + query.replace('"', '""') + '"'
+    candidates = conn.execute(
+        "SELECT rowid, bm25(messages_fts) AS score FROM messages_fts "
+        "WHERE messages_fts MATCH ? ORDER BY rowid DESC LIMIT ?", (phrase, SEARCH_CANDIDATES)
+    ).fetchall()
+    capped = len(candidates) >= SEARCH_CANDIDATES
+    top = [row["rowid"] for row in sorted(candidates, key=lambda row: row["score"])[:limit]]
+    if not top:
+        return [], False
+    # 摘要只为最终返回的结果生成
+    placeholders = ",".join("?" * len(top))
+    rows = conn.execute(
+        "SELECT m.id, m.conversation_id, m.role, c.title, "
+        "snippet(messages_fts, 0, '【', '】', '…', 24) AS snippet "
+        "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+        "JOIN conversations c ON c.id = m.conversation_id "
+        f"WHERE messages_fts MATCH ? AND messages_fts.rowid IN ({placeholders})", [phrase] + top
+    ).fetchall()
+    order = {message_id: index for index, message_id in enumerate(top)}
+    return sorted((dict(row) for row in rows), key=lambda hit: order[hit["id"]]), capped
+
+
+def _make_snippet(content, query, context=24):
+    """截取命中位置附近的文字，命中部分用【】标出"""
+    index = content.find(query)
+    if index < 0:
+        return content[:context * 2]
+    start = max(0, index - context)
+    end = min(len(content), index + len(query) + context)
+    return ("…" if start else "") + content[start:index] + "【" + query + "】" + \
+        content[index + len(query):end] + ("…" if end < len(content) else "")
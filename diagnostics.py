@@ -0,0 +1,139 @@
+"""诊断模式：检测界面线程卡顿并记录卡顿时主线程的调用栈，按需采集cProfile性能数据
+
+默认关闭，通过 `python main.py --diagnostics` 或设置环境变量 DEEPSEEK_DIAGNOSTICS=1 启用。
+- 主线程上的心跳定时器定期更新时间戳；后台线程发现心跳超时，就对主线程调用栈反复采样
+- 心跳恢复后，把卡顿时长、采样到的调用栈和当时进行中的请求写入 diagnostics.log
+- Ctrl+Shift+P 开始/停止性能分析，停止时保存 .prof 文件（可用pstats或snakeviz查看）和文本摘要
+"""
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from app_paths import data_path
+
+DEFAULT_THRESHOLD = 0.2  # 心跳间隔超过该秒数视为卡顿
+HEARTBEAT_MS = 50
+SAMPLE_INTERVAL = 0.02  # 卡顿期间的调用栈采样间隔
+MAX_SAMPLES = 500  # 单次卡顿最多保留的采样数
+
+
+class StallWatchdog(QObject):
+    """界面线程卡顿监视器，需在主线程中创建"""
+    stall_detected = pyqtSignal(float, str)  # 卡顿秒数, 日志文件路径
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, log_path=None, parent=None):
+        super().__init__(parent)
+        self.threshold = threshold
+        self.log_path = log_path or data_path("diagnostics.log")
+        self.state_provider = None  # 返回进行中请求等状态描述的函数，在主线程调用
+        self.main_thread_id = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        self.samples = []
+        self.lock = threading.Lock()
+        self.running = False
+        self.timer = QTimer(self)
+        self.timer.setInterval(HEARTBEAT_MS)
+        self.timer.timeout.connect(self.beat)
+        self.monitor = threading.Thread(target=self._monitor, name="stall-watchdog", daemon=True)
+
+    def start(self):
+        """在事件循环启动前调用时，窗口创建等启动耗时也会记为一次卡顿"""
+        self.running = True
+        self.last_beat = time.perf_counter()
+        self.timer.start()
+        self.monitor.start()
+        self._write(f"[{_timestamp()}] 诊断模式已启动，卡顿阈值 {self.threshold * 1000:.0f} ms\n")
+
+    def stop(self):
+        self.running = False
+        self.timer.stop()
+
+    def beat(self):
+        now = time.perf_counter()
+        stalled = now - self.last_beat - HEARTBEAT_MS / 1000
+        self.last_beat = now
+        with self.lock:
+            samples, self.samples = self.samples, []
+        if stalled >= self.threshold:
+            self._report(stalled, samples)
+
+    def _monitor(self):
+        while self.running:
+            time.sleep(SAMPLE_INTERVAL)
+            if time.perf_counter() - self.last_beat - HEARTBEAT_MS / 1000 < self.threshold:
+                continue
+            frame = sys._current_frames().get(self.main_thread_id)
+            if frame is None:
+                continue
+            stack = tuple(traceback.format_stack(frame))
+            del frame
+            with self.lock:
+                if len(self.samples) < MAX_SAMPLES:
+                    self.samples.append(stack)
+
+    def _report(self, stalled, samples):
+        lines = [f"[{_timestamp()}] 界面卡顿 {stalled * 1000:.0f} ms（采样 {len(samples)} 次）"]
+        if self.state_provider is not None:
+            try:
+                lines.append(self.state_provider())
+            except Exception as e:  # 诊断代码不能影响程序本身
+                lines.append(f"获取状态失败: {e}")
+        if samples:
+            # 每次采样最内层的函数，出现次数最多的就是热点
+            hot = Counter(stack[-1].splitlines()[0].strip() for stack in samples)
+            lines.append("热点位置:")
+            lines.extend(f"  {count:4d}次  {location}" for location, count in hot.most_common(5))
+            stack, count = Counter(samples).most_common(1)[0]
+            lines.append(f"最常见的调用栈（{count}/{len(samples)}次）:")
+            lines.append("".join(stack).rstrip())
+        self._write("\n".join(lines) + "\n\n")
+        self.stall_detected.emit(stalled, self.log_path)
+
+    def _write(self, text):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(text)
+
+
+class Profiler:
+    """在主线程上开关cProfile，停止时保存性能数据"""
+
+    def __init__(self):
+        self.profile = None
+
+    @property
+    def running(self):
+        return self.profile is not None
+
+    def start(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self, path=None, top=40):
+        """停止分析，保存 .prof 文件和按累计耗时排序的文本摘要，返回 .prof 文件路径"""
+        profile, self.profile = self.profile, None
+        profile.disable()
+        path = path or data_path(time.strftime("profile-%Y%m%d-%H%M%S.prof"))
+        profile.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(top)
+        with open(path + ".txt", "w", encoding="utf-8") as f:
+            f.write(summary.getvalue())
+        return path
+
+    def toggle(self):
+        """开始分析时返回None，停止时返回保存的文件路径"""
+        if self.running:
+            return self.stop()
+        self.start()
+        return None
+
+
+def _timestamp():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
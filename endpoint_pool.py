@@ -0,0 +1,241 @@
+"""多端点路由：在多个API URL和代理线路之间选择最快的可用端点，连接失败时自动切换
+
+每条线路（API URL + 代理）是一个独立的DeepseekClient，拥有自己的连接池。
+- 后台线程定期向每个端点发送轻量的探测请求，测量往返延迟
+- 请求优先发往延迟最低的健康端点；连接失败（含代理、SSL错误）或网关错误时立即换下一个端点
+- 连续失败达到阈值的端点进入熔断状态，冷却期内不再使用，冷却结束后可以再次试用，成功即恢复
+"""
+import re
+import threading
+import time
+
+from api_client import DeepseekClient
+
+FAILURE_THRESHOLD = 2  # 连续失败多少次后熔断
+COOLDOWN = 30.0  # 熔断后多少秒内不再使用该端点
+PROBE_INTERVAL = 30.0
+PROBE_TIMEOUT = 5.0
+LATENCY_SMOOTHING = 0.3  # 探测延迟的指数平滑系数，越大越看重最近一次
+GATEWAY_ERRORS = {502, 503, 504}  # 通常是代理或网关的问题，换一条线路可能就能成功
+DIRECT = "direct"  # 代理列表中表示直连的写法
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def split_list(text):
+    """按逗号、分号或空白拆分用户输入的列表"""
+    return [item for item in re.split(r"[\s,;，；]+", text) if item]
+
+
+def parse_routes(api_urls, use_proxy=False, proxies=""):
+    """把URL列表和代理列表展开为 [(api_url, proxy), ...]，proxy为空字符串表示直连
+
+    每个URL都与每条代理线路组合，按URL在前的顺序排列，该顺序也是延迟未知时的优先级。
+    """
+    routes = []
+    proxy_list = [""]
+    if use_proxy:
+        proxy_list = ["" if proxy.lower() == DIRECT else proxy for proxy in split_list(proxies)] or [""]
+    for url in split_list(api_urls):
+        for proxy in proxy_list:
+            if (url, proxy) not in routes:
+                routes.append((url, proxy))
+    return routes
+
+
+def create_client(routes, verify_ssl=True, pool_size=10, on_change=None):
+    """单条线路返回DeepseekClient，多条线路返回已开始后台探测的EndpointPool"""
+    if len(routes) > 1:
+        pool = EndpointPool(routes, verify_ssl, pool_size, on_change=on_change)
+        pool.start_probing()
+        return pool
+    url, proxy = routes[0]
+    return DeepseekClient(url, bool(proxy), proxy, verify_ssl, pool_size)
+
+
+class Endpoint:
+    """一个端点的健康状态"""
+
+    def __init__(self, client, index):
+        self.client = client
+        self.index = index  # 在配置中的顺序
+        self.state = CLOSED
+        self.failures = 0  # 连续失败次数
+        self.opened_at = 0.0
+        self.latency = None  # 平滑后的探测延迟（秒），尚未探测成功时为None
+        self.last_error = ""
+
+    def rank(self):
+        """排序键：可用的在前，然后按延迟从低到高，延迟未知的按配置顺序排在最后"""
+        return (self.state != CLOSED, self.latency is None, self.latency or 0.0, self.index)
+
+
+class EndpointPool:
+    """与DeepseekClient接口相同的多端点客户端，可在多个请求线程间共享"""
+
+    def __init__(self, routes, verify_ssl=True, pool_size=10, failure_threshold=FAILURE_THRESHOLD,
+                 cooldown=COOLDOWN, on_change=None):
+        if not routes:
+            raise ValueError("至少需要一个端点")
+        self.routes = list(routes)
+        self.verify_ssl = verify_ssl
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.on_change = on_change  # 端点状态变化时调用，可能在任意线程中
+        self.endpoints = [
+            Endpoint(DeepseekClient(url, bool(proxy), proxy, verify_ssl, pool_size), index)
+            for index, (url, proxy) in enumerate(self.routes)
+        ]
+        self._by_client = {endpoint.client: endpoint for endpoint in self.endpoints}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.probe_thread = None
+
+    def candidates(self):
+        """按优先级返回本次请求依次尝试的端点（DeepseekClient）
+
+        熔断中的端点冷却结束后转为半开状态，排在健康端点之后；所有端点都在熔断中时
+        仍按熔断先后返回全部端点，不至于完全无法发送请求。
+        """
+        now = time.monotonic()
+        changed = False
+        with self.lock:
+            for endpoint in self.endpoints:
+                if endpoint.state == OPEN and now - endpoint.opened_at >= self.cooldown:
+                    endpoint.state = HALF_OPEN
+                    changed = True
+            usable = sorted((e for e in self.endpoints if e.state != OPEN), key=Endpoint.rank)
+            if not usable:
+                usable = sorted(self.endpoints, key=lambda e: e.opened_at)
+        if changed:
+            self._notify()
+        return [endpoint.client for endpoint in usable]
+
+    def record_success(self, client, latency=None):
+        with self.lock:
+            endpoint = self._by_client[client]
+            endpoint.failures = 0
+            if latency is not None:
+                if endpoint.latency is None:
+                    endpoint.latency = latency
+                else:
+                    endpoint.latency += LATENCY_SMOOTHING * (latency - endpoint.latency)
+            changed = endpoint.state != CLOSED or latency is not None
+            endpoint.state = CLOSED
+        if changed:
+            self._notify()
+
+    def record_failure(self, client, reason):
+        with self.lock:
+            endpoint = self._by_client[client]
+            endpoint.failures += 1
+            endpoint.last_error = reason
+            # 半开状态下的试用失败立即重新熔断
+            opened = endpoint.state == HALF_OPEN or (
+                endpoint.state == CLOSED and endpoint.failures >= self.failure_threshold)
+            if opened or endpoint.state == OPEN:
+                endpoint.state = OPEN
+                endpoint.opened_at = time.monotonic()
+        if opened:
+            self._notify()
+
+    def post(self, headers, body, stream=False):
+        """依次尝试各端点，连接失败或网关错误时换下一个；全部失败时抛出最后一个端点的错误"""
+        import requests  # 创建DeepseekClient时已加载
+        candidates = self.candidates()
+        for index, client in enumerate(candidates):
+            has_next = index + 1 < len(candidates)
+            try:
+                response = client.post(headers, body, stream)
+            except requests.exceptions.ConnectionError as e:
+                # 连接阶段的失败（包括连接超时、代理和SSL错误），换一条线路重发
+                self.record_failure(client, _describe(e))
+                if has_next:
+                    continue
+                raise
+            except requests.exceptions.Timeout as e:
+                # 读取超时说明服务端可能已在处理，交给重试策略决定是否重发
+                self.record_failure(client, _describe(e))
+                raise
+            if response.status_code in GATEWAY_ERRORS:
+                self.record_failure(client, f"HTTP {response.status_code}")
+                if has_next:
+                    response.close()
+                    continue
+            else:
+                self.record_success(client)
+            return response
+
+    def probe_all(self):
+        """探测所有端点：收到HTTP响应（网关错误除外）即视为可达，并用往返时间更新延迟"""
+        import requests
+        for endpoint in self.endpoints:
+            if self.stop_event.is_set():
+                return
+            client = endpoint.client
+            try:
+                latency, status = client.probe(PROBE_TIMEOUT)
+            except requests.exceptions.RequestException as e:
+                self.record_failure(client, _describe(e))
+                continue
+            if status in GATEWAY_ERRORS:
+                self.record_failure(client, f"HTTP {status}")
+            else:
+                self.record_success(client, latency)
+
+    def start_probing(self, interval=PROBE_INTERVAL):
+        """启动后台探测线程，立即探测一次，之后每隔interval秒探测一次"""
+        if self.probe_thread is not None:
+            return
+        self.probe_thread = threading.Thread(target=self._probe_loop, args=(interval,),
+                                             name="endpoint-probe", daemon=True)
+        self.probe_thread.start()
+
+    def stop(self):
+        """停止探测；连接仍可被未完成的请求使用"""
+        self.stop_event.set()
+
+    def close(self):
+        self.stop()
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+
+    def status_text(self):
+        """各端点状态的简短描述，按当前优先级排列"""
+        now = time.monotonic()
+        with self.lock:
+            endpoints = sorted(self.endpoints, key=Endpoint.rank)
+            parts = []
+            for endpoint in endpoints:
+                if endpoint.state == OPEN:
+                    remaining = max(0.0, self.cooldown - (now - endpoint.opened_at))
+                    detail = f"熔断（{remaining:.0f}秒后重试）"
+                elif endpoint.state == HALF_OPEN:
+                    detail = "待恢复"
+                elif endpoint.latency is not None:
+                    detail = f"{endpoint.latency * 1000:.0f}ms"
+                else:
+                    detail = "未探测"
+                parts.append(f"{endpoint.client.label()} {detail}")
+        return "端点: " + " | ".join(parts)
+
+    def errors_text(self):
+        """各端点最近一次失败的原因，用于提示信息"""
+        with self.lock:
+            return "\n".join(f"{endpoint.client.label()}: {endpoint.last_error}"
+                             for endpoint in self.endpoints if endpoint.last_error)
+
+    def _probe_loop(self, interval):
+        while not self.stop_event.is_set():
+            self.probe_all()
+            self.stop_event.wait(interval)
+
+    def _notify(self):
+        if self.on_change is not None:
+            self.on_change()
+
+
+def _describe(error):
+    """异常的简短描述，requests的异常信息往往很长，只保留类型和第一行"""
+    message = str(error).splitlines()[0] if str(error) else ""
+    return f"{type(error).__name__}: {message[:120]}" if message else type(error).__name__
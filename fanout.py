@@ -0,0 +1,100 @@
+"""多模型对比：把同一组消息同时发给多个模型（或端点），并排比较各自的回复、耗时和token统计
+
+各目标的请求并发执行，总耗时取决于最慢的目标而不是各目标耗时之和。
+目标写作 "模型" 或 "模型@API URL"，不写URL的使用当前配置的端点。
+"""
+import time
+
+from endpoint_pool import split_list
+
+TARGET_SEPARATOR = "@"
+
+
+def parse_targets(text):
+    """解析对比目标列表，返回去重后的 [(模型, API URL)]，URL为空字符串表示使用当前端点"""
+    targets = []
+    for item in split_list(text):
+        model, _, api_url = item.partition(TARGET_SEPARATOR)
+        target = (model.strip(), api_url.strip())
+        if target[0] and target not in targets:
+            targets.append(target)
+    return targets
+
+
+class FanoutTarget:
+    """对比中的一个目标及其请求状态"""
+
+    def __init__(self, model, api_url=""):
+        self.model = model
+        self.api_url = api_url
+        self.request = None  # DeepseekRequest
+        self.request_id = None
+        self.status = "pending"  # ok / error
+        self.text = ""  # 回复或错误信息
+
+    def label(self):
+        return f"{self.model}{TARGET_SEPARATOR}{self.api_url}" if self.api_url else self.model
+
+    def stats_text(self):
+        """耗时和token统计的简短描述"""
+        metrics = self.request.metrics if self.request is not None else None
+        if metrics is None or metrics.total is None:
+            return "等待回复..."
+        parts = [f"耗时 {metrics.total:.2f}s"]
+        first = metrics.first_token or metrics.ttfb
+        if first is not None:
+            parts.append(f"首字 {first:.2f}s")
+        if metrics.prompt_tokens is not None:
+            parts.append(f"输入 {metrics.prompt_tokens}")
+        if metrics.completion_tokens:
+            parts.append(f"输出 {metrics.completion_tokens} tokens")
+            generating = metrics.total - (first or 0.0)
+            if generating > 0:
+                parts.append(f"{metrics.completion_tokens / generating:.1f} tokens/s")
+        if self.request.attempts > 1:
+            parts.append(f"尝试{self.request.attempts}次")
+        return " | ".join(parts)
+
+
+class FanoutGroup:
+    """一次对比：同一个提示词发给多个目标"""
+
+    def __init__(self, prompt, messages, targets, conversation=None):
+        self.prompt = prompt
+        self.messages = messages
+        self.targets = [FanoutTarget(model, api_url) for model, api_url in targets]
+        self.conversation = conversation  # 发起对比时所在的对话，采用回复时需仍在该对话中
+        self.finished = []  # 按完成先后排列的目标序号
+        self.promoted = None  # 已采用的目标序号
+        self.started = time.perf_counter()
+        self.wall_time = None
+
+    def finish(self, index, ok, text):
+        """记录目标完成，返回是否为第一个成功完成的目标"""
+        target = self.targets[index]
+        target.status = "ok" if ok else "error"
+        target.text = text
+        self.finished.append(index)
+        if self.done():
+            self.wall_time = time.perf_counter() - self.started
+        return ok and self.first_success() == index
+
+    def done(self):
+        return len(self.finished) == len(self.targets)
+
+    def first_success(self):
+        for index in self.finished:
+            if self.targets[index].status == "ok":
+                return index
+        return None
+
+    def sequential_time(self):
+        """各目标耗时之和，即逐个发送时大约需要的时间"""
+        return sum(target.request.metrics.total or 0.0 for target in self.targets if target.request is not None)
+
+    def summary_text(self):
+        ok = sum(1 for target in self.targets if target.status == "ok")
+        text = f"对比完成：{ok}/{len(self.targets)}个目标成功"
+        if self.wall_time is not None:
+            text += f"，总耗时{self.wall_time:.1f}秒（逐个发送约需{self.sequential_time():.1f}秒）"
+        return text
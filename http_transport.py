@@ -0,0 +1,73 @@
+"""HTTP传输层：基于requests的长连接会话和计时连接池
+
+requests及urllib3的导入耗时占启动时间的大头，因此只有在第一次发送请求时才导入本模块。
+"""
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from metrics import add_connect_time
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    """记录建立连接耗时的连接类，连接池复用已有连接时不会产生耗时"""
+    
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            add_connect_time(time.perf_counter() - started)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            add_connect_time(time.perf_counter() - started)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+_TIMED_POOL_CLASSES = {"http": _TimedHTTPConnectionPool, "https": _TimedHTTPSConnectionPool}
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """使用计时连接的适配器，用于区分握手耗时和服务端耗时"""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _TIMED_POOL_CLASSES
+    
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        # SOCKS代理使用自己的连接池类型，保持不变
+        if not proxy.lower().startswith("socks"):
+            manager.pool_classes_by_scheme = _TIMED_POOL_CLASSES
+        return manager
+
+
+def create_session(proxy="", verify_ssl=True, pool_size=10):
+    """创建使用计时连接池的会话，多个请求线程可共享"""
+    session = requests.Session()
+    adapter = TimedHTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.verify = verify_ssl
+    if proxy:
+        session.proxies.update({
+            "http": proxy,
+            "https": proxy
+        })
+    return session
@@ -1,9 +1,17 @@
+import os
 import sys
 from PyQt5.QtWidgets import QApplication
-from ui.main_window import DeepseekWindow
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
-    window = DeepseekWindow()
+    watchdog = None
+    if '--diagnostics' in sys.argv or os.environ.get('DEEPSEEK_DIAGNOSTICS', '') not in ('', '0'):
+        # 在创建窗口前启动，窗口创建和样式加载的耗时也会被记录
+        from diagnostics import StallWatchdog
+        watchdog = StallWatchdog()
+        watchdog.start()
+    # 网络相关模块在第一次发送请求时才导入，窗口导入后即可显示
+    from ui.main_window import DeepseekWindow
+    window = DeepseekWindow(watchdog=watchdog)
     window.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    sys.exit(app.exec_())
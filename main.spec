@@ -0,0 +1,72 @@
+# -*- mode: python ; coding: utf-8 -*-
+# 精简的PyInstaller打包配置：pyinstaller main.spec
+#
+# 默认生成目录形式（dist/main/main.exe）。单文件形式每次启动都要把全部DLL解压到临时目录，
+# 在开启杀毒扫描的机器上会多花数秒；确实需要单文件时设置环境变量 DEEPSEEK_ONEFILE=1。
+import os
+
+ONEFILE = os.environ.get("DEEPSEEK_ONEFILE") == "1"
+
+# 程序只用到QtCore/QtGui/QtWidgets，其余Qt模块及其DLL、插件都不需要
+UNUSED_QT_MODULES = [
+    "QtBluetooth", "QtDesigner", "QtHelp", "QtLocation", "QtMultimedia",
+    "QtMultimediaWidgets", "QtNetwork", "QtNfc", "QtOpenGL", "QtPositioning",
+    "QtPrintSupport", "QtQml", "QtQuick", "QtQuick3D", "QtQuickWidgets", "QtRemoteObjects",
+    "QtSensors", "QtSerialPort", "QtSql", "QtSvg", "QtTest", "QtTextToSpeech",
+    "QtWebChannel", "QtWebEngine", "QtWebEngineCore", "QtWebEngineWidgets",
+    "QtWebSockets", "QtXml", "QtXmlPatterns",
+]
+EXCLUDES = ["PyQt5." + name for name in UNUSED_QT_MODULES] + [
+    # 打包环境中装了但程序没有用到的库
+    "numpy", "tkinter", "unittest", "pydoc", "IPython", "matplotlib", "pandas",
+]
+# 不随程序分发的Qt二进制文件（按文件名中的片段匹配，不区分大小写）
+UNUSED_QT_BINARIES = ["qt5" + name[2:].lower() for name in UNUSED_QT_MODULES] + [
+    "opengl32sw", "d3dcompiler", "egl", "glesv2", "qwebgl", "qminimal", "qsvg",
+]
+KEPT_TRANSLATIONS = ("qtbase_zh_cn", "qt_zh_cn")
+
+
+def is_unused(entry):
+    path = entry[0].replace("\\", "/").lower()
+    name = path.rsplit("/", 1)[-1]
+    if name.startswith("lib"):  # Linux/macOS下的库文件名带lib前缀
+        name = name[3:]
+    if any(name.startswith(prefix) for prefix in UNUSED_QT_BINARIES):
+        return True
+    if "/translations/" in path:
+        return not name.startswith(KEPT_TRANSLATIONS)
+    return False
+
+
+a = Analysis(
+    ["main.py"],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    hiddenimports=[],
+    hookspath=[],
+    runtime_hooks=[],
+    excludes=EXCLUDES,
+    noarchive=False,
+)
+a.binaries = [entry for entry in a.binaries if not is_unused(entry)]
+a.datas = [entry for entry in a.datas if not is_unused(entry)]
+pyz = PYZ(a.pure)
+
+if ONEFILE:
+    exe = EXE(
+        pyz, a.scripts, a.binaries, a.datas, [],
+        name="main",
+        console=False,
+        upx=False,  # UPX压缩的DLL需要在启动时解压，反而更慢
+    )
+else:
+    exe = EXE(
+        pyz, a.scripts, [],
+        exclude_binaries=True,
+        name="main",
+        console=False,
+        upx=False,
+    )
+    coll = COLLECT(exe, a.binaries, a.datas, name="main", upx=False)
@@ -0,0 +1,212 @@
+"""大文件处理：把本地文件按token数切分，各段并发发送（map），再把各段结果合并为最终回答（reduce）
+
+- 文件通过mmap逐行扫描，只记录各段的字节范围，发送时才读取对应的一段，不会把整个文件载入内存或输入框
+- 每段请求都经过回复缓存，中断或部分失败后重新处理同一文件时，已完成的段直接命中缓存
+- 各段结果合计超出一段的大小时分多轮合并，每轮的合并请求同样并发执行
+"""
+import math
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from api_client import DeepseekError, RequestCancelled
+from context_manager import estimate_tokens
+from payload_builder import UNCACHED_BUILDER
+
+DEFAULT_CHUNK_TOKENS = 6000
+ENCODING_SAMPLE_BYTES = 64 * 1024
+FALLBACK_ENCODING = "gb18030"  # 不是UTF-8时按中文Windows常见的编码读取
+
+
+def detect_encoding(data):
+    """按文件开头判断编码：能按UTF-8解码（允许末尾字符被截断）即为UTF-8"""
+    try:
+        data.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start < len(data) - 3:
+            return FALLBACK_ENCODING
+    return "utf-8"
+
+
+def plan_chunks(data, encoding="utf-8", chunk_tokens=DEFAULT_CHUNK_TOKENS):
+    """按行把data（bytes或mmap）切分为估算token数不超过chunk_tokens的片段，返回 [(起始字节, 结束字节)]
+
+    超长的单行按字节均分，UTF-8下切分点对齐到字符边界。
+    """
+    chunks = []
+    size = len(data)
+    start = position = 0
+    tokens = 0
+    while position < size:
+        end = data.find(b"\n", position)
+        end = size if end < 0 else end + 1
+        cost = estimate_tokens(data[position:end].decode(encoding, "replace"))
+        if tokens and tokens + cost > chunk_tokens:
+            chunks.append((start, position))
+            start, tokens = position, 0
+        if cost > chunk_tokens:
+            step = math.ceil((end - position) / math.ceil(cost / chunk_tokens))
+            while position < end:
+                cut = min(position + step, end)
+                while encoding == "utf-8" and cut < end and data[cut] & 0xC0 == 0x80:
+                    cut += 1
+                chunks.append((position, cut))
+                position = cut
+            start = end
+        else:
+            tokens += cost
+        position = end
+    if start < size:
+        chunks.append((start, size))
+    return chunks
+
+
+class MapReduceJob:
+    """用同一条指令处理整个文件，线程安全的cancel可在任意线程调用
+
+    make_request(messages) 返回非流式的DeepseekRequest，由调用方决定模型、客户端、缓存和限速。
+    """
+
+    def __init__(self, path, instruction, make_request, system_prompt="", chunk_tokens=DEFAULT_CHUNK_TOKENS,
+                 concurrency=4):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.instruction = instruction
+        self.make_request = make_request
+        self.system_prompt = system_prompt
+        self.chunk_tokens = chunk_tokens
+        self.concurrency = concurrency
+        self.cancel_event = threading.Event()
+        self.running = set()  # 进行中的请求，取消时逐个中断
+        self.lock = threading.Lock()
+        self.cached = 0  # 命中缓存的请求数
+        self.requests = 0
+
+    def cancel(self):
+        self.cancel_event.set()
+        with self.lock:
+            running = list(self.running)
+        for request in running:
+            request.cancel()
+
+    def run(self, on_progress=None):
+        """处理文件并返回最终回答；on_progress(阶段, 已完成, 总数) 在工作线程中调用，阶段为"map"或"reduce"
+
+        有段失败时抛出DeepseekError，已成功的段保留在缓存中。
+        """
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise DeepseekError(f"文件为空: {self.name}")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                encoding = detect_encoding(data[:ENCODING_SAMPLE_BYTES])
+                chunks = plan_chunks(data, encoding, self.chunk_tokens)
+                if len(chunks) == 1:
+                    text = data[:].decode(encoding, "replace")
+                    return self._execute(self._messages(f"下面是文件「{self.name}」的内容：\n\n{text}"))
+                results = self._run_all(
+                    [lambda i=i, s=s, e=e: self._map(data, encoding, i, len(chunks), s, e)
+                     for i, (s, e) in enumerate(chunks)],
+                    "map", on_progress)
+        return self._reduce(results, on_progress)
+
+    def _map(self, data, encoding, index, total, start, end):
+        text = data[start:end].decode(encoding, "replace")
+        return self._execute(self._messages(f"下面是文件「{self.name}」的第{index + 1}/{total}部分：\n\n{text}"))
+
+    def _reduce(self, results, on_progress):
+        """逐轮合并，直到只剩一份结果"""
+        while True:
+            groups = self._group(results)
+            if len(groups) == 1:
+                if on_progress is not None:
+                    on_progress("reduce", 0, 1)
+                final = self._execute(self._reduce_messages(groups[0], len(results), final=True))
+                if on_progress is not None:
+                    on_progress("reduce", 1, 1)
+                return final
+            results = self._run_all(
+                [lambda group=group: self._execute(self._reduce_messages(group, len(results), final=False))
+                 for group in groups],
+                "reduce", on_progress)
+
+    def _group(self, results):
+        """把编号后的结果按chunk_tokens分组，每组至少两份，保证每轮都能减少结果数"""
+        groups = [[]]
+        tokens = 0
+        for index, text in enumerate(results):
+            part = f"[第{index + 1}部分]\n{text}"
+            cost = estimate_tokens(part)
+            if len(groups[-1]) >= 2 and tokens + cost > self.chunk_tokens:
+                groups.append([])
+                tokens = 0
+            groups[-1].append(part)
+            tokens += cost
+        if len(groups) > 1 and len(groups[-1]) == 1:
+            groups[-2].extend(groups.pop())
+        return groups
+
+    def _reduce_messages(self, parts, count, final):
+        if final:
+            request = "请据此给出针对整个文件的最终回答。"
+        else:
+            request = "请把这些结果合并为一份，保留之后继续合并所需的要点。"
+        return self._messages(f"文件「{self.name}」较长，已分为{count}部分分别处理，以下是其中各部分的结果。"
+                              f"{request}\n\n" + "\n\n".join(parts))
+
+    def _messages(self, content):
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        messages.append({"role": "user", "content": f"{self.instruction}\n\n{content}"})
+        return messages
+
+    def _run_all(self, tasks, stage, on_progress):
+        """并发执行tasks，返回按顺序排列的结果；有任务失败时等其余任务结束后抛出第一个错误
+
+        DeepseekError以外的意外错误（如缓存数据库出错）重新发送也无济于事，立即取消其余任务。
+        """
+        results = [None] * len(tasks)
+        errors = []
+        unexpected = None
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {executor.submit(task): index for index, task in enumerate(tasks)}
+            for done, future in enumerate(as_completed(futures), 1):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except DeepseekError as e:
+                    errors.append((index, e))
+                except Exception as e:
+                    if unexpected is None:
+                        unexpected = (index, e)
+                        self.cancel()
+                if on_progress is not None:
+                    on_progress(stage, done, len(tasks))
+        if unexpected is not None:
+            index, error = unexpected
+            raise DeepseekError(f"第{index + 1}部分处理出错: {error}") from error
+        if self.cancel_event.is_set():
+            raise RequestCancelled()
+        if errors:
+            index, error = min(errors, key=lambda item: item[0])
+            raise DeepseekError(f"{len(errors)}/{len(tasks)}部分处理失败（第{index + 1}部分: {error}），"
+                                f"已完成的部分已缓存，重新发送可跳过")
+        return results
+
+    def _execute(self, messages):
+        if self.cancel_event.is_set():
+            raise RequestCancelled()
+        request = self.make_request(messages)
+        # 每段只发送一次，序列化结果不进入共享的片段缓存，处理完的内容不会留在内存里
+        request.payload_builder = UNCACHED_BUILDER
+        with self.lock:
+            self.running.add(request)
+        try:
+            text = request.execute()
+        finally:
+            with self.lock:
+                self.running.discard(request)
+                self.requests += 1
+                self.cached += request.from_cache
+        return text
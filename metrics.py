@@ -0,0 +1,153 @@
+"""请求指标：记录每次请求的连接耗时、首字节时间、总耗时、数据量和token用量
+
+最近的记录保存在环形缓冲区中，可汇总为延迟分位数和生成速度，并导出为CSV/JSONL供离线分析。
+"""
+import csv
+import json
+import math
+import threading
+import time
+from collections import deque
+
+METRIC_FIELDS = [
+    "started_at", "model", "status", "streamed", "attempts",
+    "connect_time", "ttfb", "first_token", "total",
+    "request_bytes", "response_bytes",
+    "prompt_tokens", "completion_tokens", "prompt_cache_hit_tokens",
+    "queue_wait",
+]
+
+_connect_timing = threading.local()
+
+
+def reset_connect_time():
+    _connect_timing.seconds = 0.0
+
+
+def add_connect_time(seconds):
+    """由计时连接在建立TCP/TLS（含代理隧道）连接后调用；复用连接时不会调用"""
+    _connect_timing.seconds = getattr(_connect_timing, "seconds", 0.0) + seconds
+
+
+def connect_time():
+    return getattr(_connect_timing, "seconds", 0.0)
+
+
+class RequestMetrics:
+    """单次请求的指标，时间单位为秒；未测得的项为None"""
+
+    def __init__(self, model, streamed=False):
+        self.started_at = time.time()
+        self.model = model
+        self.status = "pending"  # ok / error / cancelled / cache
+        self.streamed = streamed
+        self.attempts = 0
+        self.connect_time = None
+        self.ttfb = None  # 发出请求到收到响应头
+        self.first_token = None  # 发出请求到收到第一段增量（仅流式）
+        self.total = None
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.prompt_cache_hit_tokens = None
+        self.queue_wait = 0.0  # 等待限速配额的秒数，计入total
+        self._clock = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self._clock
+
+    def add_usage(self, usage):
+        if not usage:
+            return
+        self.prompt_tokens = usage.get("prompt_tokens")
+        self.completion_tokens = usage.get("completion_tokens")
+        self.prompt_cache_hit_tokens = usage.get("prompt_cache_hit_tokens")
+
+    def finish(self, status):
+        self.status = status
+        self.total = self.elapsed()
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in METRIC_FIELDS}
+
+
+def percentile(values, fraction):
+    """最近秩法计算分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = math.ceil(fraction * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+class MetricsRecorder:
+    """线程安全的环形缓冲区，保存最近capacity条请求指标"""
+
+    def __init__(self, capacity=500):
+        self.records = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+
+    def record(self, metrics):
+        with self.lock:
+            self.records.append(metrics)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.records)
+
+    def summary(self):
+        """汇总网络请求（不含缓存命中）的延迟分位数和生成速度"""
+        records = [m for m in self.snapshot() if m.status in ("ok", "error")]
+        totals = [m.total for m in records if m.total is not None]
+        ttfbs = [m.ttfb for m in records if m.ttfb is not None]
+        generated = [m for m in records if m.status == "ok" and m.completion_tokens and m.total]
+        tokens = sum(m.completion_tokens for m in generated)
+        # 生成耗时从收到首段增量（非流式时为响应头）开始计算
+        seconds = sum(m.total - (m.first_token or m.ttfb or 0.0) for m in generated)
+        # 只统计服务端返回了缓存命中数的请求
+        cached = [m for m in records if m.prompt_cache_hit_tokens is not None and m.prompt_tokens]
+        prompt_tokens = sum(m.prompt_tokens for m in cached)
+        return {
+            "count": len(records),
+            "errors": sum(1 for m in records if m.status == "error"),
+            "latency_p50": percentile(totals, 0.5),
+            "latency_p95": percentile(totals, 0.95),
+            "ttfb_p50": percentile(ttfbs, 0.5),
+            "tokens_per_second": tokens / seconds if seconds > 0 else None,
+            "prefix_cache_hit_rate": (sum(m.prompt_cache_hit_tokens for m in cached) / prompt_tokens
+                                      if prompt_tokens else None),
+        }
+
+    def export(self, path):
+        """按扩展名导出为CSV或JSONL"""
+        records = [m.as_dict() for m in self.snapshot()]
+        if path.lower().endswith(".csv"):
+            with open(path, "w", encoding="utf-8-sig", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=METRIC_FIELDS)
+                writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return len(records)
+
+
+def format_summary(summary):
+    """格式化为状态面板中的一行文字"""
+    if not summary["count"]:
+        return "暂无请求统计"
+
+    def seconds(value):
+        return "-" if value is None else f"{value:.2f}s"
+
+    speed = summary["tokens_per_second"]
+    text = (f"请求 {summary['count']}（失败 {summary['errors']}） | "
+            f"延迟 p50 {seconds(summary['latency_p50'])} p95 {seconds(summary['latency_p95'])} | "
+            f"首字节 p50 {seconds(summary['ttfb_p50'])} | "
+            f"生成 {'-' if speed is None else f'{speed:.1f}'} tokens/s")
+    hit_rate = summary.get("prefix_cache_hit_rate")
+    if hit_rate is not None:
+        text += f" | 前缀缓存命中 {hit_rate:.0%}"
+    return text
@@ -0,0 +1,107 @@
+"""请求体构建：缓存已序列化的消息，每轮只序列化新增的消息，并保证相同前缀的字节完全一致
+
+多轮对话中，系统提示词和较早的历史在每次请求里都原样出现。这里按消息缓存JSON片段，
+并记住最近几次拼接好的消息列表，新请求与之前缀相同时直接在后面追加。
+序列化方式固定（不转义中文、紧凑分隔符、键顺序固定），同一段前缀每次生成的字节都相同，
+也比requests默认的ASCII转义小得多。较大的请求体可选用gzip压缩。
+
+缓存按字符数限制总大小，过长的单条消息不缓存；批量、大文件分段这类每条消息只发送一次的请求
+应使用UNCACHED_BUILDER，避免把用不上的内容留在内存里。
+"""
+import gzip
+import json
+import threading
+from collections import OrderedDict
+
+GZIP_MIN_BYTES = 16 * 1024  # 小于该大小的请求体压缩收益不大，不压缩
+MAX_FRAGMENTS = 4096  # 缓存的消息片段数
+MAX_FRAGMENT_CHARS = 4 * 1024 * 1024  # 消息片段缓存的总字符数（每条按内容加片段计两份）
+MAX_CACHED_MESSAGE_CHARS = 64 * 1024  # 超过该长度的单条消息不缓存
+MAX_PREFIXES = 8  # 记住的最近拼接结果数，多个对话交替发送时各自都能命中
+MAX_PREFIX_CHARS = 4 * 1024 * 1024  # 记住的拼接结果的总字符数
+
+
+def dumps(value):
+    """固定格式的JSON序列化，相同的值总是得到相同的字节"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class PayloadBuilder:
+    """线程安全，所有请求共用一个实例即可"""
+
+    def __init__(self, max_fragments=MAX_FRAGMENTS, max_prefixes=MAX_PREFIXES, max_fragment_chars=MAX_FRAGMENT_CHARS,
+                 max_prefix_chars=MAX_PREFIX_CHARS):
+        self.fragments = OrderedDict()  # (role, content) -> 该消息的JSON片段
+        self.fragment_chars = 0  # 缓存中的内容和片段的总字符数
+        self.prefixes = []  # 最近的 (片段列表, 用逗号拼接后的文本)，最新的在前
+        self.max_fragments = max_fragments
+        self.max_prefixes = max_prefixes
+        self.max_fragment_chars = max_fragment_chars
+        self.max_prefix_chars = max_prefix_chars
+        self.lock = threading.Lock()
+
+    def build(self, fields, messages):
+        """返回UTF-8编码的请求体：fields中的字段在前，messages在最后"""
+        head = dumps(fields)
+        messages_json = self.messages_json(messages)
+        if head == "{}":
+            return ('{"messages":' + messages_json + "}").encode("utf-8")
+        return (head[:-1] + ',"messages":' + messages_json + "}").encode("utf-8")
+
+    def messages_json(self, messages):
+        parts = [self.fragment(message) for message in messages]
+        if not self.max_prefixes:
+            return "[" + ",".join(parts) + "]"
+        with self.lock:
+            text = None
+            for index, (prefix, prefix_text) in enumerate(self.prefixes):
+                # 片段来自缓存，相同的消息是同一个字符串对象，比较时很快
+                if len(prefix) <= len(parts) and parts[:len(prefix)] == prefix:
+                    rest = parts[len(prefix):]
+                    text = prefix_text + "".join("," + part for part in rest) if prefix else ",".join(rest)
+                    del self.prefixes[index]
+                    break
+            if text is None:
+                text = ",".join(parts)
+            if len(text) <= self.max_prefix_chars:
+                self.prefixes.insert(0, (parts, text))
+            del self.prefixes[self.max_prefixes:]
+            total = 0
+            for index, (_, prefix_text) in enumerate(self.prefixes):
+                total += len(prefix_text)
+                if total > self.max_prefix_chars:
+                    del self.prefixes[index:]
+                    break
+        return "[" + text + "]"
+
+    def fragment(self, message):
+        """单条消息的JSON片段；只含role和content、且不太长的消息会被缓存"""
+        if (not self.max_fragments or len(message) != 2 or "role" not in message or "content" not in message
+                or not isinstance(message["content"], str) or len(message["content"]) > MAX_CACHED_MESSAGE_CHARS):
+            return dumps(message)
+        key = (message["role"], message["content"])
+        with self.lock:
+            fragment = self.fragments.get(key)
+            if fragment is not None:
+                self.fragments.move_to_end(key)
+                return fragment
+        fragment = dumps({"role": key[0], "content": key[1]})
+        with self.lock:
+            if key not in self.fragments:
+                self.fragments[key] = fragment
+                self.fragment_chars += len(key[1]) + len(fragment)
+            while len(self.fragments) > self.max_fragments or self.fragment_chars > self.max_fragment_chars:
+                (_, content), evicted = self.fragments.popitem(last=False)
+                self.fragment_chars -= len(content) + len(evicted)
+        return fragment
+
+
+def compress_body(body, min_bytes=GZIP_MIN_BYTES):
+    """较大的请求体用gzip压缩，返回 (请求体, 需要附加的请求头)"""
+    if len(body) < min_bytes:
+        return body, {}
+    return gzip.compress(body, compresslevel=6), {"Content-Encoding": "gzip"}
+
+
+DEFAULT_BUILDER = PayloadBuilder()
+UNCACHED_BUILDER = PayloadBuilder(max_fragments=0, max_prefixes=0)  # 只序列化，不缓存任何内容
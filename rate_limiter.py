@@ -0,0 +1,265 @@
+"""客户端限速：按模型用令牌桶限制每分钟请求数（RPM）和token数（TPM），超出配额时排队等待而不是报错
+
+- 每次发送前按估算的token数预约配额，返回需要等待的秒数；预约按先后顺序排队
+- 响应返回usage后按实际用量结算，多退少补；输出token数的估算也随实际用量修正
+- 令牌桶容量（可突发的量）为配额的一小部分，补充速率扣除这部分，因此任意60秒内放行的总量
+  不超过配额（单个请求的token数大于突发量时，最多超出二者之差），持续负载下吞吐量约为配额的95%
+- 桶的状态可以保存在本机的SQLite文件中，同一台机器上的多个程序实例共享同一份配额；
+  共享文件不可用（如被其他实例长时间锁住）时预约抛出QuotaStoreError，结算和退还则直接放弃
+"""
+import sqlite3
+import threading
+import time
+
+from app_paths import data_path
+from context_manager import estimate_message_tokens
+
+DEFAULT_BURST = 0.05  # 可突发的量占每分钟配额的比例，取值范围 [0, 1)
+COMPLETION_SMOOTHING = 0.3  # 输出token数估算的指数平滑系数
+
+
+class QuotaStoreError(Exception):
+    """配额存储读写失败"""
+
+
+class RateLimit:
+    """一个模型的配额，0表示不限制"""
+
+    def __init__(self, rpm=0, tpm=0, burst=DEFAULT_BURST):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.burst = burst
+
+
+class TokenBucket:
+    """令牌桶的参数；桶的状态 (余量, 更新时间) 保存在存储中，以便在进程间共享
+
+    余量可以为负，表示已被之前的预约占用，新的预约要等余量补回到0才能发出。
+    """
+
+    def __init__(self, limit_per_minute, burst=DEFAULT_BURST):
+        self.capacity = limit_per_minute * burst
+        self.rate = limit_per_minute * (1 - burst) / 60  # 每秒补充的量
+
+    def refill(self, level, updated, now):
+        return min(self.capacity, level + max(0.0, now - updated) * self.rate)
+
+    def take(self, state, cost, now):
+        """从state中预约cost，返回 (新状态, 需要等待的秒数)"""
+        level = self.refill(*(state or (self.capacity, now)), now) - cost
+        return (level, now), max(0.0, -level / self.rate)
+
+    def give(self, state, amount, now):
+        """退还amount（为负时追加占用）"""
+        if state is None:
+            return None
+        return self.refill(*state, now) + amount, now
+
+
+class MemoryBucketStore:
+    """只在本进程内有效的桶状态"""
+
+    def __init__(self):
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def update(self, names, change):
+        """在锁内取出names对应的状态，由change(states)修改后保存，返回change的返回值"""
+        with self.lock:
+            states = {name: self.states.get(name) for name in names}
+            result = change(states)
+            self.states.update(states)
+            return result
+
+    def close(self):
+        pass
+
+
+class SharedBucketStore:
+    """保存在SQLite文件中的桶状态，写事务互斥，多个进程可同时使用"""
+
+    def __init__(self, path=None):
+        self.path = path or data_path("rate_limits.sqlite3")
+        self.lock = threading.Lock()
+        try:
+            # 自行管理事务；其他实例持有写锁时最多等待10秒
+            self.conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+            )
+        except sqlite3.Error as e:
+            raise QuotaStoreError(f"无法打开共享配额文件 {self.path}: {e}") from e
+
+    def update(self, names, change):
+        with self.lock:
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.Error as e:
+                raise QuotaStoreError(f"共享配额文件不可用: {e}") from e
+            try:
+                placeholders = ",".join("?" * len(names))
+                rows = self.conn.execute(
+                    f"SELECT name, level, updated FROM buckets WHERE name IN ({placeholders})", list(names)
+                ).fetchall()
+                states = {name: None for name in names}
+                states.update((name, (level, updated)) for name, level, updated in rows)
+                result = change(states)
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                    [(name, state[0], state[1]) for name, state in states.items() if state is not None]
+                )
+                self.conn.execute("COMMIT")
+            except BaseException as e:
+                try:
+                    self.conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                if isinstance(e, sqlite3.Error):
+                    raise QuotaStoreError(f"共享配额文件不可用: {e}") from e
+                raise
+            return result
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class Reservation:
+    """一次预约：发送前等待delay秒，完成后用settle结算，放弃时用cancel退还"""
+
+    def __init__(self, model, tokens, delay):
+        self.model = model
+        self.tokens = tokens  # 预约的token数
+        self.delay = delay
+
+
+class RateLimiter:
+    """线程安全，可被多个请求线程和asyncio后端共享"""
+
+    def __init__(self, store=None):
+        self.store = store or MemoryBucketStore()
+        self.store_users = {}  # 存储 -> 正在使用它的操作数，被替换的存储等这些操作结束后才关闭
+        self.limits = {}  # 模型名 -> RateLimit，键None表示未单独设置的模型
+        self.completion_estimates = {}  # 模型名 -> 平滑后的实际输出token数
+        self.lock = threading.Lock()
+
+    def set_limit(self, model, rpm=0, tpm=0, burst=DEFAULT_BURST):
+        """设置模型的配额，model为None时作为其他模型的默认配额"""
+        self.limits[model] = RateLimit(rpm, tpm, burst)
+
+    def share(self, enabled, path=None):
+        """切换是否与本机其他实例共享配额，共享文件无法打开时抛出QuotaStoreError并保持原状"""
+        self._replace_store(SharedBucketStore(path) if enabled else MemoryBucketStore())
+
+    def close(self):
+        self._replace_store(MemoryBucketStore())
+
+    def _replace_store(self, store):
+        with self.lock:
+            old, self.store = self.store, store
+            in_use = old in self.store_users
+        if not in_use:
+            old.close()
+
+    def _update(self, names, change):
+        """在当前存储上执行update；执行期间存储被替换时，由最后一个使用者关闭旧存储"""
+        with self.lock:
+            store = self.store
+            self.store_users[store] = self.store_users.get(store, 0) + 1
+        try:
+            return store.update(names, change)
+        finally:
+            with self.lock:
+                self.store_users[store] -= 1
+                retired = not self.store_users[store] and store is not self.store
+                if not self.store_users[store]:
+                    del self.store_users[store]
+            if retired:
+                store.close()
+
+    def estimate_tokens(self, model, messages, max_tokens):
+        """预约用的token数：输入按字符估算，输出按该模型最近的实际用量估算，尚无数据时按max_tokens"""
+        prompt = sum(estimate_message_tokens(message) for message in messages)
+        with self.lock:
+            completion = self.completion_estimates.get(model, max_tokens)
+        return prompt + min(max_tokens, int(completion))
+
+    def reserve(self, model, tokens):
+        """预约一次请求和tokens个token，返回Reservation，其delay为需要等待的秒数"""
+        buckets = self._buckets(model, 1, tokens)
+        if not buckets:
+            return Reservation(model, tokens, 0.0)
+        now = time.time()
+
+        def change(states):
+            delay = 0.0
+            for name, bucket, cost in buckets:
+                states[name], wait = bucket.take(states[name], cost, now)
+                delay = max(delay, wait)
+            return delay
+        return Reservation(model, tokens, self._update([b[0] for b in buckets], change))
+
+    def try_reserve(self, model, tokens):
+        """配额充足、无需等待时预约并返回Reservation，否则不占用配额并返回None"""
+        buckets = self._buckets(model, 1, tokens)
+        if not buckets:
+            return Reservation(model, tokens, 0.0)
+        now = time.time()
+
+        def change(states):
+            taken = {}
+            for name, bucket, cost in buckets:
+                taken[name], wait = bucket.take(states[name], cost, now)
+                if wait > 0:
+                    return False
+            states.update(taken)
+            return True
+        if self._update([b[0] for b in buckets], change):
+            return Reservation(model, tokens, 0.0)
+        return None
+
+    def settle(self, reservation, usage):
+        """按响应中的usage结算：退还多预约的token，或补扣不足的部分"""
+        if not usage:
+            return
+        completion = usage.get("completion_tokens")
+        if completion is not None:
+            with self.lock:
+                estimate = self.completion_estimates.get(reservation.model)
+                self.completion_estimates[reservation.model] = completion if estimate is None else (
+                    estimate + COMPLETION_SMOOTHING * (completion - estimate))
+        total = usage.get("total_tokens")
+        if total is None:
+            total = (usage.get("prompt_tokens") or 0) + (completion or 0)
+        self._give(reservation.model, 0, reservation.tokens - total)
+
+    def cancel(self, reservation):
+        """请求在等待期间被取消，退还预约的配额"""
+        self._give(reservation.model, 1, reservation.tokens)
+
+    def _buckets(self, model, requests, tokens):
+        """返回该模型需要检查的 [(状态名, TokenBucket, 数量)]"""
+        limit = self.limits.get(model) or self.limits.get(None)
+        if limit is None:
+            return []
+        buckets = []
+        if limit.rpm:
+            buckets.append((f"{model}/rpm", TokenBucket(limit.rpm, limit.burst), requests))
+        if limit.tpm:
+            buckets.append((f"{model}/tpm", TokenBucket(limit.tpm, limit.burst), tokens))
+        return buckets
+
+    def _give(self, model, requests, tokens):
+        buckets = [b for b in self._buckets(model, requests, tokens) if b[2]]
+        if not buckets:
+            return
+        now = time.time()
+
+        def change(states):
+            for name, bucket, amount in buckets:
+                states[name] = bucket.give(states[name], amount, now)
+        try:
+            self._update([b[0] for b in buckets], change)
+        except QuotaStoreError:
+            # 结算和退还只是修正配额，存储不可用时放弃，不影响已经完成或取消的请求
+            pass
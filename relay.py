@@ -0,0 +1,224 @@
+"""本地HTTP中转：在本机提供OpenAI兼容的 /v1/chat/completions 接口，请求经DeepseekService转发
+
+自动化脚本只需指向本机地址，不必各自保存API密钥、处理重试、限速和端点切换；
+同一中转进程内的请求共享连接池、回复缓存和限速配额。
+只使用请求中的 model、messages、temperature、max_tokens 和 stream 字段。
+
+    python -m cli --serve 127.0.0.1:8765
+    curl http://127.0.0.1:8765/v1/chat/completions -d '{"messages": [{"role": "user", "content": "你好"}]}'
+"""
+import json
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from api_client import DeepseekError, RequestCancelled, TransientError
+from endpoint_pool import EndpointPool
+
+MAX_BODY_BYTES = 32 * 1024 * 1024
+
+
+class RelayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, token=None):
+        super().__init__(address, RelayHandler)
+        self.service = service
+        self.token = token  # 设置后要求请求携带 Authorization: Bearer <token>
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+
+class RelayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        client = self.server.service.client
+        status = client.status_text() if isinstance(client, EndpointPool) else client.label()
+        self.send_json(200, {"status": "ok", "endpoints": status})
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error_json(404, "只支持 /v1/chat/completions")
+            return
+        try:
+            data = self.read_json()
+        except (OSError, ValueError):
+            # 请求体可能没有读完，连接上剩余的数据无法再按请求解析
+            self.close_connection = True
+            self.send_error_json(400, "请求体应为包含messages列表的JSON")
+            return
+        error = validate_body(data)
+        if error:
+            self.send_error_json(400, error)
+            return
+        options = {key: data[key] for key in ("temperature", "max_tokens") if data.get(key) is not None}
+        request = self.server.service.request(data["messages"], data.get("model"), bool(data.get("stream")), **options)
+        if request.stream:
+            self.relay_stream(request)
+        else:
+            self.relay(request)
+
+    def relay(self, request):
+        try:
+            text = request.execute()
+        except DeepseekError as e:
+            self.send_error_json(error_status(e), str(e))
+            return
+        except Exception as e:
+            self.send_error_json(500, f"中转内部错误: {e}")
+            return
+        self.send_json(200, {
+            "id": f"relay-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.model_name,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": request.usage,
+        })
+
+    def relay_stream(self, request):
+        """收到第一段增量才发送响应头，之前失败时仍可返回普通的错误响应"""
+        chunk_id = f"relay-{uuid.uuid4().hex}"
+        started = []
+
+        def on_token(delta):
+            if not started:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                started.append(True)
+            try:
+                self.write_event(self.stream_chunk(chunk_id, request, {"content": delta}))
+            except OSError:
+                # 调用方已断开，中断上游请求
+                request.cancel()
+
+        try:
+            request.execute(on_token)
+        except RequestCancelled:
+            self.close_connection = True
+            return
+        except Exception as e:
+            status = error_status(e) if isinstance(e, DeepseekError) else 500
+            message = str(e) if isinstance(e, DeepseekError) else f"中转内部错误: {e}"
+            if not started:
+                self.send_error_json(status, message)
+                return
+            final = {"error": {"message": message}}
+        else:
+            if not started:
+                on_token("")
+            final = self.stream_chunk(chunk_id, request, {}, "stop")
+            final["usage"] = request.usage
+        try:
+            self.write_event(final)
+            self.write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            self.close_connection = True
+
+    def stream_chunk(self, chunk_id, request, delta, finish_reason=None):
+        return {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.model_name,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+
+    def authorized(self):
+        token = self.server.token
+        if token and self.headers.get("Authorization", "") != f"Bearer {token}":
+            self.send_error_json(401, "中转令牌无效")
+            return False
+        return True
+
+    def read_json(self):
+        """读取并解析请求体，长度无效、超过MAX_BODY_BYTES（包括解压后）或不是JSON时抛出ValueError"""
+        length = self.headers.get("Content-Length", "0").strip()
+        if not length.isdigit():
+            raise ValueError(f"Content-Length无效: {length}")
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("请求体过大")
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Encoding", "").lower() == "gzip":
+            # 限制解压后的大小，避免很小的压缩包展开后占满内存
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                body = decompressor.decompress(body, MAX_BODY_BYTES)
+            except zlib.error as e:
+                raise ValueError(f"gzip数据无效: {e}") from e
+            if decompressor.unconsumed_tail:
+                raise ValueError("解压后的请求体过大")
+        return json.loads(body)
+
+    def write_event(self, data):
+        text = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+        payload = f"data: {text}\n\n".encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+        self.wfile.flush()
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json(status, {"error": {"message": message}})
+
+
+def validate_body(data):
+    """检查请求体中用到的字段，有问题时返回错误信息"""
+    if not isinstance(data, dict):
+        return "请求体应为JSON对象"
+    messages = data.get("messages")
+    if not isinstance(messages, list) or not messages:
+        return "messages应为非空列表"
+    for index, message in enumerate(messages):
+        if not (isinstance(message, dict) and isinstance(message.get("role"), str)
+                and isinstance(message.get("content"), str)):
+            return f"messages[{index}]应为包含字符串role和content的对象"
+    if data.get("model") is not None and not isinstance(data["model"], str):
+        return "model应为字符串"
+    temperature = data.get("temperature")
+    if temperature is not None and (isinstance(temperature, bool) or not isinstance(temperature, (int, float))):
+        return "temperature应为数字"
+    max_tokens = data.get("max_tokens")
+    if max_tokens is not None and (isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 1):
+        return "max_tokens应为正整数"
+    return None
+
+
+def error_status(error):
+    """上游错误对应的响应状态码：重试后仍失败的暂时性错误为503，其余为502"""
+    return 503 if isinstance(error, TransientError) else 502
+
+
+def serve(service, host="127.0.0.1", port=8765, token=None, log=print):
+    """启动中转并阻塞运行，Ctrl+C退出"""
+    server = RelayServer((host, port), service, token)
+    log(f"中转已启动：{server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
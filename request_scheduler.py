@@ -0,0 +1,359 @@
+"""请求调度器：在有界的执行后端中并发执行API请求，并保证同一对话内的回复按提交顺序送达
+
+执行后端有两种：
+- "thread"：QThreadPool线程池，每个进行中的请求占用一个工作线程（默认）
+- "asyncio"：单个后台事件循环加httpx异步客户端，见 async_backend
+两种后端通过相同的信号把结果投递回主线程，界面无需区分。
+请求本身的逻辑在不依赖Qt的api_client中，本模块只是图形界面使用的适配层。
+"""
+from collections import deque
+
+from PyQt5.QtCore import QObject, QRunnable, QThread, QThreadPool, pyqtSignal
+
+from api_client import DeepseekClient, DeepseekError, DeepseekRequest, RequestCancelled
+
+DEFAULT_MAX_CONCURRENCY = 4
+BACKENDS = {"thread": "线程池", "asyncio": "asyncio (httpx)"}
+
+
+class TaskSignals(QObject):
+    """工作线程/事件循环通过这些信号把结果投递回调度器所在的主线程"""
+    token = pyqtSignal(int, str)
+    retry = pyqtSignal(int, int, float, str)
+    queued = pyqtSignal(int, float)  # 请求id, 等待限速配额的秒数
+    done = pyqtSignal(int, bool, str)  # 请求id, 是否成功, 回复或错误信息
+
+
+class _RequestTask(QRunnable):
+    def __init__(self, request_id, request, signals):
+        super().__init__()
+        self.setAutoDelete(False)  # 由后端持有，避免排队期间被提前释放
+        self.request_id = request_id
+        self.request = request
+        self.signals = signals
+
+    def run(self):
+        try:
+            text = self.request.execute(
+                lambda delta: self.signals.token.emit(self.request_id, delta),
+                lambda attempt, delay, reason: self.signals.retry.emit(self.request_id, attempt, delay, reason),
+                lambda delay: self.signals.queued.emit(self.request_id, delay)
+            )
+        except DeepseekError as e:
+            self.signals.done.emit(self.request_id, False, str(e))
+        except Exception as e:
+            # 与asyncio后端一致：意外的异常也要送达结果，否则同一对话的后续回复会一直等待
+            self.signals.done.emit(self.request_id, False, f"发生错误: {str(e)}")
+        else:
+            self.signals.done.emit(self.request_id, True, text)
+
+
+class DeepseekThread(QThread):
+    """在单独的QThread中执行一个请求，供不经过调度器的简单场景使用"""
+    result_ready = pyqtSignal(str)
+    error_occurred = pyqtSignal(str)
+    token_received = pyqtSignal(str)  # 流式模式下每收到一段增量文本发出
+    retry_scheduled = pyqtSignal(int, float, str)  # 第几次失败, 等待秒数, 失败原因
+
+    def __init__(self, api_key, api_url, messages, model_name, use_proxy=False, proxy_url="", verify_ssl=True,
+                 stream=False, client=None):
+        super().__init__()
+        # 未传入共享客户端时退化为一次性会话
+        client = client or DeepseekClient(api_url, use_proxy, proxy_url, verify_ssl)
+        self.request = DeepseekRequest(api_key, messages, model_name, client, stream)
+
+    def run(self):
+        try:
+            response_text = self.request.execute(self.token_received.emit, self.retry_scheduled.emit)
+        except DeepseekError as e:
+            self.error_occurred.emit(str(e))
+        else:
+            self.result_ready.emit(response_text)
+
+    def cancel(self):
+        self.request.cancel()
+
+
+class MapReduceThread(QThread):
+    """在单独的QThread中执行大文件的分段处理（见map_reduce），进度和结果通过信号投递回主线程"""
+    progress = pyqtSignal(str, int, int)  # 阶段("map"/"reduce"), 已完成, 总数
+    result_ready = pyqtSignal(str)
+    error_occurred = pyqtSignal(str)
+
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+
+    def run(self):
+        try:
+            text = self.job.run(self.progress.emit)
+        except (DeepseekError, OSError) as e:
+            self.error_occurred.emit(str(e))
+        except Exception as e:
+            # 与_RequestTask一致：意外的异常也要送达结果，否则对话中之后的请求会一直等待
+            self.error_occurred.emit(f"发生错误: {str(e)}")
+        else:
+            self.result_ready.emit(text)
+
+    def cancel(self):
+        self.job.cancel()
+
+
+class ExternalBackend:
+    """在调度器之外执行的请求（见RequestScheduler.submit_external）只在这里登记，取消时转交请求本身"""
+
+    def __init__(self, requests):
+        self.requests = requests  # 调度器的 请求id -> 请求
+
+    def cancel(self, request_id):
+        self.requests[request_id].cancel()
+        return False  # 结果仍由执行方通过finish_external送达
+
+    def discard(self, request_id):
+        pass
+
+
+class ThreadPoolBackend:
+    """每个请求在QThreadPool的工作线程中同步执行"""
+
+    def __init__(self, signals, max_concurrency, parent=None):
+        self.signals = signals
+        self.pool = QThreadPool(parent)
+        self.pool.setMaxThreadCount(max_concurrency)
+        self.tasks = {}
+
+    def start(self, request_id, request):
+        task = _RequestTask(request_id, request, self.signals)
+        self.tasks[request_id] = task
+        self.pool.start(task)
+
+    def cancel(self, request_id):
+        """取消请求；仍在排队时直接移出队列并返回True"""
+        task = self.tasks.get(request_id)
+        if task is None:
+            return False
+        task.request.cancel()
+        return self.pool.tryTake(task)
+
+    def discard(self, request_id):
+        self.tasks.pop(request_id, None)
+
+    def set_max_concurrency(self, value):
+        self.pool.setMaxThreadCount(value)
+
+    def close(self):
+        pass
+
+
+class RequestScheduler(QObject):
+    """按id跟踪进行中的请求，限制并发数，并支持取消
+
+    同一对话（conversation）中的请求按提交顺序依次"轮到"：只有排在最前面的请求
+    会实时发出流式增量，后面请求的增量先缓存，轮到它时再一次性发出。
+    """
+    turn_started = pyqtSignal(int)  # 请求轮到在对话中展示
+    token_received = pyqtSignal(int, str)
+    retry_scheduled = pyqtSignal(int, int, float, str)  # 请求id, 第几次失败, 等待秒数, 失败原因
+    quota_wait = pyqtSignal(int, float)  # 请求id, 等待限速配额的秒数
+    result_ready = pyqtSignal(int, str)
+    error_occurred = pyqtSignal(int, str)
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, parent=None):
+        super().__init__(parent)
+        self.max_concurrency = max_concurrency
+        self._signals = TaskSignals(self)
+        self._signals.token.connect(self._on_token)
+        self._signals.retry.connect(self.retry_scheduled)
+        self._signals.queued.connect(self.quota_wait)
+        self._signals.done.connect(self._on_done)
+        self._backends = {"thread": ThreadPoolBackend(self._signals, max_concurrency, self)}
+        self.backend_name = "thread"
+        self._next_id = 1
+        self._requests = {}  # 请求id -> DeepseekRequest
+        self._external = ExternalBackend(self._requests)
+        self._backend_of = {}  # 请求id -> 执行它的后端
+        self._conversations = {}  # 请求id -> 对话标识
+        self._queues = {}  # 对话标识 -> 按提交顺序排列的请求id
+        self._started = set()  # 已轮到展示的请求
+        self._pending_tokens = {}  # 尚未轮到的请求缓存的增量
+        self._outcomes = {}  # 已完成但尚未轮到的请求结果
+        self._deferred = {}  # 轮到时才创建的请求id -> make_request（见submit_deferred）
+
+    def set_backend(self, name):
+        """切换之后提交的请求所用的执行后端，进行中的请求不受影响
+
+        asyncio后端依赖httpx，未安装时抛出DeepseekError。
+        """
+        if name not in self._backends:
+            if name != "asyncio":
+                raise ValueError(f"未知的执行后端: {name}")
+            from async_backend import AsyncioBackend
+            self._backends[name] = AsyncioBackend(self._signals, self.max_concurrency)
+        self.backend_name = name
+
+    def set_max_concurrency(self, value):
+        self.max_concurrency = value
+        for backend in self._backends.values():
+            backend.set_max_concurrency(value)
+
+    def submit(self, request, conversation=0):
+        """提交DeepseekRequest，返回请求id"""
+        request_id = self._next_id
+        self._next_id += 1
+        backend = self._backends[self.backend_name]
+        self._requests[request_id] = request
+        self._backend_of[request_id] = backend
+        self._conversations[request_id] = conversation
+        queue = self._queues.setdefault(conversation, deque())
+        queue.append(request_id)
+        backend.start(request_id, request)
+        if len(queue) == 1:
+            self._start_turn(request_id)
+        return request_id
+
+    def submit_external(self, request, conversation=0):
+        """登记一个在调度器之外执行的请求（大文件处理、多模型对比中采用的回复等），返回请求id
+
+        它和submit提交的请求一样在对话中按顺序轮到和送达，执行方完成后调用finish_external；
+        取消时调用request.cancel()。
+        """
+        request_id = self._next_id
+        self._next_id += 1
+        self._requests[request_id] = request
+        self._backend_of[request_id] = self._external
+        self._conversations[request_id] = conversation
+        queue = self._queues.setdefault(conversation, deque())
+        queue.append(request_id)
+        if len(queue) == 1:
+            self._start_turn(request_id)
+        return request_id
+
+    def submit_deferred(self, make_request, conversation=0):
+        """提交一个轮到时才创建并开始执行的请求，返回请求id
+
+        对话中前面的请求都送达后才调用make_request()，它构建的上下文因此包含前面的回复；
+        在此之前取消时同样调用make_request()生成请求用于展示，但不发送。
+        对话中没有进行中的请求时等同于submit(make_request(), conversation)。
+        """
+        if not self._queues.get(conversation):
+            return self.submit(make_request(), conversation)
+        request_id = self._next_id
+        self._next_id += 1
+        self._deferred[request_id] = make_request
+        self._requests[request_id] = None
+        self._backend_of[request_id] = self._external
+        self._conversations[request_id] = conversation
+        self._queues[conversation].append(request_id)
+        return request_id
+
+    def finish_external(self, request_id, ok, text):
+        self._on_done(request_id, ok, text)
+
+    def adopt(self, request_id, conversation, delivered=""):
+        """把进行中的请求移到另一个对话的队列末尾，之后像该对话中刚提交的请求一样按顺序送达
+
+        delivered是此前已经通过token_received发出的增量，轮到该请求时会重新发出。
+        请求已送达结果时返回False。
+        """
+        old = self._conversations.get(request_id)
+        if old is None or request_id in self._outcomes:
+            return False
+        self._queues[old].remove(request_id)
+        self._started.discard(request_id)
+        self._release(old)
+        if delivered:
+            self._pending_tokens.setdefault(request_id, []).insert(0, delivered)
+        self._conversations[request_id] = conversation
+        queue = self._queues.setdefault(conversation, deque())
+        queue.append(request_id)
+        if len(queue) == 1:
+            self._start_turn(request_id)
+        return True
+
+    def request(self, request_id):
+        return self._requests.get(request_id)
+
+    def conversation_of(self, request_id):
+        return self._conversations.get(request_id)
+
+    def in_flight(self, conversation=None):
+        """返回尚未送达结果的请求id"""
+        return [request_id for request_id, conv in self._conversations.items()
+                if conversation is None or conv == conversation]
+
+    def cancel(self, request_id):
+        if request_id not in self._requests or request_id in self._outcomes:
+            return
+        make_request = self._deferred.pop(request_id, None)
+        if make_request is not None:
+            self._requests[request_id] = make_request()
+        elif not self._backend_of[request_id].cancel(request_id):
+            return
+        # 尚未开始执行，execute不会记录指标，在这里记为已取消
+        self._requests[request_id].finish("cancelled")
+        self._on_done(request_id, False, str(RequestCancelled()))
+
+    def cancel_conversation(self, conversation):
+        # 从后往前取消：先取消的请求送达时后面的请求已有结果，尚未创建的请求不会因轮到而开始发送
+        for request_id in reversed(self.in_flight(conversation)):
+            self.cancel(request_id)
+
+    def cancel_all(self):
+        for request_id in reversed(self.in_flight()):
+            self.cancel(request_id)
+
+    def shutdown(self):
+        self.cancel_all()
+        for backend in self._backends.values():
+            backend.close()
+
+    def _on_token(self, request_id, delta):
+        if request_id not in self._requests or request_id in self._outcomes:
+            return
+        if request_id in self._started:
+            self.token_received.emit(request_id, delta)
+        else:
+            self._pending_tokens.setdefault(request_id, []).append(delta)
+
+    def _on_done(self, request_id, ok, text):
+        if request_id not in self._requests or request_id in self._outcomes:
+            return
+        self._outcomes[request_id] = (ok, text)
+        self._release(self._conversations[request_id])
+
+    def _release(self, conversation):
+        """按提交顺序送达已完成的结果，并把后续请求依次切换为当前请求"""
+        queue = self._queues.get(conversation)
+        while queue and queue[0] in self._outcomes:
+            # 先出队再发信号，槽函数中再次取消请求时不会重复送达
+            request_id = queue.popleft()
+            ok, text = self._outcomes.pop(request_id)
+            self._start_turn(request_id)
+            if ok:
+                self.result_ready.emit(request_id, text)
+            else:
+                self.error_occurred.emit(request_id, text)
+            self._backend_of.pop(request_id).discard(request_id)
+            del self._requests[request_id]
+            del self._conversations[request_id]
+            self._started.discard(request_id)
+        if queue:
+            self._start_turn(queue[0])
+        elif queue is not None and self._queues.get(conversation) is queue:
+            del self._queues[conversation]
+
+    def _start_turn(self, request_id):
+        if request_id in self._started:
+            return
+        self._started.add(request_id)
+        make_request = self._deferred.pop(request_id, None)
+        if make_request is not None:
+            request = make_request()
+            backend = self._backends[self.backend_name]
+            self._requests[request_id] = request
+            self._backend_of[request_id] = backend
+            backend.start(request_id, request)
+        self.turn_started.emit(request_id)
+        buffered = self._pending_tokens.pop(request_id, None)
+        if buffered:
+            self.token_received.emit(request_id, "".join(buffered))
@@ -0,0 +1,102 @@
+"""回复缓存：相同的模型、消息和参数直接返回已缓存的回复，不再发起网络请求
+
+内存中保留最近使用的条目（LRU），同时持久化到SQLite，按过期时间和条目数淘汰。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app_paths import data_path
+
+DEFAULT_TTL = 7 * 24 * 3600  # 缓存有效期（秒）
+
+
+def make_cache_key(model_name, messages, temperature, max_tokens):
+    """由模型、完整消息列表和采样参数计算缓存键"""
+    payload = json.dumps(
+        [model_name, [[m["role"], m["content"]] for m in messages], temperature, max_tokens],
+        ensure_ascii=False,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, db_path=None, max_memory_entries=256, max_disk_entries=5000, ttl=DEFAULT_TTL):
+        self.db_path = db_path or data_path("response_cache.sqlite3")
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.memory = OrderedDict()  # 缓存键 -> (写入时间, 回复)
+        self.lock = threading.Lock()
+        self.puts_since_evict = 0
+        # 请求在工作线程中执行，连接由锁保护后跨线程共享
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, key):
+        """返回缓存的回复，未命中或已过期时返回None"""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is None:
+                row = self.conn.execute(
+                    "SELECT created_at, response FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                entry = (row[0], row[1])
+                self._remember(key, entry)
+            if now - entry[0] > self.ttl:
+                self.memory.pop(key, None)
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.memory.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, response):
+        entry = (time.time(), response)
+        with self.lock:
+            self._remember(key, entry)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)",
+                (key, response, entry[0])
+            )
+            self.puts_since_evict += 1
+            if self.puts_since_evict >= 50:
+                self._evict_disk()
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def _evict_disk(self):
+        """删除过期条目，并把磁盘上的条目数控制在上限以内（先删最旧的）"""
+        self.puts_since_evict = 0
+        self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+        self.conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,)
+        )
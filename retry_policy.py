@@ -0,0 +1,50 @@
+"""重试策略：对超时、连接错误、429和5xx按指数退避加随机抖动重发同一请求"""
+import math
+import random
+import time
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base_delay=1.0, max_delay=30.0, max_retry_after=120.0):
+        self.max_attempts = max_attempts  # 包含首次请求在内的最大尝试次数
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after  # 服务端Retry-After的上限，避免无限等待
+
+    def is_retryable_status(self, status_code):
+        return status_code in RETRYABLE_STATUS
+
+    def compute_delay(self, attempt, retry_after=None):
+        """第attempt次尝试失败后的等待秒数
+
+        服务端给出Retry-After时按其等待；否则使用"全抖动"指数退避，
+        即在 [0, min(max_delay, base_delay * 2^(attempt-1))] 内随机取值，避免多个客户端同时重发。
+        """
+        if retry_after is not None:
+            return min(max(retry_after, 0.0), self.max_retry_after)
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+
+def parse_retry_after(value):
+    """解析Retry-After响应头（秒数或HTTP日期），无法解析或不是有限数时返回None"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        # "nan"、"inf"也能被float解析，nan经过clamp仍是nan，会让等待抛出异常
+        return seconds if math.isfinite(seconds) else None
+    from email.utils import parsedate_to_datetime  # 很少用到，避免拖慢启动
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
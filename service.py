@@ -0,0 +1,131 @@
+"""不依赖Qt的请求入口：脚本、定时任务、命令行（cli）和本地HTTP中转（relay）共用
+
+    from service import DeepseekService
+    service = DeepseekService(api_key)
+    print(service.complete("你好", system_prompt="你是一个专业翻译助手"))
+    for delta in service.stream("写一首诗"):
+        print(delta, end="", flush=True)
+
+同步接口在调用线程中执行；stream在后台线程中执行请求并逐段返回增量；
+complete_async / stream_async 使用httpx异步客户端（可选依赖），可在任意asyncio事件循环中调用。
+缓存、重试、限速、端点切换等与图形界面使用的是同一套实现。
+"""
+import queue
+import threading
+
+from api_client import DEFAULT_API_URL, DeepseekRequest
+from context_manager import DEFAULT_TOKEN_BUDGET, build_context
+from endpoint_pool import create_client, parse_routes
+from retry_policy import RetryPolicy
+
+_DELTA, _DONE, _ERROR = "delta", "done", "error"
+
+
+class DeepseekService:
+    """持有共享连接池的客户端，线程安全，一个进程创建一个即可"""
+
+    def __init__(self, api_key, api_url=DEFAULT_API_URL, model="deepseek-chat", proxy="", verify_ssl=True,
+                 retries=2, cache=None, rate_limiter=None, compress=False, metrics_recorder=None, pool_size=10):
+        routes = parse_routes(api_url, bool(proxy), proxy)
+        if not routes:
+            raise ValueError("请提供API URL")
+        self.api_key = api_key
+        self.model = model
+        self.retry_policy = RetryPolicy(max_attempts=retries + 1)
+        self.cache = cache  # 可选的ResponseCache
+        self.rate_limiter = rate_limiter  # 可选的RateLimiter
+        self.compress = compress
+        self.metrics_recorder = metrics_recorder
+        self.client = create_client(routes, verify_ssl, pool_size)
+        self.async_clients = None  # 第一次使用异步接口时创建
+
+    def messages(self, prompt, system_prompt="", history=(), budget=DEFAULT_TOKEN_BUDGET):
+        """由提示词、系统提示和历史消息构建消息列表，超出预算时裁剪较早的历史"""
+        return build_context(system_prompt, list(history), prompt, budget)[0]
+
+    def request(self, messages, model=None, stream=False, temperature=0.7, max_tokens=2000):
+        """创建DeepseekRequest，需要取消请求或读取usage、metrics时使用"""
+        return DeepseekRequest(
+            self.api_key, messages, model or self.model, self.client, stream,
+            temperature=temperature, max_tokens=max_tokens, cache=self.cache, retry_policy=self.retry_policy,
+            metrics_recorder=self.metrics_recorder, rate_limiter=self.rate_limiter, compress=self.compress
+        )
+
+    def complete(self, prompt, system_prompt="", history=(), **options):
+        """发送一次请求并返回完整回复，失败时抛出DeepseekError"""
+        return self.request(self.messages(prompt, system_prompt, history), **options).execute()
+
+    def stream(self, prompt, system_prompt="", history=(), **options):
+        """逐段返回回复增量的生成器；提前关闭生成器会取消请求"""
+        request = self.request(self.messages(prompt, system_prompt, history), stream=True, **options)
+        return iterate_request(request)
+
+    async def complete_async(self, prompt, system_prompt="", history=(), **options):
+        from async_backend import execute_async
+        request = self.request(self.messages(prompt, system_prompt, history), **options)
+        return await execute_async(request, self._async_clients())
+
+    async def stream_async(self, prompt, system_prompt="", history=(), **options):
+        """异步生成器版本的stream"""
+        import asyncio
+        from async_backend import execute_async
+        request = self.request(self.messages(prompt, system_prompt, history), stream=True, **options)
+        deltas = asyncio.Queue()
+        task = asyncio.ensure_future(execute_async(request, self._async_clients(), deltas.put_nowait))
+        task.add_done_callback(lambda _: deltas.put_nowait(None))
+        try:
+            while True:
+                delta = await deltas.get()
+                if delta is None:
+                    break
+                yield delta
+            task.result()  # 请求失败时抛出异常
+        finally:
+            if not task.done():
+                request.cancel()
+                task.cancel()
+
+    async def aclose(self):
+        if self.async_clients is not None:
+            await self.async_clients.aclose()
+
+    def close(self):
+        self.client.close()
+
+    def _async_clients(self):
+        if self.async_clients is None:
+            from async_backend import AsyncClients
+            self.async_clients = AsyncClients()
+        return self.async_clients
+
+
+def iterate_request(request, on_retry=None, on_queue=None):
+    """在后台线程中执行request，逐段返回增量；生成器结束时的返回值为完整回复
+
+    请求失败时在迭代处抛出DeepseekError；调用方提前关闭生成器时取消请求。
+    """
+    events = queue.Queue()
+
+    def run():
+        try:
+            text = request.execute(lambda delta: events.put((_DELTA, delta)), on_retry, on_queue)
+        except Exception as e:  # 异常交给迭代的线程抛出
+            events.put((_ERROR, e))
+        else:
+            events.put((_DONE, text))
+
+    threading.Thread(target=run, name="deepseek-stream", daemon=True).start()
+    finished = False
+    try:
+        while True:
+            kind, value = events.get()
+            if kind == _DELTA:
+                yield value
+                continue
+            finished = True
+            if kind == _ERROR:
+                raise value
+            return value
+    finally:
+        if not finished:
+            request.cancel()
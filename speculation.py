@@ -0,0 +1,68 @@
+"""预发送：输入停顿一段时间后在后台提前发送请求，点击发送时若内容未变则直接复用结果
+
+适合系统提示固定、输入较短的模板化用法，常见提示词的等待时间接近于零。
+- 预发送的请求不排队：限速配额不足时直接放弃，把配额留给用户真正发送的请求
+- 没有被采用的预发送所消耗的token计入每小时上限，超出上限后暂停预发送
+"""
+import time
+from collections import deque
+
+HOUR = 3600.0
+
+
+class SpendCap:
+    """滑动一小时窗口内的token消耗上限，0表示不限制"""
+
+    def __init__(self, tokens_per_hour=0):
+        self.tokens_per_hour = tokens_per_hour
+        self.entries = deque()  # [记录时间, token数]，按时间先后排列
+
+    def spent(self, now=None):
+        now = time.monotonic() if now is None else now
+        while self.entries and now - self.entries[0][0] >= HOUR:
+            self.entries.popleft()
+        return sum(entry[1] for entry in self.entries)
+
+    def allow(self, tokens, now=None):
+        return not self.tokens_per_hour or self.spent(now) + tokens <= self.tokens_per_hour
+
+    def charge(self, tokens, now=None):
+        """先按估算记账，返回的记录可用settle改为实际用量"""
+        entry = [time.monotonic() if now is None else now, tokens]
+        self.entries.append(entry)
+        return entry
+
+    def settle(self, entry, tokens):
+        entry[1] = tokens
+
+
+class Speculation:
+    """一次预发送"""
+
+    def __init__(self, prompt, key, request, charge):
+        self.prompt = prompt
+        self.key = key  # 见speculation_key，发送时的请求与之相同才能复用
+        self.request = request
+        self.request_id = None
+        self.charge = charge  # SpendCap中的记账记录
+        self.text = ""  # 已收到的流式增量
+        self.outcome = None  # 完成后为 (是否成功, 回复或错误信息)
+        self.started = time.monotonic()
+
+    def lead(self):
+        """预发送比用户点击发送提前的秒数"""
+        return time.monotonic() - self.started
+
+    def spent_tokens(self):
+        """未被采用时计入上限的token数：有usage时按实际用量，尚未发出时为0，否则保留估算值"""
+        usage = self.request.usage or {}
+        if usage.get("total_tokens") is not None:
+            return usage["total_tokens"]
+        if self.request.attempts == 0:
+            return 0
+        return self.charge[1]
+
+
+def speculation_key(request):
+    """决定请求能否复用的全部输入：密钥、客户端（端点配置）、模型、消息、采样参数和是否流式"""
+    return (request.api_key, id(request.client), request.stream, request.compress, request.cache_key())
@@ -0,0 +1,98 @@
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtWidgets import QHBoxLayout, QLabel, QPushButton, QSplitter, QTextEdit, QVBoxLayout, QWidget
+
+from ui.conversation_view import ConversationRenderer
+
+
+class ComparePane(QWidget):
+    """对比中的一个目标：标题、流式输出的回复、统计信息和"采用此回复"按钮"""
+
+    def __init__(self, title, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.title_label = QLabel(title)
+        self.output_text = QTextEdit()
+        self.output_text.setReadOnly(True)
+        self.stats_label = QLabel("等待回复...")
+        self.stats_label.setStyleSheet("font-weight: normal;")
+        self.stats_label.setWordWrap(True)
+        self.promote_button = QPushButton("采用此回复")
+        self.promote_button.setEnabled(False)
+        layout.addWidget(self.title_label)
+        layout.addWidget(self.output_text, 1)
+        layout.addWidget(self.stats_label)
+        layout.addWidget(self.promote_button)
+        self.renderer = ConversationRenderer(self.output_text)
+
+
+class ComparePanel(QWidget):
+    """多模型对比的并排输出区域，每个目标一栏"""
+    promote_requested = pyqtSignal(int)  # 目标序号
+    close_requested = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        header = QHBoxLayout()
+        self.summary_label = QLabel()
+        self.summary_label.setStyleSheet("font-weight: normal;")
+        close_button = QPushButton("关闭对比")
+        close_button.clicked.connect(self.close_requested)
+        header.addWidget(self.summary_label, 1)
+        header.addWidget(close_button)
+        layout.addLayout(header)
+        self.splitter = QSplitter(Qt.Horizontal)
+        layout.addWidget(self.splitter, 1)
+        self.panes = []
+
+    def start(self, group):
+        """为一次对比创建各目标的输出栏，替换上一次对比"""
+        for pane in self.panes:
+            pane.setParent(None)
+            pane.deleteLater()
+        self.panes = []
+        for index, target in enumerate(group.targets):
+            pane = ComparePane(target.label())
+            pane.promote_button.clicked.connect(lambda checked=False, i=index: self.promote_requested.emit(i))
+            self.splitter.addWidget(pane)
+            self.panes.append(pane)
+        self.splitter.setSizes([1] * len(self.panes))
+        self.summary_label.setText(f"正在对比{len(group.targets)}个目标：{group.prompt[:40]}")
+        self.show()
+
+    def append_delta(self, index, text):
+        self.panes[index].renderer.append_delta(text)
+
+    def set_status(self, index, text):
+        self.panes[index].stats_label.setText(text)
+
+    def finish(self, index, target, first, promotable=True):
+        """目标完成：显示完整回复或错误，first为True时标记为最先完成"""
+        pane = self.panes[index]
+        if target.status == "ok":
+            if pane.renderer.reply_open:
+                pane.renderer.end_reply([{"role": "assistant", "content": target.text}])
+            else:
+                pane.renderer.render_new([{"role": "assistant", "content": target.text}])
+            pane.promote_button.setEnabled(promotable)
+        else:
+            pane.renderer.append_text(f"错误: {target.text}")
+        pane.stats_label.setText(target.stats_text())
+        if first:
+            pane.title_label.setText(f"{target.label()}（最先完成）")
+
+    def set_summary(self, text):
+        self.summary_label.setText(text)
+
+    def mark_promoted(self, index):
+        """回复已写入对话历史，其他回复不能再采用"""
+        for i, pane in enumerate(self.panes):
+            pane.promote_button.setEnabled(False)
+            if i == index:
+                pane.promote_button.setText("已采用")
+
+    def disable_promotion(self):
+        for pane in self.panes:
+            pane.promote_button.setEnabled(False)
@@ -0,0 +1,406 @@
+from collections import OrderedDict
+import re
+
+from PyQt5.QtCore import QCoreApplication, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+from PyQt5.QtGui import QTextBlockFormat, QTextCharFormat, QTextCursor, QTextDocument, QTextDocumentFragment
+
+ROLE_LABELS = {"user": "用户", "assistant": "DeepSeek"}
+MARKDOWN_SUPPORTED = hasattr(QTextDocument, "setMarkdown")  # Qt 5.14及以上
+FRAGMENT_CACHE_SIZE = 500  # 缓存解析结果的消息条数
+TAIL_RENDER_MS = 50  # 流式输出时重新渲染末尾未完成段落的最短间隔
+TAIL_RENDER_LIMIT = 2000  # 未完成部分超过该长度时暂以纯文本显示，避免每次重新渲染都越来越慢
+_LIST_ITEM = re.compile(r"([-*+]|\d+[.)])\s")
+_FENCES = ("```", "~~~")
+
+
+def parse_markdown(text):
+    """把Markdown解析为 (文档片段, 首段格式, 首段字符格式)
+
+    插入片段时第一段会并入光标所在段落、丢失自身格式（如标题、代码块），因此一并返回
+    首段格式，插入后再补上。
+    """
+    return _to_fragment(_markdown_document(text))
+
+
+def _markdown_document(text):
+    """QTextDocument是可重入的，这一步可以在工作线程中进行"""
+    document = QTextDocument()
+    if MARKDOWN_SUPPORTED:
+        document.setMarkdown(text, QTextDocument.MarkdownDialectGitHub)
+    else:
+        document.setPlainText(text)
+    return document
+
+
+def _to_fragment(document):
+    """片段内部的文档属于创建它的线程，插入时Qt会在其下创建子对象，因此要在主线程中创建"""
+    first = document.begin()
+    return QTextDocumentFragment(document), first.blockFormat(), first.charFormat()
+
+
+def stable_length(text):
+    """返回text开头已经完整、之后不会再变化的Markdown段落的长度
+
+    text须从代码块之外开始。段落在空行处结束，但要等下一行出现、确认它不是列表项或缩进的
+    续行时才算完整（避免把一个松散列表拆开）；代码块在结束标记所在行结束。
+    """
+    boundary = 0
+    offset = 0
+    fence = None
+    blank_end = None  # 尚待确认的空行之后的位置
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        # 未写完的最后一行至少要有几个字符，才能判断它是否是列表项
+        if blank_end is not None and stripped and (line.endswith("\n") or len(line) >= 3):
+            if not line[0].isspace() and not _LIST_ITEM.match(line):
+                boundary = blank_end
+            blank_end = None
+        if not line.endswith("\n"):
+            break  # 最后一行还没写完
+        offset += len(line)
+        if fence is not None:
+            if stripped.startswith(fence):
+                fence = None
+                boundary = offset
+        elif stripped.startswith(_FENCES):
+            fence = stripped[:3]
+        elif not stripped:
+            blank_end = offset
+    return boundary
+
+
+class _ParseSignals(QObject):
+    done = pyqtSignal(object, object)  # 缓存键, 解析后的QTextDocument
+
+
+class _ParseTask(QRunnable):
+    def __init__(self, key, text, signals):
+        super().__init__()
+        self.key = key
+        self.text = text
+        self.signals = signals
+
+    def run(self):
+        document = _markdown_document(self.text)
+        document.moveToThread(QCoreApplication.instance().thread())
+        self.signals.done.emit(self.key, document)
+
+
+class MarkdownParser(QObject):
+    """在后台线程中解析消息的Markdown，结果按消息缓存，每条消息只解析一次"""
+    parsed = pyqtSignal(object, object)
+
+    def __init__(self, parent=None, cache_size=FRAGMENT_CACHE_SIZE):
+        super().__init__(parent)
+        self.cache = OrderedDict()  # 缓存键 -> parse_markdown的结果
+        self.cache_size = cache_size
+        self.pending = set()
+        self.uncached = set()  # 结果不进入缓存的键
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self._signals = _ParseSignals(self)
+        self._signals.done.connect(self._on_done)
+
+    def cached(self, key):
+        parsed = self.cache.get(key)
+        if parsed is not None:
+            self.cache.move_to_end(key)
+        return parsed
+
+    def request(self, key, text, cache=True):
+        """cache=False时结果只通过parsed信号发出，用于只显示一次的内容（如流式回复中定稿的段落）"""
+        if key in self.pending or key in self.cache:
+            return
+        self.pending.add(key)
+        if not cache:
+            self.uncached.add(key)
+        self.pool.start(_ParseTask(key, text, self._signals))
+
+    def _on_done(self, key, document):
+        self.pending.discard(key)
+        parsed = _to_fragment(document)
+        if key in self.uncached:
+            self.uncached.discard(key)
+        else:
+            self.cache[key] = parsed
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        self.parsed.emit(key, parsed)
+
+
+class ConversationRenderer:
+    """增量渲染对话记录：新消息和流式增量只追加到文档末尾，不重建整个文档
+
+    DeepSeek的回复按Markdown渲染。已保存的消息先以纯文本显示，后台解析完成后再替换为
+    富文本，解析结果按消息缓存；流式回复中已经完整的段落同样先显示纯文本、在后台解析一次，
+    只有末尾未完成的段落会在主线程中定时重新解析。
+    """
+
+    def __init__(self, text_edit, max_blocks=5000):
+        self.text_edit = text_edit
+        self.max_blocks = max_blocks
+        self.rendered_count = 0  # 已渲染的消息条数
+        self.reply_open = False  # 是否有正在流式输出的回复
+        self.notice_shown = False  # 当前文档是否只是一条提示信息
+        self.anchors = {}  # 消息id -> 指向该消息开头的光标，文档增删时Qt会自动调整其位置
+        self.placeholders = {}  # 缓存键 -> (正文开头的光标, 纯文本正文)，等待替换为富文本
+        self.reply_text = ""  # 正在流式输出的回复全文
+        self.reply_committed = 0  # reply_text中已渲染为最终富文本的长度
+        self.reply_shown = 0  # reply_text中已显示在界面上的长度
+        self.reply_tail = None  # 指向回复中未完成部分开头的光标
+        self.reply_anchor = None
+        self.segment_count = 0  # 已交给后台解析的回复段落数，用于生成缓存键
+        self.parser = MarkdownParser(text_edit)
+        self.parser.parsed.connect(self._replace_placeholder)
+        self.tail_timer = QTimer(text_edit)
+        self.tail_timer.setSingleShot(True)
+        self.tail_timer.setInterval(TAIL_RENDER_MS)
+        self.tail_timer.timeout.connect(self._render_reply)
+        # 超出上限时Qt会自动丢弃最早的文本块，避免超长会话拖慢布局
+        self.text_edit.document().setMaximumBlockCount(max_blocks)
+
+    def render_new(self, messages):
+        """渲染messages中尚未显示的消息"""
+        for message in messages[self.rendered_count:]:
+            # 过滤系统提示词不显示在对话历史中
+            if message["role"] == "assistant":
+                self._render_reply_message(message)
+            elif message["role"] != "system":
+                anchor = self._insert(self._format(message["role"], message["content"]) + "\n")
+                self._set_anchor(message, anchor)
+        self.rendered_count = len(messages)
+
+    def begin_reply(self, role="assistant"):
+        self.reply_anchor = self._insert(self._label(role))
+        self.reply_tail = self._insert("")
+        self.reply_text = ""
+        self.reply_committed = 0
+        self.reply_shown = 0
+        self.reply_open = True
+
+    def append_delta(self, text):
+        """把流式增量追加到当前回复末尾，攒一小段时间后一并渲染
+
+        逐个增量插入时，Qt每次都要重新排版整个段落，长段落下代价很高。
+        """
+        if not self.reply_open:
+            self.begin_reply()
+        self.reply_text += text
+        if not self.tail_timer.isActive():
+            self.tail_timer.start()
+
+    def end_reply(self, messages):
+        """流式回复结束，回复内容已在界面上，只需完成渲染并同步已渲染计数"""
+        if self.reply_open:
+            self._close_reply()
+            self._insert("\n", new_block=False)
+            message = messages[-1]
+            self._set_anchor(message, self.reply_anchor)
+            # 在后台解析完整回复并缓存，重新打开对话时可直接使用
+            self.parser.request(self._key(message), message["content"])
+        self.rendered_count = len(messages)
+
+    def append_text(self, text):
+        """追加不属于对话记录的文本（如错误信息），会结束未完成的流式回复"""
+        if self.reply_open:
+            self._close_reply()
+        self._insert(text)
+
+    def show_notice(self, text):
+        """清空文档并显示提示，下一条消息到来时提示会被清除"""
+        self.rebuild([])
+        self.text_edit.setPlainText(text)
+        self.notice_shown = True
+
+    def rebuild(self, messages):
+        """完整重建文档，仅用于清除历史等需要重排的场景"""
+        self.tail_timer.stop()
+        self.text_edit.clear()
+        self.rendered_count = 0
+        self.reply_open = False
+        self.notice_shown = False
+        self.anchors = {}
+        self.placeholders = {}
+        # 超出文本块上限的较早消息插入后也会立即被丢弃，而文档满后每次插入都要先删除开头的文本块，
+        # 代价很高，因此直接跳过
+        self.rendered_count = self._first_visible(messages)
+        self.render_new(messages)
+
+    def scroll_to_message(self, message_id):
+        """滚动到指定消息并选中其开头的角色标签，消息未显示时返回False"""
+        anchor = self.anchors.get(message_id)
+        if anchor is None:
+            return False
+        cursor = self._cursor_at(anchor.position())
+        cursor.movePosition(QTextCursor.EndOfBlock, QTextCursor.KeepAnchor)
+        # 先滚到底部再定位，使目标消息出现在视口顶部附近
+        scrollbar = self.text_edit.verticalScrollBar()
+        scrollbar.setValue(scrollbar.maximum())
+        self.text_edit.setTextCursor(cursor)
+        self.text_edit.ensureCursorVisible()
+        return True
+
+    def _first_visible(self, messages):
+        blocks = 0
+        for index in range(len(messages) - 1, -1, -1):
+            blocks += messages[index]["content"].count("\n") + 3  # 标签、正文和空行
+            if blocks > self.max_blocks:
+                return index + 1
+        return 0
+
+    def _render_reply_message(self, message):
+        anchor = self._insert(self._label(message["role"]))
+        self._set_anchor(message, anchor)
+        key = self._key(message)
+        parsed = self.parser.cached(key)
+        if parsed is not None:
+            self._edit(lambda: self._insert_parsed(self._new_block(), parsed))
+        else:
+            start = self._insert("")
+            self._insert(message["content"], new_block=False)
+            self.placeholders[key] = (start, message["content"])
+            self.parser.request(key, message["content"])
+        self._insert("\n", new_block=False)
+
+    def _replace_placeholder(self, key, parsed):
+        entry = self.placeholders.pop(key, None)
+        if entry is None:
+            return
+        start, text = entry
+        cursor = self._cursor_at(start.position())
+        cursor.setPosition(start.position() + self._length(text), QTextCursor.KeepAnchor)
+        # 较早的文本块可能已被丢弃，内容对不上时保留纯文本（selectedText用U+2029表示换行）
+        if cursor.selectedText() != text.replace("\n", "\u2029"):
+            return
+
+        def replace():
+            # 流式回复末尾没有未完成部分时，回复的插入点紧跟在这段内容之后，替换后要移到新内容末尾
+            tail_follows = self.reply_open and self.reply_tail.position() == cursor.selectionEnd()
+            cursor.removeSelectedText()
+            self._insert_parsed(cursor, parsed)
+            if tail_follows:
+                self.reply_tail.setPosition(cursor.position())
+        self._edit(replace)
+
+    def _render_reply(self):
+        """重新渲染流式回复中尚未定稿的部分，已完整的段落定稿后不再解析"""
+        if not self.reply_open:
+            return
+        pending = self.reply_text[self.reply_committed:]
+        stable = stable_length(pending)
+        tail = pending[stable:]
+        if len(tail) <= TAIL_RENDER_LIMIT:
+            self._replace_reply(pending[:stable], tail)
+        elif stable:
+            self._replace_reply(pending[:stable], tail, rich_tail=False)
+        else:
+            # 很长且没有段落边界的内容先追加纯文本，等出现边界或回复结束时再渲染
+            self._insert(self.reply_text[self.reply_shown:], new_block=False)
+        self.reply_committed += stable
+        self.reply_shown = len(self.reply_text)
+
+    def _close_reply(self):
+        self.tail_timer.stop()
+        self._replace_reply(self.reply_text[self.reply_committed:], "")
+        self.reply_committed = len(self.reply_text)
+        self.reply_open = False
+
+    def _replace_reply(self, stable, tail, rich_tail=True):
+        def replace():
+            cursor = self._cursor_at(self.reply_tail.position())
+            cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+            if stable:
+                self._insert_segment(cursor, stable)
+                if tail:
+                    cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+                self.reply_tail.setPosition(cursor.position())
+            if tail and rich_tail:
+                self._insert_parsed(cursor, parse_markdown(tail))
+            elif tail:
+                cursor.insertText(tail, QTextCharFormat())
+        self._edit(replace)
+
+    def _insert_segment(self, cursor, text):
+        """插入回复中定稿的段落：先显示纯文本，后台解析完成后由_replace_placeholder替换为富文本"""
+        text = text.rstrip("\n")  # 段落之间的空行由Markdown渲染决定，不显示为空文本块
+        if not text:
+            return
+        start = self._anchor(cursor.position())
+        cursor.insertText(text, QTextCharFormat())
+        self.segment_count += 1
+        key = ("reply", self.segment_count)
+        self.placeholders[key] = (start, text)
+        self.parser.request(key, text, cache=False)
+
+    def _insert_parsed(self, cursor, parsed):
+        fragment, block_format, char_format = parsed
+        start = cursor.position()
+        cursor.insertFragment(fragment)
+        first = self._cursor_at(start)
+        first.setBlockFormat(block_format)
+        first.setBlockCharFormat(char_format)
+
+    def _edit(self, change):
+        """在文档中间修改内容，保持"停留在底部时自动滚动"的行为"""
+        scrollbar = self.text_edit.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum() - 4
+        change()
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
+
+    def _new_block(self):
+        cursor = self._end_cursor()
+        cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+        return cursor
+
+    def _end_cursor(self):
+        cursor = QTextCursor(self.text_edit.document())
+        cursor.movePosition(QTextCursor.End)
+        return cursor
+
+    def _cursor_at(self, position):
+        cursor = QTextCursor(self.text_edit.document())
+        cursor.setPosition(position)
+        return cursor
+
+    def _anchor(self, position):
+        anchor = self._cursor_at(position)
+        # 在光标位置插入文本时光标不后移，之后追加在末尾的文本不会把它挤到后面
+        anchor.setKeepPositionOnInsert(True)
+        return anchor
+
+    def _set_anchor(self, message, anchor):
+        if "id" in message:
+            self.anchors[message["id"]] = anchor
+
+    def _key(self, message):
+        return message.get("id", message["content"])
+
+    def _length(self, text):
+        """Qt按UTF-16编码单元计算位置"""
+        return len(text.encode("utf-16-le")) // 2
+
+    def _label(self, role):
+        return f"【{ROLE_LABELS.get(role, role)}】:"
+
+    def _format(self, role, content):
+        return f"{self._label(role)} {content}"
+
+    def _insert(self, text, new_block=True):
+        """在文档末尾插入文本，返回指向插入位置的光标"""
+        if self.notice_shown:
+            self.text_edit.clear()
+            self.notice_shown = False
+        # 仅当用户停留在底部时才自动滚动，便于回看历史
+        scrollbar = self.text_edit.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum() - 4
+        document = self.text_edit.document()
+        cursor = self._end_cursor()
+        if new_block and not document.isEmpty():
+            cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+        start = cursor.position()
+        cursor.insertText(text)
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
+        return self._anchor(start)
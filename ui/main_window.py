@@ -1,21 +1,79 @@
 # 修改导入部分
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QTextEdit, QPushButton, QLabel, QSplitter,
     QLineEdit, QFormLayout, QCheckBox, QComboBox,
-    QFrame, QSizePolicy  # 添加缺失的QFrame和QSizePolicy
+    QFrame, QSizePolicy,  # 添加缺失的QFrame和QSizePolicy
+    QSpinBox, QFileDialog, QListWidget, QListWidgetItem, QShortcut, QScrollArea
 )
-from PyQt5.QtCore import Qt
-from api_client import DeepseekThread
-from PyQt5.QtGui import QIcon
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+from api_client import DeepseekClient, DeepseekRequest, DeepseekError, RequestCancelled
+from context_manager import build_context, MODEL_TOKEN_BUDGETS, DEFAULT_TOKEN_BUDGET
+from PyQt5.QtGui import QIcon, QKeySequence
+from ui.conversation_view import ConversationRenderer, ROLE_LABELS
+from request_scheduler import RequestScheduler, MapReduceThread, DEFAULT_MAX_CONCURRENCY, BACKENDS
+from response_cache import ResponseCache
+from retry_policy import RetryPolicy
+from metrics import MetricsRecorder, format_summary
+from conversation_store import ConversationStore, SearchReader, SEARCH_CANDIDATES
+from endpoint_pool import EndpointPool, create_client, parse_routes, split_list
+from rate_limiter import RateLimiter, QuotaStoreError
+from fanout import FanoutGroup, parse_targets
+from speculation import SpendCap, Speculation, speculation_key
+from ui.compare_panel import ComparePanel
+from ui.prompt_edit import PromptEdit
+from map_reduce import MapReduceJob, DEFAULT_CHUNK_TOKENS
+from app_paths import data_path
+
+RECENT_MESSAGE_LIMIT = 50  # 打开对话时读取的最近消息条数
+SEARCH_DELAY_MS = 250  # 停止输入后多久开始搜索
+SPECULATE_DELAY_MS = 800  # 默认的预发送停顿时间
+SPECULATE_CAP = 50000  # 默认的预发送每小时token上限
+ATTACHMENT_INSTRUCTION = "请总结这个文件的主要内容"  # 附加文件但没有输入内容时使用的指令
 
 class DeepseekWindow(QMainWindow):
-    def __init__(self):
+    endpoints_changed = pyqtSignal()  # 多端点的健康状态变化，由探测线程或请求线程发出
+    search_finished = pyqtSignal(int, list, bool, float)  # 搜索序号, 结果, 是否只在部分命中中排序, 耗时ms
+    
+    def __init__(self, watchdog=None):
         super().__init__()
         self.message_history = []
         self.system_prompt = ""
+        self.client = None  # 所有请求共享的长连接客户端，配置了多个端点时为EndpointPool
+        self.client_config = None  # 创建self.client时的 (线路列表, 是否验证SSL, 连接池大小)
+        self.retired_clients = []  # 配置变化后被替换、等使用它的请求结束后再关闭的客户端
+        self.token_budgets = dict(MODEL_TOKEN_BUDGETS)  # 每个模型的上下文token预算
+        self.rate_limits = {}  # 模型名 -> (RPM, TPM)，0表示不限制
+        self.rate_limiter = RateLimiter()  # 所有请求共用，超出配额时排队等待
+        self.conversation_id = 0  # 清除历史后递增，旧对话的迟到回复会被忽略
+        self.scheduler = RequestScheduler(parent=self)
+        self.response_cache = None  # 首次启用缓存时才打开缓存数据库
+        self.metrics = MetricsRecorder()
+        self.store = ConversationStore()
+        self.search_executor = ThreadPoolExecutor(max_workers=1)  # 搜索在后台线程执行，不阻塞界面
+        self.search_reader = None  # 首次搜索时在后台线程中打开
+        self.search_generation = 0  # 每次发起搜索时递增，过时的结果直接丢弃
+        self.stored_conversation = None  # 当前对话在存储中的id，发送第一条消息时才创建
+        self.history_at_tail = True  # 从搜索结果跳转后显示的可能是对话中间的片段
+        self.watchdog = watchdog  # 诊断模式下的界面卡顿监视器
+        self.profiler = None
+        self.fanout = None  # 当前的多模型对比（FanoutGroup）
+        self.fanout_requests = {}  # 请求id -> (FanoutGroup, 目标序号)
+        self.fanout_clients = {}  # (线路列表, 是否验证SSL) -> 对比目标单独指定URL时使用的客户端
+        self.speculation = None  # 与当前输入对应、尚未被采用的预发送
+        self.speculations = {}  # 请求id -> 未完成且未被采用的Speculation
+        self.spend_cap = SpendCap(SPECULATE_CAP)
+        self.attachment = None  # 附加的本地文件路径，发送时按段处理而不载入输入框
+        self.attachment_thread = None  # 正在处理附件的MapReduceThread
         self.initUI()
         self.load_styles()  # 新增样式初始化
+        self.open_latest_conversation()
+        if watchdog is not None:
+            self.enable_diagnostics()
     
     def load_styles(self):
         self.setStyleSheet("""
@@ -67,11 +125,77 @@ class DeepseekWindow(QMainWindow):
         settings_layout.addRow("API Key:", self.api_key_input)
         
         self.api_url_input = QLineEdit("https://api.deepseek.com/v1/chat/completions")
+        self.api_url_input.setToolTip("可填写多个URL（用逗号或空格分隔），自动选择最快的可用端点，连接失败时切换到下一个")
         settings_layout.addRow("API URL:", self.api_url_input)
         
+        # 模型选择与对应的上下文预算
+        model_widget = QWidget()
+        model_layout = QHBoxLayout(model_widget)
+        model_layout.setContentsMargins(0, 0, 0, 0)
         self.model_selector = QComboBox()
         self.model_selector.addItems(["deepseek-chat", "deepseek-reasoner"])
-        settings_layout.addRow("选择模型:", self.model_selector)
+        model_layout.addWidget(self.model_selector)
+        model_layout.addWidget(QLabel("上下文预算(tokens):"))
+        self.budget_input = QSpinBox()
+        self.budget_input.setRange(1000, 128000)
+        self.budget_input.setSingleStep(1000)
+        self.budget_input.setValue(self.token_budgets.get(self.model_selector.currentText(), DEFAULT_TOKEN_BUDGET))
+        model_layout.addWidget(self.budget_input)
+        model_layout.addWidget(QLabel("限速 RPM:"))
+        self.rpm_input = QSpinBox()
+        self.rpm_input.setRange(0, 100000)
+        self.rpm_input.setSpecialValueText("不限")
+        self.rpm_input.setToolTip("每分钟最多发送的请求数，超出时排队等待")
+        model_layout.addWidget(self.rpm_input)
+        model_layout.addWidget(QLabel("TPM:"))
+        self.tpm_input = QSpinBox()
+        self.tpm_input.setRange(0, 100000000)
+        self.tpm_input.setSingleStep(10000)
+        self.tpm_input.setSpecialValueText("不限")
+        self.tpm_input.setToolTip("每分钟最多消耗的token数（按估算预约，收到响应后按实际用量结算）")
+        model_layout.addWidget(self.tpm_input)
+        settings_layout.addRow("选择模型:", model_widget)
+        
+        # 多模型对比：同一提示词并发发给多个模型或端点，并排显示回复
+        fanout_widget = QWidget()
+        fanout_layout = QHBoxLayout(fanout_widget)
+        fanout_layout.setContentsMargins(0, 0, 0, 0)
+        self.fanout_checkbox = QCheckBox("多模型对比")
+        self.fanout_checkbox.setToolTip("同时发给下列所有目标，各自的回复并排显示，可选择其中一个写入对话历史")
+        fanout_layout.addWidget(self.fanout_checkbox)
+        self.fanout_targets_input = QLineEdit("deepseek-chat, deepseek-reasoner")
+        self.fanout_targets_input.setToolTip("用逗号分隔多个目标，写作 模型 或 模型@API URL，不写URL时使用上面配置的端点")
+        self.fanout_targets_input.setEnabled(False)
+        fanout_layout.addWidget(self.fanout_targets_input)
+        settings_layout.addRow("对比目标:", fanout_widget)
+        
+        # 预发送：输入停顿后在后台提前发送，点击发送时内容未变则直接复用
+        speculate_widget = QWidget()
+        speculate_layout = QHBoxLayout(speculate_widget)
+        speculate_layout.setContentsMargins(0, 0, 0, 0)
+        self.speculate_checkbox = QCheckBox("输入停顿后提前发送")
+        self.speculate_checkbox.setToolTip("适合系统提示固定、输入较短的场景；点击发送时输入和设置未变则直接使用已收到的回复")
+        speculate_layout.addWidget(self.speculate_checkbox)
+        speculate_layout.addWidget(QLabel("停顿:"))
+        self.speculate_delay_input = QSpinBox()
+        self.speculate_delay_input.setRange(200, 10000)
+        self.speculate_delay_input.setSingleStep(100)
+        self.speculate_delay_input.setValue(SPECULATE_DELAY_MS)
+        self.speculate_delay_input.setSuffix(" ms")
+        speculate_layout.addWidget(self.speculate_delay_input)
+        speculate_layout.addWidget(QLabel("每小时上限:"))
+        self.speculate_cap_input = QSpinBox()
+        self.speculate_cap_input.setRange(0, 100000000)
+        self.speculate_cap_input.setSingleStep(10000)
+        self.speculate_cap_input.setValue(SPECULATE_CAP)
+        self.speculate_cap_input.setSpecialValueText("不限")
+        self.speculate_cap_input.setSuffix(" tokens")
+        self.speculate_cap_input.setToolTip("未被采用的预发送每小时最多消耗的token数，超出后暂停预发送")
+        speculate_layout.addWidget(self.speculate_cap_input)
+        speculate_layout.addStretch()
+        settings_layout.addRow("预发送:", speculate_widget)
+        self.speculate_timer = QTimer(self)
+        self.speculate_timer.setSingleShot(True)
         
         # 代理设置
         proxy_widget = QWidget()
@@ -81,6 +205,7 @@ class DeepseekWindow(QMainWindow):
         proxy_layout.addWidget(self.use_proxy_checkbox)
         self.proxy_url_input = QLineEdit()
         self.proxy_url_input.setPlaceholderText("http://proxy.example.com:port")
+        self.proxy_url_input.setToolTip("可填写多个代理（用逗号或空格分隔），direct 表示直连，每个API URL会与每条代理线路组合")
         proxy_layout.addWidget(self.proxy_url_input)
         settings_layout.addRow("代理设置:", proxy_widget)
         
@@ -88,6 +213,41 @@ class DeepseekWindow(QMainWindow):
         self.verify_ssl_checkbox.setChecked(True)
         settings_layout.addRow("SSL选项:", self.verify_ssl_checkbox)
         
+        # 请求选项：流式输出与最大并发数
+        request_widget = QWidget()
+        request_layout = QHBoxLayout(request_widget)
+        request_layout.setContentsMargins(0, 0, 0, 0)
+        self.stream_checkbox = QCheckBox("流式输出（边生成边显示）")
+        self.stream_checkbox.setChecked(True)
+        request_layout.addWidget(self.stream_checkbox)
+        self.cache_checkbox = QCheckBox("缓存回复")
+        self.cache_checkbox.setToolTip("相同的模型、对话和参数直接使用缓存的回复，不再发送请求")
+        request_layout.addWidget(self.cache_checkbox)
+        self.shared_quota_checkbox = QCheckBox("多开共享配额")
+        self.shared_quota_checkbox.setToolTip("本机同时运行的多个程序实例共用同一份RPM/TPM配额")
+        request_layout.addWidget(self.shared_quota_checkbox)
+        self.compress_checkbox = QCheckBox("压缩请求体")
+        self.compress_checkbox.setToolTip("用gzip压缩较大的请求体（长对话、长文档），需要服务端支持")
+        request_layout.addWidget(self.compress_checkbox)
+        request_layout.addWidget(QLabel("最大并发:"))
+        self.concurrency_input = QSpinBox()
+        self.concurrency_input.setRange(1, 256)
+        self.concurrency_input.setValue(DEFAULT_MAX_CONCURRENCY)
+        request_layout.addWidget(self.concurrency_input)
+        request_layout.addWidget(QLabel("失败重试:"))
+        self.retry_input = QSpinBox()
+        self.retry_input.setRange(0, 10)
+        self.retry_input.setValue(2)
+        self.retry_input.setSuffix(" 次")
+        request_layout.addWidget(self.retry_input)
+        request_layout.addWidget(QLabel("执行后端:"))
+        self.backend_selector = QComboBox()
+        for name, label in BACKENDS.items():
+            self.backend_selector.addItem(label, name)
+        request_layout.addWidget(self.backend_selector)
+        request_layout.addStretch()
+        settings_layout.addRow("请求选项:", request_widget)
+        
         # 在API设置部分添加提示词输入
         self.prompt_input = QTextEdit()
         self.prompt_input.setPlaceholderText("请输入系统提示词（例如：你是一个专业翻译助手）")
@@ -134,10 +294,15 @@ class DeepseekWindow(QMainWindow):
         self.input_widget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred)
         self.output_widget.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         
-        # 限制设置区域的最大高度
-        settings_widget.setMaximumHeight(280)
+        # 限制设置区域的最大高度，设置项放不下时在区域内滚动
+        settings_area = QScrollArea()
+        settings_area.setWidget(settings_widget)
+        settings_area.setWidgetResizable(True)
+        settings_area.setFrameShape(QFrame.NoFrame)
+        settings_area.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Fixed)
+        settings_area.setMaximumHeight(280)
         
-        main_layout.addWidget(settings_widget)
+        main_layout.addWidget(settings_area)
         
         # 分割器布局
         splitter = QSplitter(Qt.Vertical)
@@ -146,12 +311,34 @@ class DeepseekWindow(QMainWindow):
         input_widget = QWidget()
         input_layout = QVBoxLayout(input_widget)
         input_label = QLabel("输入:")
-        self.input_text = QTextEdit()
+        self.input_text = PromptEdit()
+        self.input_text.large_paste.connect(self.attach_pasted_text)
+        self.input_text.files_dropped.connect(lambda paths: self.set_attachment(paths[0]))
         send_button = QPushButton("发送到Deepseek")
         send_button.clicked.connect(self.process_input)
+        cancel_button = QPushButton("取消请求")
+        cancel_button.clicked.connect(self.cancel_requests)
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(send_button)
+        button_layout.addWidget(cancel_button)
+        
+        # 附件：大文件按段发送，输入框中的内容作为处理指令
+        attachment_layout = QHBoxLayout()
+        attach_button = QPushButton("附加文件")
+        attach_button.clicked.connect(self.choose_attachment)
+        self.attachment_label = QLabel()
+        self.attachment_label.setStyleSheet("font-weight: normal;")
+        self.remove_attachment_button = QPushButton("移除附件")
+        self.remove_attachment_button.clicked.connect(lambda: self.set_attachment(None))
+        attachment_layout.addWidget(attach_button)
+        attachment_layout.addWidget(self.attachment_label, 1)
+        attachment_layout.addWidget(self.remove_attachment_button)
+        self.set_attachment(None)
+        
         input_layout.addWidget(input_label)
         input_layout.addWidget(self.input_text)
-        input_layout.addWidget(send_button)
+        input_layout.addLayout(attachment_layout)
+        input_layout.addLayout(button_layout)
         
         # 输出区域
         output_widget = QWidget()
@@ -161,9 +348,49 @@ class DeepseekWindow(QMainWindow):
         self.output_text.setReadOnly(True)
         clear_button = QPushButton("清除对话历史")
         clear_button.clicked.connect(self.clear_history)
-        output_layout.addWidget(clear_button)
+        
+        # 对话选择：切换已保存的对话，按需加载更早的消息
+        conversation_layout = QHBoxLayout()
+        conversation_layout.addWidget(QLabel("对话:"))
+        self.conversation_selector = QComboBox()
+        self.conversation_selector.setMinimumWidth(240)
+        conversation_layout.addWidget(self.conversation_selector, 1)
+        self.load_older_button = QPushButton("加载更早消息")
+        self.load_older_button.setEnabled(False)
+        self.load_older_button.clicked.connect(self.load_older_messages)
+        conversation_layout.addWidget(self.load_older_button)
+        conversation_layout.addWidget(clear_button)
+        output_layout.addLayout(conversation_layout)
+        
+        # 全文搜索：搜索所有已保存的对话，点击结果跳转到对应消息
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("搜索历史对话...")
+        self.search_input.setClearButtonEnabled(True)
+        self.search_results = QListWidget()
+        self.search_results.setMaximumHeight(160)
+        self.search_results.hide()
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY_MS)
+        output_layout.addWidget(self.search_input)
+        output_layout.addWidget(self.search_results)
         output_layout.addWidget(output_label)
-        output_layout.addWidget(self.output_text)
+        self.compare_panel = ComparePanel()
+        self.compare_panel.hide()
+        output_layout.addWidget(self.compare_panel, 1)
+        output_layout.addWidget(self.output_text, 1)
+        
+        # 请求统计面板
+        stats_layout = QHBoxLayout()
+        self.stats_label = QLabel(format_summary(self.metrics.summary()))
+        self.stats_label.setStyleSheet("font-weight: normal;")
+        export_button = QPushButton("导出统计")
+        export_button.clicked.connect(self.export_metrics)
+        stats_layout.addWidget(self.stats_label, 1)
+        stats_layout.addWidget(export_button)
+        output_layout.addLayout(stats_layout)
+        
+        self.renderer = ConversationRenderer(self.output_text)
         
         splitter.addWidget(input_widget)
         splitter.addWidget(output_widget)
@@ -172,83 +399,790 @@ class DeepseekWindow(QMainWindow):
         
         # 状态栏和信号连接
         self.statusBar().showMessage('准备就绪')
+        self.endpoint_label = QLabel()
+        self.endpoint_label.setStyleSheet("font-weight: normal;")
+        self.endpoint_label.hide()
+        self.statusBar().addPermanentWidget(self.endpoint_label)
+        self.endpoints_changed.connect(self.show_endpoints)
         self.use_proxy_checkbox.toggled.connect(self.toggle_proxy_input)
+        self.fanout_checkbox.toggled.connect(self.fanout_targets_input.setEnabled)
+        self.input_text.textChanged.connect(self.input_changed)
+        self.speculate_timer.timeout.connect(self.speculate)
+        self.speculate_checkbox.toggled.connect(self.input_changed)
+        self.speculate_cap_input.valueChanged.connect(self.save_spend_cap)
         self.proxy_url_input.setEnabled(False)
+        self.model_selector.currentTextChanged.connect(self.show_model_budget)
+        self.budget_input.valueChanged.connect(self.save_model_budget)
+        self.model_selector.currentTextChanged.connect(self.show_rate_limit)
+        self.rpm_input.valueChanged.connect(self.save_rate_limit)
+        self.tpm_input.valueChanged.connect(self.save_rate_limit)
+        self.shared_quota_checkbox.toggled.connect(self.toggle_shared_quota)
+        self.concurrency_input.valueChanged.connect(self.scheduler.set_max_concurrency)
+        self.backend_selector.currentIndexChanged.connect(self.change_backend)
+        self.scheduler.turn_started.connect(self.start_turn)
+        self.scheduler.token_received.connect(self.append_stream_token)
+        self.scheduler.retry_scheduled.connect(self.show_retry)
+        self.scheduler.quota_wait.connect(self.show_quota_wait)
+        self.scheduler.result_ready.connect(self.update_output)
+        self.scheduler.error_occurred.connect(self.handle_error)
+        self.scheduler.token_received.connect(self.append_fanout_token)
+        self.scheduler.result_ready.connect(lambda request_id, text: self.finish_fanout_target(request_id, True, text))
+        self.scheduler.error_occurred.connect(lambda request_id, text: self.finish_fanout_target(request_id, False, text))
+        self.scheduler.token_received.connect(self.append_speculation_token)
+        self.scheduler.result_ready.connect(lambda request_id, text: self.finish_speculation(request_id, True, text))
+        self.scheduler.error_occurred.connect(lambda request_id, text: self.finish_speculation(request_id, False, text))
+        self.scheduler.result_ready.connect(lambda request_id, text: self.close_idle_clients(request_id))
+        self.scheduler.error_occurred.connect(lambda request_id, text: self.close_idle_clients(request_id))
+        self.compare_panel.promote_requested.connect(self.promote_fanout)
+        self.compare_panel.close_requested.connect(self.close_compare)
+        self.conversation_selector.activated.connect(self.switch_conversation)
+        self.search_input.textChanged.connect(self.search_timer.start)
+        self.search_input.returnPressed.connect(self.search_messages)
+        self.search_timer.timeout.connect(self.search_messages)
+        self.search_finished.connect(self.show_search_results)
+        self.search_results.itemActivated.connect(self.open_search_result)
+        self.search_results.itemClicked.connect(self.open_search_result)
         
     def toggle_proxy_input(self, checked):
         self.proxy_url_input.setEnabled(checked)
+    
+    def show_model_budget(self, model_name):
+        self.budget_input.setValue(self.token_budgets.get(model_name, DEFAULT_TOKEN_BUDGET))
+    
+    def save_model_budget(self, value):
+        self.token_budgets[self.model_selector.currentText()] = value
+    
+    def show_rate_limit(self, model_name):
+        rpm, tpm = self.rate_limits.get(model_name, (0, 0))
+        self.rpm_input.setValue(rpm)
+        self.tpm_input.setValue(tpm)
+    
+    def save_rate_limit(self):
+        model_name = self.model_selector.currentText()
+        limit = (self.rpm_input.value(), self.tpm_input.value())
+        self.rate_limits[model_name] = limit
+        self.rate_limiter.set_limit(model_name, *limit)
         
+    def toggle_shared_quota(self, enabled):
+        try:
+            self.rate_limiter.share(enabled)
+        except QuotaStoreError as e:
+            self.shared_quota_checkbox.blockSignals(True)
+            self.shared_quota_checkbox.setChecked(not enabled)
+            self.shared_quota_checkbox.blockSignals(False)
+            self.statusBar().showMessage(str(e))
+    
     def clear_history(self):
+        # 已保存的对话仍保留在存储中，可通过对话列表重新打开
+        self.leave_conversation()
+        self.stored_conversation = None
         self.message_history = []
-        self.output_text.setText("对话历史已清除")
+        self.history_at_tail = True
+        self.renderer.show_notice("对话历史已清除")
+        self.refresh_conversation_list()
         self.statusBar().showMessage('对话历史已清除')
+    
+    def leave_conversation(self):
+        # 取消旧对话中未完成的请求
+        self.scheduler.cancel_conversation(self.conversation_id)
+        self.cancel_speculation()
+        self.conversation_id += 1
+    
+    def refresh_conversation_list(self):
+        self.conversation_selector.clear()
+        self.conversation_selector.addItem("（新对话）", None)
+        for conversation in self.store.list_conversations():
+            title = conversation["title"] or "未命名对话"
+            self.conversation_selector.addItem(f"{title}（{conversation['message_count']}条）", conversation["id"])
+        index = self.conversation_selector.findData(self.stored_conversation)
+        self.conversation_selector.setCurrentIndex(max(index, 0))
+    
+    def open_latest_conversation(self):
+        conversations = self.store.list_conversations(limit=1)
+        if conversations:
+            self.open_conversation(conversations[0]["id"])
+        else:
+            self.refresh_conversation_list()
+    
+    def switch_conversation(self, index):
+        conversation_id = self.conversation_selector.itemData(index)
+        if conversation_id == self.stored_conversation:
+            return
+        if conversation_id is None:
+            self.clear_history()
+        else:
+            self.open_conversation(conversation_id)
+    
+    def open_conversation(self, conversation_id):
+        """打开已保存的对话，只加载最近的若干条消息"""
+        self.leave_conversation()
+        self.stored_conversation = conversation_id
+        self.message_history = self.store.load_recent(conversation_id, RECENT_MESSAGE_LIMIT)
+        self.history_at_tail = True
+        self.renderer.rebuild(self.message_history)
+        self.update_load_older_button()
+        self.refresh_conversation_list()
+        self.statusBar().showMessage(f'已打开对话，显示最近{len(self.message_history)}条消息')
+    
+    def load_older_messages(self):
+        if self.stored_conversation is None or not self.message_history:
+            return
+        older = self.store.load_before(self.stored_conversation, self.message_history[0]["id"], RECENT_MESSAGE_LIMIT)
+        self.message_history = older + self.message_history
+        self.renderer.rebuild(self.message_history)
+        self.update_load_older_button()
+        self.statusBar().showMessage(f'已加载{len(older)}条更早的消息')
+    
+    def search_messages(self):
+        """在后台线程中搜索，结果由show_search_results显示；输入继续变化时只显示最后一次搜索的结果"""
+        self.search_timer.stop()
+        self.search_generation += 1
+        query = self.search_input.text().strip()
+        if not query:
+            self.search_results.clear()
+            self.search_results.hide()
+            return
+        self.search_executor.submit(self.run_search, self.search_generation, query)
+    
+    def run_search(self, generation, query):
+        """在搜索线程中执行；排队期间已有更新的搜索时跳过"""
+        if generation != self.search_generation:
+            return
+        if self.search_reader is None:
+            self.search_reader = SearchReader(self.store.db_path, self.store.fts_enabled)
+        started = time.perf_counter()
+        hits, capped = self.search_reader.search(query)
+        self.search_finished.emit(generation, hits, capped, (time.perf_counter() - started) * 1000)
+    
+    def show_search_results(self, generation, hits, capped, elapsed):
+        if generation != self.search_generation:
+            return
+        self.search_results.clear()
+        for hit in hits:
+            role = ROLE_LABELS.get(hit["role"], hit["role"])
+            snippet = " ".join(hit["snippet"].split())
+            item = QListWidgetItem(f"[{hit['title'] or '未命名对话'}] {role}: {snippet}")
+            item.setData(Qt.UserRole, (hit["conversation_id"], hit["id"]))
+            self.search_results.addItem(item)
+        self.search_results.setVisible(bool(hits))
+        message = f'找到{len(hits)}条结果（{elapsed:.0f} ms）'
+        if capped:
+            message += f'，命中过多，仅按相关度排序最近的{SEARCH_CANDIDATES}条命中'
+        self.statusBar().showMessage(message)
+    
+    def open_search_result(self, item):
+        conversation_id, message_id = item.data(Qt.UserRole)
+        self.jump_to_message(conversation_id, message_id)
+    
+    def jump_to_message(self, conversation_id, message_id):
+        """打开消息所在的对话，加载它前后的若干条消息并滚动到该消息"""
+        self.leave_conversation()
+        self.stored_conversation = conversation_id
+        self.message_history = self.store.load_around(conversation_id, message_id, RECENT_MESSAGE_LIMIT)
+        self.history_at_tail = not (self.message_history and self.store.has_after(
+            conversation_id, self.message_history[-1]["id"]))
+        self.renderer.rebuild(self.message_history)
+        self.renderer.scroll_to_message(message_id)
+        self.update_load_older_button()
+        self.refresh_conversation_list()
+        self.statusBar().showMessage('已跳转到搜索结果')
+    
+    def update_load_older_button(self):
+        has_older = (self.stored_conversation is not None and bool(self.message_history)
+                     and self.store.has_before(self.stored_conversation, self.message_history[0]["id"]))
+        self.load_older_button.setEnabled(has_older)
+    
+    def add_message(self, role, content):
+        """把消息写入当前对话（追加到存储并加入内存中的历史）"""
+        if self.stored_conversation is None:
+            self.stored_conversation = self.store.create_conversation()
+            message_id = self.store.append_message(self.stored_conversation, role, content)
+            self.refresh_conversation_list()
+        else:
+            message_id = self.store.append_message(self.stored_conversation, role, content)
+        self.message_history.append({"id": message_id, "role": role, "content": content})
         
     def process_input(self):
         # 获取系统提示词
         system_prompt = self.prompt_input.toPlainText().strip()
         
         prompt = self.input_text.toPlainText().strip()
-        api_key = self.api_key_input.text().strip()
-        api_url = self.api_url_input.text().strip()
-        use_proxy = self.use_proxy_checkbox.isChecked()
-        proxy_url = self.proxy_url_input.text().strip() if use_proxy else ""
-        verify_ssl = self.verify_ssl_checkbox.isChecked()
+        api_key, api_url, use_proxy, proxy_url, verify_ssl = self.connection_settings()
+        stream = self.stream_checkbox.isChecked()
         model_name = self.model_selector.currentText()
         
-        if not prompt:
+        if not prompt and self.attachment is None:
             self.statusBar().showMessage('请输入内容')
             return
             
-        if not api_key or not api_url:
-            self.statusBar().showMessage('请填写API配置')
+        error = self.check_settings(api_key, api_url, use_proxy, proxy_url)
+        if error:
+            self.statusBar().showMessage(error)
             return
             
-        if use_proxy and not proxy_url:
-            self.statusBar().showMessage('已启用代理但未设置代理URL')
+        if not self.history_at_tail:
+            # 正在查看搜索跳转的历史片段，发送前回到对话末尾，保证上下文是最近的消息
+            self.open_conversation(self.stored_conversation)
+            
+        if self.attachment is not None:
+            self.start_attachment(prompt or ATTACHMENT_INSTRUCTION, system_prompt, api_key, model_name,
+                                  self.get_client(api_url, use_proxy, proxy_url, verify_ssl))
+            return
+            
+        targets = parse_targets(self.fanout_targets_input.text()) if self.fanout_checkbox.isChecked() else []
+        if self.fanout_checkbox.isChecked() and not targets:
+            self.statusBar().showMessage('请填写对比目标')
             return
             
-        self.statusBar().showMessage('正在处理...')
+        # 构建消息历史（包含系统提示），超出预算时裁剪较早的轮次；对比时按各模型中最小的预算
+        models = [model for model, _ in targets] or [model_name]
+        budget = min(self.token_budgets.get(model, DEFAULT_TOKEN_BUDGET) for model in models)
+        current_messages, stats = build_context(system_prompt, self.message_history, prompt, budget)
+        status = f"正在处理... 发送约{stats['sent_tokens']} tokens"
+        if targets:
+            status = f"正在对比{len(targets)}个目标... 每个发送约{stats['sent_tokens']} tokens"
+        if stats['dropped_messages']:
+            status += f"，已裁剪{stats['dropped_messages']}条较早消息（约{stats['dropped_tokens']} tokens）"
+        self.statusBar().showMessage(status)
         
-        # 构建消息历史（包含系统提示）
-        current_messages = []
-        if system_prompt:
-            current_messages.append({"role": "system", "content": system_prompt})
-        current_messages.extend(self.message_history)
-        current_messages.append({"role": "user", "content": prompt})
+        client = self.get_client(api_url, use_proxy, proxy_url, verify_ssl)
+        if targets:
+            self.start_fanout(FanoutGroup(prompt, current_messages, targets, self.conversation_id), api_key,
+                              client, stream, use_proxy, proxy_url, verify_ssl)
+            self.input_text.clear()
+            return
         
-        # 更新消息历史显示
-        self.message_history.append({"role": "user", "content": prompt})
-        self.update_conversation_display()
+        if self.scheduler.in_flight(self.conversation_id):
+            # 前一条回复尚未送达时，上下文以尚无回复的用户消息结尾，API会收到两条相连的用户消息；
+            # 改为轮到该请求时再按当时的历史构建上下文，包含前一条回复
+            self.cancel_speculation()
+            self.scheduler.submit_deferred(
+                lambda: self.create_request(
+                    api_key, build_context(system_prompt, self.message_history, prompt, budget)[0], model_name,
+                    self.get_client(api_url, use_proxy, proxy_url, verify_ssl), stream),
+                self.conversation_id)
+            self.statusBar().showMessage('已排队，前一条回复送达后发送')
+            self.input_text.clear()
+            return
         
-        # 创建线程时传递 current_messages
-        self.thread = DeepseekThread(
-            api_key, 
-            api_url, 
-            current_messages,  # 传递包含系统提示的消息
+        # 提交到调度器，轮到该请求时才把用户消息写入历史并显示
+        request = self.create_request(api_key, current_messages, model_name, client, stream)
+        speculation, self.speculation = self.speculation, None
+        # 已完成的预发送会立即显示，对话中还有更早的请求未送达时不能插到它们前面
+        if (speculation is not None and speculation.key == speculation_key(request)
+                and (speculation.outcome is None or not self.scheduler.in_flight(self.conversation_id))):
+            self.adopt_speculation(speculation)
+        else:
+            self.cancel_speculation(speculation)
+            self.scheduler.submit(request, self.conversation_id)
+        self.input_text.clear()
+    
+    def connection_settings(self):
+        """返回 (API密钥, API URL, 是否使用代理, 代理URL, 是否验证SSL)"""
+        use_proxy = self.use_proxy_checkbox.isChecked()
+        return (self.api_key_input.text().strip(), self.api_url_input.text().strip(), use_proxy,
+                self.proxy_url_input.text().strip() if use_proxy else "", self.verify_ssl_checkbox.isChecked())
+    
+    def check_settings(self, api_key, api_url, use_proxy, proxy_url):
+        """API配置不完整时返回提示信息"""
+        if not api_key or not split_list(api_url):
+            return '请填写API配置'
+        if use_proxy and not proxy_url:
+            return '已启用代理但未设置代理URL'
+        return None
+    
+    def create_request(self, api_key, messages, model_name, client, stream, speculative=False):
+        """按当前的缓存、重试、限速和压缩选项创建请求，messages包含系统提示
+
+        预发送的请求不重试，避免为一个可能用不上的请求反复等待。
+        """
+        return DeepseekRequest(
+            api_key,
+            messages,
             model_name,
-            use_proxy, 
-            proxy_url, 
-            verify_ssl
+            client,
+            stream,
+            cache=self.get_cache() if self.cache_checkbox.isChecked() else None,
+            retry_policy=RetryPolicy(max_attempts=1 if speculative else self.retry_input.value() + 1),
+            metrics_recorder=self.metrics,
+            rate_limiter=self.rate_limiter,
+            compress=self.compress_checkbox.isChecked(),
+            speculative=speculative
         )
-        self.thread.result_ready.connect(self.update_output)
-        self.thread.error_occurred.connect(self.handle_error)
-        self.thread.start()
+    
+    def save_spend_cap(self, value):
+        self.spend_cap.tokens_per_hour = value
+    
+    def input_changed(self):
+        """输入变化时放弃与之不符的预发送，停顿足够久后再预发送新的内容"""
+        speculation = self.speculation
+        if speculation is not None and speculation.prompt != self.input_text.toPlainText().strip():
+            self.cancel_speculation()
+        if self.speculate_checkbox.isChecked():
+            self.speculate_timer.start(self.speculate_delay_input.value())
+        else:
+            self.speculate_timer.stop()
+            self.cancel_speculation()
+    
+    def speculate(self):
+        """按当前输入和设置在后台提前发送请求，结果暂不显示"""
+        prompt = self.input_text.toPlainText().strip()
+        if not prompt or self.fanout_checkbox.isChecked() or not self.speculate_checkbox.isChecked():
+            return
+        # 对话中还有请求未完成时，发送前历史还会变化，预发送的上下文必然不符
+        if not self.history_at_tail or self.scheduler.in_flight(self.conversation_id):
+            return
+        api_key, api_url, use_proxy, proxy_url, verify_ssl = self.connection_settings()
+        if self.check_settings(api_key, api_url, use_proxy, proxy_url):
+            return
+        model_name = self.model_selector.currentText()
+        budget = self.token_budgets.get(model_name, DEFAULT_TOKEN_BUDGET)
+        messages, _ = build_context(self.prompt_input.toPlainText().strip(), self.message_history, prompt, budget)
+        request = self.create_request(api_key, messages, model_name,
+                                      self.get_client(api_url, use_proxy, proxy_url, verify_ssl),
+                                      self.stream_checkbox.isChecked(), speculative=True)
+        key = speculation_key(request)
+        if self.speculation is not None and self.speculation.key == key:
+            return
+        tokens = self.rate_limiter.estimate_tokens(model_name, messages, request.max_tokens)
+        if not self.spend_cap.allow(tokens):
+            self.statusBar().showMessage('预发送已达到每小时token上限，暂停预发送')
+            return
+        self.cancel_speculation()
+        speculation = Speculation(prompt, key, request, self.spend_cap.charge(tokens))
+        # 单独的队列，结果由预发送自己的槽函数处理，不会显示在对话中
+        speculation.request_id = self.scheduler.submit(request, ("speculative", id(speculation)))
+        self.speculation = speculation
+        self.speculations[speculation.request_id] = speculation
+    
+    def cancel_speculation(self, speculation=None):
+        """取消未被采用的预发送，默认为当前的预发送"""
+        if speculation is None:
+            speculation, self.speculation = self.speculation, None
+        if speculation is not None and speculation.outcome is None:
+            self.scheduler.cancel(speculation.request_id)
+    
+    def adopt_speculation(self, speculation):
+        """用户发送的内容与预发送一致：未完成的请求转入当前对话，已完成的直接显示结果"""
+        self.spend_cap.settle(speculation.charge, 0)
+        lead = speculation.lead()
+        self.speculations.pop(speculation.request_id, None)
+        speculation.request.promote(RetryPolicy(max_attempts=self.retry_input.value() + 1))
+        if speculation.outcome is None:
+            self.scheduler.adopt(speculation.request_id, self.conversation_id, speculation.text)
+            self.statusBar().showMessage(f'已复用提前{lead:.1f}秒发出的请求，正在接收...')
+            return
+        request = speculation.request
+        self.add_message("user", speculation.prompt)
+        self.add_message("assistant", speculation.outcome[1])
+        self.update_conversation_display()
+        self.show_done_status('处理完成' + self.request_summary(request))
+    
+    def append_speculation_token(self, request_id, token):
+        speculation = self.speculations.get(request_id)
+        if speculation is not None:
+            speculation.text += token
+    
+    def finish_speculation(self, request_id, ok, text):
+        """预发送完成：成功的结果留待发送时复用，失败或被取消的直接丢弃"""
+        speculation = self.speculations.pop(request_id, None)
+        if speculation is None:
+            return
+        speculation.outcome = (ok, text)
+        self.spend_cap.settle(speculation.charge, speculation.spent_tokens())
+        if not ok and self.speculation is speculation:
+            self.speculation = None
+    
+    def start_fanout(self, group, api_key, client, stream, use_proxy, proxy_url, verify_ssl):
+        """把同一组消息并发发给对比的每个目标，替换上一次未完成的对比"""
+        self.cancel_fanout()
+        self.fanout = group
+        self.compare_panel.start(group)
+        for index, target in enumerate(group.targets):
+            target_client = client
+            if target.api_url:
+                target_client = self.get_fanout_client(target.api_url, use_proxy, proxy_url, verify_ssl)
+            target.request = self.create_request(api_key, group.messages, target.model, target_client, stream)
+            # 每个目标使用单独的队列，互不等待，各自实时输出
+            target.request_id = self.scheduler.submit(target.request, ("fanout", id(group), index))
+            self.fanout_requests[target.request_id] = (group, index)
+    
+    def get_fanout_client(self, api_url, use_proxy, proxy_url, verify_ssl):
+        """对比目标单独指定URL时使用的客户端，相同配置的目标共用连接"""
+        routes = parse_routes(api_url, use_proxy, proxy_url)
+        key = (tuple(routes), verify_ssl)
+        if key not in self.fanout_clients:
+            if len(routes) > 1:
+                self.fanout_clients[key] = EndpointPool(routes, verify_ssl)
+            else:
+                url, proxy = routes[0]
+                self.fanout_clients[key] = DeepseekClient(url, bool(proxy), proxy, verify_ssl)
+        return self.fanout_clients[key]
+    
+    def cancel_fanout(self):
+        for request_id in list(self.fanout_requests):
+            self.scheduler.cancel(request_id)
+    
+    def fanout_index(self, request_id):
+        """请求属于当前对比时返回目标序号，否则返回None"""
+        group, index = self.fanout_requests.get(request_id, (None, None))
+        return index if group is not None and group is self.fanout else None
+    
+    def append_fanout_token(self, request_id, token):
+        index = self.fanout_index(request_id)
+        if index is not None:
+            self.compare_panel.append_delta(index, token)
+    
+    def finish_fanout_target(self, request_id, ok, text):
+        index = self.fanout_index(request_id)
+        group, _ = self.fanout_requests.pop(request_id, (None, None))
+        if index is None:
+            return
+        first = group.finish(index, ok, text)
+        self.compare_panel.finish(index, group.targets[index], first,
+                                  group.conversation == self.conversation_id and group.promoted is None)
+        if group.done():
+            self.compare_panel.set_summary(group.summary_text())
+            self.stats_label.setText(format_summary(self.metrics.summary()))
+            self.statusBar().showMessage(group.summary_text())
+        elif first:
+            self.statusBar().showMessage(f"{group.targets[index].label()} 最先完成，可采用其回复，其余目标仍在生成...")
+    
+    def promote_fanout(self, index):
+        """把对比中的一个回复连同提示词写入当前对话"""
+        group = self.fanout
+        if group is None or group.promoted is not None:
+            return
+        if group.conversation != self.conversation_id:
+            self.compare_panel.disable_promotion()
+            self.statusBar().showMessage('对话已切换，无法采用该回复')
+            return
+        target = group.targets[index]
+        group.promoted = index
+        self.compare_panel.mark_promoted(index)
+        # 与普通请求一样按顺序写入：对话中还有更早的请求未送达时，等它们送达后再写入
+        request_id = self.scheduler.submit_external(target.request, self.conversation_id)
+        self.scheduler.finish_external(request_id, True, target.text)
+        if request_id in self.scheduler.in_flight(self.conversation_id):
+            self.statusBar().showMessage(f"已采用 {target.label()} 的回复，将在进行中的请求完成后写入对话")
+        else:
+            self.statusBar().showMessage(f"已采用 {target.label()} 的回复")
+    
+    def choose_attachment(self):
+        path, _ = QFileDialog.getOpenFileName(self, "附加文件", "", "文本文件 (*.txt *.log *.md *.csv *.json);;所有文件 (*)")
+        if path:
+            self.set_attachment(path)
+    
+    def set_attachment(self, path):
+        """附加或移除（path为None）本地文件；文件只在发送时按段读取"""
+        if path is not None and not os.path.isfile(path):
+            self.statusBar().showMessage(f'无法附加：{path} 不是文件')
+            return
+        self.attachment = path
+        self.remove_attachment_button.setVisible(path is not None)
+        if path is None:
+            self.attachment_label.setText("未附加文件")
+            return
+        size = os.path.getsize(path)
+        self.attachment_label.setText(f"附件：{os.path.basename(path)}（{size / 1024 / 1024:.1f} MB），"
+                                      f"发送时输入内容作为处理指令")
+        self.attachment_label.setToolTip(path)
+    
+    def attach_pasted_text(self, text):
+        """过长的粘贴内容保存为文件后作为附件，文件名由内容决定，重复粘贴同一内容时可命中各段的缓存"""
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+        os.makedirs(data_path("attachments"), exist_ok=True)
+        path = data_path(os.path.join("attachments", f"粘贴内容-{digest}.txt"))
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        self.set_attachment(path)
+        self.statusBar().showMessage(f'粘贴内容较长（{len(text)}字），已转为附件')
+    
+    def start_attachment(self, instruction, system_prompt, api_key, model_name, client):
+        """在后台把附件分段并发处理后合并；各段始终经过回复缓存，失败后再次发送会跳过已完成的段"""
+        if self.attachment_thread is not None:
+            self.statusBar().showMessage('附件仍在处理中')
+            return
+        cache = self.get_cache()
+        retry_policy = RetryPolicy(max_attempts=self.retry_input.value() + 1)
+        compress = self.compress_checkbox.isChecked()
+        
+        def make_request(messages):
+            return DeepseekRequest(api_key, messages, model_name, client, False, cache=cache,
+                                   retry_policy=retry_policy, metrics_recorder=self.metrics,
+                                   rate_limiter=self.rate_limiter, compress=compress)
+        
+        budget = self.token_budgets.get(model_name, DEFAULT_TOKEN_BUDGET)
+        job = MapReduceJob(self.attachment, instruction, make_request, system_prompt,
+                           min(DEFAULT_CHUNK_TOKENS, budget // 2), self.concurrency_input.value())
+        # 与普通请求一样在对话中排队：之后发送的请求等附件的结果写入后才显示，之前的请求也不会被插队
+        request_id = self.scheduler.submit_external(job, self.conversation_id)
+        thread = MapReduceThread(job)
+        thread.progress.connect(lambda stage, done, total: self.show_attachment_progress(request_id, stage, done, total))
+        thread.result_ready.connect(lambda text: self.scheduler.finish_external(request_id, True, text))
+        thread.error_occurred.connect(lambda message: self.attachment_failed(request_id, message))
+        thread.finished.connect(self.attachment_thread_finished)
+        self.attachment_thread = thread
+        thread.start()
+        self.set_attachment(None)
         self.input_text.clear()
+        self.statusBar().showMessage(f'正在切分附件 {job.name}...')
+    
+    def show_attachment_progress(self, request_id, stage, done, total):
+        job = self.scheduler.request(request_id)
+        if stage == "map":
+            message = f"正在处理附件 {job.name}：{done}/{total}段"
+        else:
+            message = f"正在合并各段结果：{done}/{total}"
+        if job.cached:
+            message += f"（缓存命中{job.cached}次）"
+        self.show_progress(request_id, message)
+    
+    def attachment_failed(self, request_id, message):
+        """恢复附件和指令（输入框和附件未被再次使用时），再次发送时已完成的段直接命中缓存
+
+        用户取消或离开了附件所在的对话时不恢复，以免附件出现在另一个对话的输入框中。
+        """
+        job = self.scheduler.request(request_id)
+        if message != str(RequestCancelled()) and self.is_current(request_id):
+            if self.attachment is None:
+                self.set_attachment(job.path)
+            if not self.input_text.toPlainText().strip():
+                self.input_text.setPlainText(job.instruction)
+        self.scheduler.finish_external(request_id, False, message)
+    
+    def attachment_thread_finished(self):
+        self.attachment_thread.deleteLater()
+        self.attachment_thread = None
+        self.close_idle_clients()
+    
+    def close_compare(self):
+        self.cancel_fanout()
+        self.fanout = None
+        self.compare_panel.hide()
+    
+    def cancel_requests(self):
+        """取消当前对话中所有未完成的请求"""
+        if not self.scheduler.in_flight(self.conversation_id) and not self.fanout_requests:
+            self.statusBar().showMessage('没有进行中的请求')
+            return
+        self.scheduler.cancel_conversation(self.conversation_id)
+        self.cancel_fanout()
     
-    def update_output(self, result):
-        self.message_history.append({"role": "assistant", "content": result})
+    def change_backend(self, index):
+        name = self.backend_selector.itemData(index)
+        try:
+            self.scheduler.set_backend(name)
+        except DeepseekError as e:
+            # 后端不可用时恢复为当前使用的后端
+            self.backend_selector.blockSignals(True)
+            self.backend_selector.setCurrentIndex(self.backend_selector.findData(self.scheduler.backend_name))
+            self.backend_selector.blockSignals(False)
+            self.statusBar().showMessage(str(e))
+            return
+        self.statusBar().showMessage(f"执行后端已切换为 {BACKENDS[name]}")
+    
+    def is_current(self, request_id):
+        return self.scheduler.conversation_of(request_id) == self.conversation_id
+    
+    def start_turn(self, request_id):
+        """请求轮到展示时写入对应的用户消息"""
+        if not self.is_current(request_id):
+            return
+        self.add_message("user", self.turn_prompt(self.scheduler.request(request_id)))
         self.update_conversation_display()
-        self.statusBar().showMessage('处理完成')
+    
+    def turn_prompt(self, request):
+        """写入对话的用户消息：附件为文件名加处理指令，其他请求为最后一条消息"""
+        if isinstance(request, MapReduceJob):
+            return f"[附件 {request.name}] {request.instruction}"
+        return request.messages[-1]["content"]
+    
+    def get_client(self, api_url, use_proxy, proxy_url, verify_ssl):
+        """返回共享客户端，仅在API URL、代理、SSL设置或并发上限变化时重建
+
+        URL或代理填写了多个时，使用在各线路间自动选择和切换的EndpointPool。
+        """
+        routes = parse_routes(api_url, use_proxy, proxy_url)
+        pool_size = self.pool_size()
+        if self.client is None or self.client_config != (routes, verify_ssl, pool_size):
+            # 旧客户端可能仍被未完成的请求使用，先停止后台探测，等这些请求结束后再关闭
+            if isinstance(self.client, EndpointPool):
+                self.client.stop()
+            if self.client is not None:
+                self.retired_clients.append(self.client)
+            self.client = create_client(routes, verify_ssl, pool_size, on_change=self.endpoints_changed.emit)
+            self.client_config = (routes, verify_ssl, pool_size)
+            self.show_endpoints()
+            self.close_idle_clients()
+        return self.client
+    
+    def close_idle_clients(self, finished=None):
+        """关闭已被替换、且不再被进行中的请求使用的客户端，释放其连接池
+
+        finished是正在送达结果的请求，它已经执行完毕。附件处理中的请求不经过调度器，处理结束前不关闭。
+        """
+        if not self.retired_clients or self.attachment_thread is not None:
+            return
+        in_use = []
+        for request_id in self.scheduler.in_flight():
+            request = self.scheduler.request(request_id)
+            if request_id != finished and isinstance(request, DeepseekRequest):
+                in_use.append(request.client)
+        for client in [client for client in self.retired_clients if client not in in_use]:
+            self.retired_clients.remove(client)
+            client.close()
+    
+    def pool_size(self):
+        """每个端点保持的连接数不少于并发上限，否则超出的连接用完即被丢弃，每次请求都要重新握手"""
+        return max(10, self.concurrency_input.value())
+    
+    def show_endpoints(self):
+        """在状态栏右侧显示各端点的延迟和熔断状态"""
+        if not isinstance(self.client, EndpointPool):
+            self.endpoint_label.hide()
+            return
+        self.endpoint_label.setText(self.client.status_text())
+        self.endpoint_label.setToolTip(self.client.errors_text() or "所有端点均正常")
+        self.endpoint_label.show()
+    
+    def get_cache(self):
+        if self.response_cache is None:
+            self.response_cache = ResponseCache()
+        return self.response_cache
+    
+    def update_output(self, request_id, result):
+        if not self.is_current(request_id):
+            return
+        request = self.scheduler.request(request_id)
+        self.add_message("assistant", result)
+        if self.renderer.reply_open:
+            # 流式回复已经显示在界面上
+            self.renderer.end_reply(self.message_history)
+        else:
+            self.update_conversation_display()
+        if isinstance(request, MapReduceJob):
+            self.show_done_status(f'附件处理完成，共{request.requests}次请求，缓存命中{request.cached}次')
+        elif request.from_cache:
+            self.show_done_status('处理完成（缓存命中）')
+        else:
+            self.show_done_status('处理完成' + self.request_summary(request))
+    
+    def show_retry(self, request_id, attempt, delay, reason):
+        self.show_progress(request_id, f"第{attempt}次请求失败（{reason}），{delay:.1f}秒后重试...")
+    
+    def show_quota_wait(self, request_id, delay):
+        self.show_progress(request_id, f"已达到限速配额，排队等待{delay:.1f}秒后发送...")
+    
+    def show_progress(self, request_id, message):
+        """当前对话的请求显示在状态栏，对比中的请求显示在对应目标下方"""
+        if self.is_current(request_id):
+            self.statusBar().showMessage(message)
+        elif self.fanout_index(request_id) is not None:
+            self.compare_panel.set_status(self.fanout_index(request_id), message)
+    
+    def request_summary(self, request):
+        if isinstance(request, MapReduceJob):
+            return f"（已发送{request.requests}次请求）"
+        parts = []
+        if request.prefetched:
+            parts.append("预发送命中")
+        if request.attempts > 1:
+            parts.append(f"共尝试{request.attempts}次，等待{request.total_wait:.1f}秒")
+        if request.queue_wait:
+            parts.append(f"排队等待配额{request.queue_wait:.1f}秒")
+        usage = request.usage or {}
+        if usage.get("prompt_cache_hit_tokens") is not None and usage.get("prompt_tokens"):
+            parts.append(f"前缀缓存命中{usage['prompt_cache_hit_tokens']}/{usage['prompt_tokens']} tokens")
+        return f"（{'，'.join(parts)}）" if parts else ""
+    
+    def export_metrics(self):
+        path, _ = QFileDialog.getSaveFileName(self, "导出请求统计", "deepseek_metrics.csv",
+                                              "CSV 文件 (*.csv);;JSONL 文件 (*.jsonl)")
+        if not path:
+            return
+        count = self.metrics.export(path)
+        self.statusBar().showMessage(f"已导出{count}条请求统计到 {path}")
+    
+    def show_done_status(self, message):
+        self.stats_label.setText(format_summary(self.metrics.summary()))
+        # 当前请求的结果尚未从调度器移除，因此减去1
+        remaining = len(self.scheduler.in_flight(self.conversation_id)) - 1
+        if remaining > 0:
+            message += f"，仍有{remaining}个请求进行中"
+        self.statusBar().showMessage(message)
+    
+    def append_stream_token(self, request_id, token):
+        """流式模式下把增量文本直接追加到输出区域末尾"""
+        if not self.is_current(request_id):
+            return
+        if not self.renderer.reply_open:
+            self.statusBar().showMessage('正在接收...')
+        self.renderer.append_delta(token)
     
     def update_conversation_display(self):
-        """更新对话显示区域，展示完整的对话历史"""
-        self.output_text.clear()
-        for message in self.message_history:
-            role = "用户" if message["role"] == "user" else "DeepSeek"
-            # 过滤系统提示词不显示在对话历史中
-            if message["role"] != "system":
-                self.output_text.append(f"【{role}】: {message['content']}\n")
-    
-    def handle_error(self, error_message):
-        self.output_text.append(f"\n错误: {error_message}")
-        self.statusBar().showMessage('发生错误')
\ No newline at end of file
+        """更新对话显示区域，只追加尚未显示的消息"""
+        self.renderer.render_new(self.message_history)
+    
+    def handle_error(self, request_id, error_message):
+        if not self.is_current(request_id):
+            return
+        self.renderer.append_text(f"\n错误: {error_message}\n")
+        self.show_done_status('发生错误' + self.request_summary(self.scheduler.request(request_id)))
+    
+    def enable_diagnostics(self):
+        from diagnostics import Profiler
+        self.profiler = Profiler()
+        self.watchdog.state_provider = self.diagnostic_state
+        self.watchdog.stall_detected.connect(self.show_stall)
+        QShortcut(QKeySequence("Ctrl+Shift+P"), self, self.toggle_profiler)
+    
+    def diagnostic_state(self):
+        """卡顿日志中记录的当前状态"""
+        document = self.output_text.document()
+        lines = [f"当前对话: 内存中{len(self.message_history)}条消息，"
+                 f"输出区{document.blockCount()}段/{document.characterCount()}字符"]
+        in_flight = self.scheduler.in_flight()
+        lines.append(f"进行中的请求: {len(in_flight)}个（{BACKENDS[self.scheduler.backend_name]}）")
+        if isinstance(self.client, EndpointPool):
+            lines.append(self.client.status_text())
+        for request_id in in_flight:
+            request = self.scheduler.request(request_id)
+            if request is None:
+                lines.append(f"  #{request_id} 等待前一条回复送达后发送")
+                continue
+            if isinstance(request, MapReduceJob):
+                lines.append(f"  #{request_id} 附件 {request.name} 已完成{request.requests}次请求")
+                continue
+            lines.append(f"  #{request_id} {request.model_name} {'流式' if request.stream else '非流式'} "
+                         f"第{request.attempts}次尝试 已用{request.metrics.elapsed():.1f}s")
+        return "\n".join(lines)
+    
+    def show_stall(self, seconds, log_path):
+        self.statusBar().showMessage(f'检测到界面卡顿 {seconds * 1000:.0f} ms，详情见 {log_path}')
+    
+    def toggle_profiler(self):
+        path = self.profiler.toggle()
+        if path is None:
+            self.statusBar().showMessage('性能分析已开始，再按 Ctrl+Shift+P 停止并保存')
+        else:
+            self.statusBar().showMessage(f'性能分析已保存到 {path}')
+    
+    def closeEvent(self, event):
+        # 关闭窗口时中断所有请求，避免线程池等待长时间的读取
+        self.scheduler.shutdown()
+        if self.attachment_thread is not None:
+            self.attachment_thread.cancel()
+            self.attachment_thread.wait()
+        self.search_generation += 1
+        self.search_executor.shutdown(wait=True)
+        if self.search_reader is not None:
+            self.search_reader.close()
+        self.store.close()
+        self.rate_limiter.close()
+        for client in [self.client, *self.retired_clients, *self.fanout_clients.values()]:
+            if client is not None:
+                client.close()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        super().closeEvent(event)
\ No newline at end of file
@@ -0,0 +1,24 @@
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtWidgets import QTextEdit
+
+LARGE_PASTE_CHARS = 200000  # 超过该长度的粘贴内容转为附件，不插入输入框
+
+
+class PromptEdit(QTextEdit):
+    """输入框：粘贴或拖入整份日志、文档时不插入文本，改为发出large_paste信号，由窗口作为附件处理"""
+    large_paste = pyqtSignal(str)
+    files_dropped = pyqtSignal(list)  # 拖入的本地文件路径
+
+    def canInsertFromMimeData(self, source):
+        return source.hasUrls() or super().canInsertFromMimeData(source)
+
+    def insertFromMimeData(self, source):
+        if source.hasUrls() and all(url.isLocalFile() for url in source.urls()):
+            self.files_dropped.emit([url.toLocalFile() for url in source.urls()])
+            return
+        if source.hasText():
+            text = source.text()
+            if len(text) > LARGE_PASTE_CHARS:
+                self.large_paste.emit(text)
+                return
+        super().insertFromMimeData(source)